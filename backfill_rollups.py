@@ -0,0 +1,121 @@
+"""
+Build the minute, hour and day price rollups from existing price_history.
+
+price_history is streamed once in product and time order, and every bucket is
+replaced with the rollup of its documents, so the command can be re-run safely,
+e.g. after reextract.py has changed stored prices.
+
+Usage:
+    python backfill_rollups.py
+    python backfill_rollups.py --product amazon.com:B0D3JLHQ8K --start 2025-01-01
+"""
+import json
+import logging
+import argparse
+import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+from config import ROLLUP_RESOLUTIONS, LOG_LEVEL, LOG_FORMAT
+from src.mongodb_handler import mongodb_handler, ROLLUP_COLLECTION_NAME
+from src.rollups import RESOLUTIONS, iter_rollups
+from src.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def _start_of_day(value):
+    return RESOLUTIONS["day"](value)
+
+
+def backfill_rollups(product_id=None, start=None, end=None, resolutions=ROLLUP_RESOLUTIONS, batch_size=1000):
+    """
+    Rebuild rollups from price_history.
+
+    The range is widened to whole days so no bucket is rebuilt from part of its
+    documents. Buckets in the range are deleted first, so ones that no longer
+    have any documents disappear.
+
+    Args:
+        product_id (str, optional): Only this product
+        start (datetime, optional): Only history at or after this day
+        end (datetime, optional): Only history before this day, the start of today if not given
+        resolutions (tuple): Resolutions to build
+        batch_size (int): Rollups per bulk write
+
+    Returns:
+        dict: Counts of documents read and rollups written
+    """
+    if not mongodb_handler.is_connected and not mongodb_handler.connect():
+        raise ConnectionError("MongoDB is not reachable")
+
+    # Today's buckets are still being merged into by the tracker, so they are left alone unless asked for
+    if end is None:
+        end = _start_of_day(datetime.datetime.now())
+    elif end != _start_of_day(end):
+        end = _start_of_day(end) + datetime.timedelta(days=1)
+    query = {"price_numeric": {"$ne": None}, "timestamp": {"$lt": end}}
+    rollup_query = {"resolution": {"$in": list(resolutions)}, "bucket": {"$lt": end}}
+    if start is not None:
+        query["timestamp"]["$gte"] = rollup_query["bucket"]["$gte"] = _start_of_day(start)
+    if product_id is not None:
+        query["product_id"] = rollup_query["product_id"] = product_id
+
+    rollups = mongodb_handler.db[ROLLUP_COLLECTION_NAME]
+    deleted = rollups.delete_many(rollup_query).deleted_count
+    summary = {"documents": 0, "rollups": 0, "deleted": deleted}
+
+    def counted(cursor):
+        for document in cursor:
+            summary["documents"] += 1
+            yield document
+
+    # Product descending and time ascending walks the (product_id, timestamp desc) index backwards
+    cursor = mongodb_handler.collection.find(
+        query,
+        {"_id": 0, "product_id": 1, "timestamp": 1, "price_numeric": 1, "discount": 1, "rating": 1},
+        sort=[("product_id", DESCENDING), ("timestamp", ASCENDING)],
+        batch_size=10000,
+    )
+    batch = []
+    for bucket in iter_rollups(counted(cursor), resolutions):
+        batch.append(bucket.replace_operation())
+        if len(batch) >= batch_size:
+            rollups.bulk_write(batch, ordered=False)
+            summary["rollups"] += len(batch)
+            batch = []
+    if batch:
+        rollups.bulk_write(batch, ordered=False)
+        summary["rollups"] += len(batch)
+
+    logger.info("Rollups rebuilt", extra=summary)
+    return summary
+
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Build price rollups from existing price_history.")
+    parser.add_argument("--product", help="Only rebuild this product ('<marketplace>:<ASIN>')")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat, help="Only history from this day on")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat,
+                        help="Only history before this day (default: today, whose buckets the tracker is still updating)")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(ROLLUP_RESOLUTIONS),
+                        help="Resolutions to build")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rollups per bulk write")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="Minimum log level, e.g. DEBUG or INFO")
+    parser.add_argument("--log-format", default=LOG_FORMAT, choices=["text", "json"],
+                        help="Log lines as key=value text or as JSON objects")
+    return parser.parse_args()
+
+
+def main(args):
+    """
+    Entry point of the script.
+    """
+    configure_logging(args.log_level, args.log_format)
+    summary = backfill_rollups(args.product, args.start, args.end, tuple(args.resolutions), args.batch_size)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main(parse_args())
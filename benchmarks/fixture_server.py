@@ -0,0 +1,121 @@
+import os
+import re
+import time
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Product page fixtures, served at /<variant>/dp/<ASIN>
+PRODUCT_VARIANTS = ("product_complete", "product_missing_name", "product_missing_price")
+
+_PRODUCT_PATH = re.compile(r"^/(?P<variant>[a-z_]+)/dp/(?P<asin>[A-Z0-9]{10})")
+_STATIC_TYPES = {
+    "/static/": ("text/javascript", b"/* fixture asset */\n" * 256),
+    "/images/": ("image/jpeg", b"\xff\xd8\xff\xe0" + b"\0" * 16 * 1024),
+    "/media/": ("video/mp4", b"\0" * 64 * 1024),
+}
+
+
+def load_fixture(name):
+    """Read a fixture file."""
+    with open(os.path.join(FIXTURES_DIR, name), mode="r", encoding="utf-8") as file:
+        return file.read()
+
+
+class FixtureServer:
+    """
+    Local HTTP server that serves recorded Amazon pages.
+
+    Product pages are served at /<variant>/dp/<ASIN> for every name in
+    PRODUCT_VARIANTS, search result pages at /s?k=<query>&page=<n> (pages past
+    `result_pages` show the "No results" page), and the images, scripts and
+    media the pages reference at /images/, /static/ and /media/. Every response
+    is delayed by `latency` seconds to stand in for the network.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, result_pages=2):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.result_pages = result_pages
+        self.requests = Counter()
+        self._pages = {name: load_fixture(f"{name}.html").encode("utf-8") for name in PRODUCT_VARIANTS}
+        self._search_page = load_fixture("search_results.html").encode("utf-8")
+        self._no_results_page = load_fixture("search_no_results.html").encode("utf-8")
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def product_url(self, variant, asin):
+        """URL of a product page fixture."""
+        return f"{self.base_url}/{variant}/dp/{asin}"
+
+    def search_url(self, query="laptop"):
+        """Search results URL with the {page_number} placeholder the crawler fills in."""
+        return f"{self.base_url}/s?k={query}&page={{page_number}}"
+
+    def _route(self, path):
+        """Return (status, content type, body, request kind) for a request path."""
+        url = urlsplit(path)
+        match = _PRODUCT_PATH.match(url.path)
+        if match and match.group("variant") in self._pages:
+            return 200, "text/html; charset=utf-8", self._pages[match.group("variant")], "product"
+
+        if url.path == "/s":
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            if page <= self.result_pages:
+                return 200, "text/html; charset=utf-8", self._search_page, "search"
+            return 200, "text/html; charset=utf-8", self._no_results_page, "search"
+
+        for prefix, (content_type, body) in _STATIC_TYPES.items():
+            if url.path.startswith(prefix):
+                return 200, content_type, body, prefix.strip("/")
+
+        return 404, "text/plain", b"Not found", "missing"
+
+    def start(self):
+        """Start serving in a background thread."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, content_type, body, kind = server._route(self.path)
+                server.requests[kind] += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,470 @@
+"""
+Offline benchmarks for the price tracker.
+
+Serves recorded Amazon pages from a local HTTP server and drives the
+extraction, search crawl, storage and price analysis paths against them, with
+MongoDB replaced by mongomock or a local mongod and LLM calls answered from
+recorded responses. Results are written as JSON so runs of different versions
+can be compared.
+
+Usage:
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --compare bench.json --output bench-new.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import datetime
+import tempfile
+import resource
+import subprocess
+import contextlib
+
+from benchmarks.fixture_server import FixtureServer, PRODUCT_VARIANTS, load_fixture
+
+# Search results container of the fixture pages
+SEARCH_CSS_SELECTOR = "div[data-component-type='s-search-result']"
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of a list of numbers with linear interpolation."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies, elapsed, unit="ops"):
+    """Summarize call latencies (seconds) and the wall time of a benchmark."""
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        f"{unit}_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+async def timed_gather(calls, concurrency):
+    """
+    Run coroutine factories with at most `concurrency` in flight.
+
+    Returns:
+        tuple: (results, latencies in seconds, wall time in seconds)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run(call):
+        async with semaphore:
+            start = time.perf_counter()
+            result = await call()
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(call) for call in calls))
+    return results, latencies, time.perf_counter() - start
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class BrowserMemorySampler:
+    """Samples the RSS of each browser of a pool while a benchmark runs."""
+
+    def __init__(self, pool, interval=0.2):
+        self.pool = pool
+        self.interval = interval
+        self.peak_mb = None
+        self._task = None
+
+    async def _run(self):
+        while True:
+            for rss_mb in self.pool.browser_rss_mb():
+                self.peak_mb = max(self.peak_mb or 0.0, rss_mb)
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+
+    def per_browser_mb(self):
+        if self.peak_mb is None:
+            return None
+        return round(self.peak_mb, 1)
+
+
+def build_recorded_llm_service(latency):
+    """
+    Return an LLM extraction service that answers from the recorded responses.
+
+    The service keeps the batching and coalescing of the real one; only the
+    provider call is replaced by a lookup keyed by the exact region the LLM is given.
+    """
+    from src.llm_cache import content_hash
+    from src.llm_service import LLMExtractionService
+    from src.price_extractor import name_region
+    from src.scraper import region_to_text
+
+    with open(os.path.join(os.path.dirname(__file__), "fixtures", "recorded_llm_responses.json"),
+              mode="r", encoding="utf-8") as file:
+        recorded = json.load(file)
+
+    responses = {
+        content_hash(name_region(load_fixture("product_missing_name.html"))): recorded["product_missing_name.html"],
+        content_hash(region_to_text(load_fixture("search_results.html"), SEARCH_CSS_SELECTOR)):
+            recorded["search_results.html"],
+    }
+
+    class RecordedLLMService(LLMExtractionService):
+        async def _send(self, group_key, batch):
+            self.calls += 1
+            if latency:
+                await asyncio.sleep(latency)
+            for request in batch:
+                response = responses.get(content_hash(request.content))
+                if response is None:
+                    request.future.set_exception(KeyError("No recorded LLM response for this document"))
+                else:
+                    request.future.set_result(response)
+
+    return RecordedLLMService()
+
+
+def connect_mongodb(uri):
+    """Connect the shared MongoDB handler to a local mongod, or to mongomock without a URI."""
+    from src.mongodb_handler import mongodb_handler
+
+    if uri:
+        connected = mongodb_handler.connect(uri=uri)
+    else:
+        import mongomock
+        connected = mongodb_handler.connect(client=mongomock.MongoClient())
+        # mongomock does not implement the update pipelines the rollup merge relies on
+        mongodb_handler.rollups_enabled = False
+    if not connected:
+        raise RuntimeError("Could not connect the benchmark MongoDB")
+    return mongodb_handler
+
+
+def bench_parse_product_html(iterations):
+    """CPU cost of parsing each product fixture."""
+    from src.price_extractor import parse_product_html
+
+    results = {}
+    for variant in PRODUCT_VARIANTS:
+        html = load_fixture(f"{variant}.html")
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            parse_product_html(html)
+            latencies.append(time.perf_counter() - call_start)
+        results[variant] = summarize(latencies, time.perf_counter() - start, unit="pages")
+    return results
+
+
+async def bench_extract_http(server, products, concurrency):
+    """extract_product_price over the pooled HTTP fast path."""
+    from src.price_extractor import extract_product_price
+
+    urls = [server.product_url("product_complete", asin) for asin in products]
+    results, latencies, elapsed = await timed_gather(
+        [lambda url=url: extract_product_price(url) for url in urls], concurrency
+    )
+    summary = summarize(latencies, elapsed, unit="pages")
+    summary["prices_found"] = sum(1 for result in results if result[0] is not None)
+    return summary
+
+
+async def bench_extract_browser(server, products, concurrency, profile):
+    """Product extraction through the browser pool, across every fixture variant."""
+    from src.browser_pool import get_browser_pool
+    from src.price_extractor import extract_product_data
+
+    pool = get_browser_pool(profile)
+    server.requests.clear()
+    calls = [
+        lambda url=server.product_url(variant, asin): extract_product_data(
+            url, product_id=url, fast_path=False, browser_profile=profile
+        )
+        for asin in products
+        for variant in PRODUCT_VARIANTS
+    ]
+
+    async with BrowserMemorySampler(pool) as sampler:
+        results, latencies, elapsed = await timed_gather(calls, concurrency)
+
+    summary = summarize(latencies, elapsed, unit="pages")
+    summary["prices_found"] = sum(1 for result in results if result["price_value"] is not None)
+    summary["peak_rss_mb_per_browser"] = sampler.per_browser_mb()
+    summary["subresource_requests"] = {
+        kind: count for kind, count in server.requests.items() if kind not in ("product", "search")
+    }
+    return summary
+
+
+async def bench_search_pages(server, iterations, profile, llm_service):
+    """fetch_and_process_page over every result page of a search, including the no-results page."""
+    from config import SCRAPER_INSTRUCTIONS
+    from models.product import ProductData
+    from src.browser_pool import get_browser_pool
+    from src.browser_profiles import get_browser_profile
+    from src.dedup import ProductDeduplicator
+    from src.llm_service import BatchedLLMExtraction
+    from src.scraper import fetch_and_process_page
+
+    strategy = BatchedLLMExtraction(SCRAPER_INSTRUCTIONS, ProductData, service=llm_service)
+    browser_profile = get_browser_profile(profile)
+    search_url = server.search_url()
+    latencies = []
+    products_found = 0
+
+    start = time.perf_counter()
+    async with get_browser_pool(profile).lease() as lease:
+        for iteration in range(iterations):
+            deduplicator = ProductDeduplicator()
+            for page_number in range(1, server.result_pages + 2):
+                call_start = time.perf_counter()
+                businesses, _ = await fetch_and_process_page(
+                    lease.crawler, page_number, search_url, SEARCH_CSS_SELECTOR, strategy,
+                    lease.session(f"_bench_{iteration}_{page_number}"), deduplicator, browser_profile,
+                )
+                latencies.append(time.perf_counter() - call_start)
+                products_found += len(businesses)
+            deduplicator.close()
+
+    summary = summarize(latencies, time.perf_counter() - start, unit="pages")
+    summary["products_found"] = products_found
+    return summary
+
+
+async def bench_storage(records, products):
+    """save_price_record throughput, including draining the MongoDB write queue."""
+    from src.data_storage import save_price_record, local_history_store
+    from src.write_pipeline import mongo_write_pipeline
+
+    base_time = datetime.datetime.now()
+    latencies = []
+    start = time.perf_counter()
+    for index in range(records):
+        product_id = f"amazon.com:{products[index % len(products)]}"
+        price = 400.0 + (index % 7) * 5
+        call_start = time.perf_counter()
+        await save_price_record(
+            price, f"${price:.2f}", "Benchmark product", "-5%", "4.3", "1,234",
+            base_time + datetime.timedelta(seconds=index), product_id=product_id, bought_30_days="1K+",
+        )
+        latencies.append(time.perf_counter() - call_start)
+    await mongo_write_pipeline.close()
+    await asyncio.to_thread(local_history_store.close)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(latencies, elapsed, unit="records")
+    summary["mongodb_written"] = mongo_write_pipeline.written
+    summary["mongodb_failed"] = mongo_write_pipeline.failed
+    summary["local_history_format"] = local_history_store.format
+    return summary
+
+
+def bench_price_change(products, iterations):
+    """check_price_change latency for the first (storage read) and later (cached) lookups."""
+    from src.price_analyzer import check_price_change
+
+    cold, warm = [], []
+    start = time.perf_counter()
+    for iteration in range(iterations):
+        for asin in products:
+            call_start = time.perf_counter()
+            check_price_change(420.0, product_id=f"amazon.com:{asin}")
+            (cold if iteration == 0 else warm).append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return {
+        "first_lookup": summarize(cold, elapsed, unit="checks"),
+        "cached_lookup": summarize(warm, elapsed, unit="checks"),
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(args):
+    """Run every benchmark and return the results."""
+    from src.logging_config import configure_logging
+    configure_logging("DEBUG" if args.verbose else "WARNING")
+
+    work_dir = tempfile.mkdtemp(prefix="price-tracker-bench-")
+
+    # Keep caches and history of the run out of the working tree
+    from src.llm_cache import llm_cache
+    from src.data_storage import local_history_store
+    llm_cache.path = os.path.join(work_dir, "llm_cache.sqlite3")
+    local_history_store.csv_filename = os.path.join(work_dir, "competitor_history.csv")
+    local_history_store.directory = os.path.join(work_dir, "history")
+
+    import src.price_extractor as price_extractor
+    llm_service = build_recorded_llm_service(args.llm_latency)
+    price_extractor.llm_service = llm_service
+
+    # The fixture host stands in for Amazon, so the lean profile has to treat it as first party
+    from config import LEAN_FIRST_PARTY_HOST_PATTERN
+    from src.browser_profiles import BROWSER_PROFILES, BrowserProfile
+    lean = BROWSER_PROFILES["lean"]
+    BROWSER_PROFILES["lean_fixture"] = BrowserProfile(
+        "lean_fixture",
+        blocked_resource_types=lean.blocked_resource_types,
+        first_party_host_pattern=rf"^127\.0\.0\.1$|{LEAN_FIRST_PARTY_HOST_PATTERN}",
+        blocked_url_patterns=lean.blocked_url_patterns,
+        wait_until=lean.wait_until,
+        wait_for_selector=lean.wait_for_selector,
+        page_timeout=lean.page_timeout,
+        verbose=False,
+    )
+
+    connect_mongodb(args.mongo_uri)
+
+    products = [f"B{index:09d}" for index in range(args.products)]
+    results = {}
+    with FixtureServer(latency=args.server_latency, result_pages=args.result_pages) as server:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            results["parse_product_html"] = bench_parse_product_html(args.iterations)
+            results["extract_product_price_http"] = await bench_extract_http(server, products, args.concurrency)
+
+            if not args.skip_browser:
+                from src.browser_pool import close_browser_pools
+                try:
+                    for profile in ("lean_fixture", "full"):
+                        results[f"extract_product_browser_{profile}"] = await bench_extract_browser(
+                            server, products, args.concurrency, profile
+                        )
+                        results[f"fetch_and_process_page_{profile}"] = await bench_search_pages(
+                            server, args.search_iterations, profile, llm_service
+                        )
+                finally:
+                    await close_browser_pools()
+
+            results["save_price_record"] = await bench_storage(args.records, products)
+            results["check_price_change"] = bench_price_change(products, args.iterations)
+
+        from src.http_fetcher import http_fetcher
+        await http_fetcher.close()
+
+    from src.metrics import metrics
+    results["llm"] = llm_service.stats()
+    results["stages"] = metrics.stage_seconds.to_dict()
+    results["peak_rss_mb"] = peak_rss_mb()
+    return {
+        "version": git_version(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mongodb": "local" if args.mongo_uri else "mongomock",
+        "settings": {
+            key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")
+        },
+        "results": results,
+    }
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def compare_results(baseline, current, tolerance):
+    """
+    Compare two benchmark runs.
+
+    Latencies that grew and throughputs that dropped by more than `tolerance`
+    (a fraction) count as regressions.
+
+    Returns:
+        list: Human readable regression descriptions
+    """
+    previous = dict(_flatten(baseline["results"]))
+    regressions = []
+    for metric, value in _flatten(current["results"]):
+        old = previous.get(metric)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+            continue
+        change = (value - old) / old
+        if metric.endswith(("p50_ms", "p99_ms")) and change > tolerance:
+            regressions.append(f"{metric}: {old} -> {value} ({change:+.1%})")
+        elif metric.endswith("_per_second") and -change > tolerance:
+            regressions.append(f"{metric}: {old} -> {value} ({change:+.1%})")
+    return regressions
+
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Run the offline price tracker benchmarks.")
+    parser.add_argument("--output", default="bench.json", help="File the JSON results are written to")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Relative change counted as a regression when comparing")
+    parser.add_argument("--mongo-uri", help="Local mongod to write to instead of mongomock")
+    parser.add_argument("--products", type=int, default=20, help="Number of distinct products")
+    parser.add_argument("--records", type=int, default=5000, help="Price records written by the storage benchmark")
+    parser.add_argument("--iterations", type=int, default=200, help="Iterations of the in-process benchmarks")
+    parser.add_argument("--search-iterations", type=int, default=5, help="Search crawls per browser profile")
+    parser.add_argument("--result-pages", type=int, default=2, help="Search pages before the no-results page")
+    parser.add_argument("--concurrency", type=int, default=4, help="Extractions running at the same time")
+    parser.add_argument("--server-latency", type=float, default=0.0, help="Delay of every fixture response in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Delay of every recorded LLM call in seconds")
+    parser.add_argument("--skip-browser", action="store_true", help="Skip the benchmarks that need Chromium")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the benchmarked code")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run_benchmarks(args))
+
+    with open(args.output, mode="w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, mode="r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare_results(baseline, report, args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.compare} ({baseline.get('version')}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare} ({baseline.get('version')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,103 +1,387 @@
+import sys
+import json
 import asyncio
-from dotenv import load_dotenv
+import logging
+import argparse
+import datetime
 
 from config import (
     BASE_URL, PRICE_SELECTOR, PRODUCT_NAME_SELECTOR, DISCOUNT_SELECTOR,
-    NUM_OF_BOUGHT_IN_30_DAYS_SELECTOR, RATING_SELECTOR, NUM_OF_RATINGS
+    NUM_OF_BOUGHT_IN_30_DAYS_SELECTOR, RATING_SELECTOR, NUM_OF_RATINGS,
+    WATCHLIST_FILE, TRACKER_CONCURRENCY, LOG_LEVEL, LOG_FORMAT, METRICS_PORT, METRICS_JSON_PATH,
+    SNAPSHOT_STORE_ENABLED, ADAPTIVE_POLLING, WORK_QUEUE_BACKEND, ALERTS_ENABLED, ALERT_RULES_FILE,
+    ALERT_DEFAULT_RULES
 )
-from src.price_extractor import extract_product_price
-from src.data_storage import save_price_to_mongodb, CSV_FILENAME
+from src.data_storage import save_price_record, flush_pending_heartbeats, flush_price_records, local_history_store
 from src.price_analyzer import check_price_change
 from src.mongodb_handler import mongodb_handler
+from src.write_pipeline import mongo_write_pipeline
+from src.price_cache import price_state_cache
+from src.snapshot_store import snapshot_store
+from src.polling_policy import polling_policy
+from src.scheduler import WatchedProduct, TrackingScheduler, load_watchlist_file, load_watchlist_from_mongodb
+from src.work_queue import get_work_queue
+from src.quote_service import QuoteService
+from src.alerts import (
+    alert_engine, alert_dispatcher, parse_rules, load_alert_rules_file, load_alert_rules_from_mongodb,
+    refresh_alert_rules
+)
+from src.worker import TrackingWorker, run_coordinator
+from src.metrics import metrics, MetricsServer
+from src.logging_config import configure_logging
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Configuration for price tracking
 TRACKING_INTERVAL = 10  # seconds
 
-# Initialize MongoDB connection
-mongodb_handler.connect()
 
-async def track_price(single_run=False):
+async def check_product(product):
+    """
+    Extract, store and analyze the current price of one product.
+    
+    The records are queued for batched writing; callers outside the tracker
+    loop use quote_once(), which also delivers the fired alerts and closes the
+    browsers and sessions before their event loop ends.
+    
+    Args:
+        product (WatchedProduct): The product to check
+        
+    Returns:
+        dict: The extracted data keyed by product, or an error entry
+    """
+    with metrics.time_stage("product_check") as run:
+        result = await _check_product(product)
+        run.failed = "error" in result
+    return result
+
+
+async def _check_product(product):
+    # Imported by the first check, so commands that never crawl do not load crawl4ai, BeautifulSoup and pydantic
+    from src.price_extractor import extract_product_data
+    
+    data = await extract_product_data(
+        product.url, product_id=product.product_id, browser_profile=product.browser_profile
+    )
+    timestamp = data["timestamp"]
+    price_value = data["price_value"]
+    price_string = data["price_string"]
+    
+    if price_string == "Not available":
+        logger.warning("Failed to extract price", extra={"product_id": product.product_id})
+        return {
+            "product_id": product.product_id,
+            "error": "Failed to extract price",
+            "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    logger.info("Price checked", extra={
+        "product_id": product.product_id, "product_name": data["product_name"], "price": price_string,
+        "discount": data["discount"], "rating": data["rating"], "num_ratings": data["num_ratings"],
+        "fetch_path": data["fetch_path"],
+    })
+    
+    # Save to CSV and queue the MongoDB write off the crawl path
+    await save_price_record(
+        price_value, price_string, data["product_name"], data["discount"],
+        data["rating"], data["num_ratings"], timestamp,
+        product_id=product.product_id, bought_30_days=data["bought_30_days"],
+        snapshot_id=data["snapshot_id"]
+    )
+    
+    # Check for significant price change
+    has_changed = False
+    if price_value is not None:
+        has_changed, _ = check_price_change(price_value, product_id=product.product_id)
+    
+    # Evaluate the product's alert rules and hand the ones that fired to the sinks
+    alert_dispatcher.submit(alert_engine.observe({
+        "product_id": product.product_id, "product_name": data["product_name"], "url": product.url,
+        "price_numeric": price_value, "discount": data["discount"], "rating": data["rating"],
+        "timestamp": timestamp,
+    }))
+    
+    return {
+        "product_id": product.product_id,
+        "product_name": data["product_name"],
+        "price": price_string,
+        "price_numeric": price_value,
+        "discount": data["discount"],
+        "rating": data["rating"],
+        "num_ratings": data["num_ratings"],
+        "fetch_path": data["fetch_path"],
+        "price_changed": has_changed,
+        "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+# Serves single-run quotes, sharing checks between concurrent callers. Each check's records are
+# written before its quote is returned, since a single-run caller may end its event loop right away.
+quote_service = QuoteService(check_product, flush=flush_price_records)
+
+# Single-run quotes in progress
+_single_runs = 0
+
+
+async def close_shared_clients():
+    """Close the warm browsers, HTTP session and LLM sends that checks opened, if any."""
+    if "src.llm_service" in sys.modules:
+        await sys.modules["src.llm_service"].llm_service.close()
+    if "src.browser_pool" in sys.modules:
+        await sys.modules["src.browser_pool"].close_browser_pools()
+    if "src.http_fetcher" in sys.modules:
+        await sys.modules["src.http_fetcher"].http_fetcher.close()
+
+
+async def quote_once(product, max_staleness=None):
+    """
+    Quote a product for a caller that may end its event loop right after.
+    
+    Once the last concurrent single-run quote is done, the alerts its checks
+    fired are delivered and the browsers, HTTP session and LLM service are
+    closed, so nothing is left bound to a loop that is about to end. The next
+    quote starts them again; quotes themselves stay cached.
+    """
+    global _single_runs
+    _single_runs += 1
+    try:
+        return await quote_service.get_quote(product, max_staleness)
+    finally:
+        _single_runs -= 1
+        if not _single_runs:
+            await alert_dispatcher.close()
+            await close_shared_clients()
+
+
+async def track_price(single_run=False, adaptive=ADAPTIVE_POLLING, max_staleness=None):
     """
     Main function to track the price of a product over time.
     
     Args:
-        single_run (bool): If True, run once and return the result instead of looping
+        single_run (bool): If True, return a quote once instead of looping
+        adaptive (bool): If True, space checks by how often the price changes instead of TRACKING_INTERVAL
+        max_staleness (float, optional): In single_run mode, oldest cached quote accepted in seconds
         
     Returns:
         dict: The extracted data if single_run is True, otherwise None
     """
-    print(f"Starting price tracker for: {BASE_URL}")
-    if not single_run:
-        print(f"Checking price every {TRACKING_INTERVAL} seconds")
-        print(f"Price history will be saved to MongoDB and {CSV_FILENAME}")
+    product = WatchedProduct.from_ref(BASE_URL, TRACKING_INTERVAL)
+    if single_run:
+        return await quote_once(product, max_staleness)
+    
+    logger.info("Starting price tracker", extra={"url": BASE_URL})
+    logger.info("Checking price periodically", extra={
+        "interval": TRACKING_INTERVAL, "adaptive": adaptive, "local_history_format": local_history_store.format,
+    })
     
     while True:
         try:
-            # Extract current price and additional data
-            price_value, price_string, product_name, discount, rating, num_ratings, timestamp = await extract_product_price(BASE_URL)
-            
-            result = None
-            if price_string != "Not available":
-                print(f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}] {product_name}")
-                print(f"Price: {price_string} (Discount: {discount})")
-                print(f"Rating: {rating} ({num_ratings} ratings)")
-                
-                # Save to MongoDB and CSV
-                save_price_to_mongodb(
-                    price_value, price_string, product_name, discount,
-                    rating, num_ratings, timestamp
-                )
-                
-                # Check for significant price change
-                if price_value is not None:
-                    has_changed, percent_change = check_price_change(price_value)
-                    if has_changed:
-                        print(f"🔔 PRICE CHANGE ALERT: {percent_change:.2%} change detected!")
-                
-                # Prepare result for API if in single_run mode
-                if single_run:
-                    result = {
-                        "product_name": product_name,
-                        "price": price_string,
-                        "price_numeric": price_value,
-                        "discount": discount,
-                        "rating": rating,
-                        "num_ratings": num_ratings,
-                        "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                    }
-            else:
-                print(f"[{timestamp.strftime('%Y-%m-%d %H:%M:%S')}] Failed to extract price")
-                if single_run:
-                    result = {
-                        "error": "Failed to extract price",
-                        "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                    }
-        
+            result = await check_product(product)
         except Exception as e:
-            print(f"Error in price tracking: {e}")
-            if single_run:
-                result = {
-                    "error": str(e),
-                    "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S') if 'timestamp' in locals() else None
-                }
+            logger.exception("Error in price tracking")
+            result = {
+                "product_id": product.product_id,
+                "error": str(e),
+                "timestamp": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
         
-        # If single_run mode, return the result and exit
-        if single_run:
-            return result
-            
         # Wait for the next check
-        await asyncio.sleep(TRACKING_INTERVAL)
+        await asyncio.sleep(polling_policy.next_interval(product, result) if adaptive else TRACKING_INTERVAL)
+
+
+async def track_watchlist(products, concurrency=TRACKER_CONCURRENCY, adaptive=ADAPTIVE_POLLING):
+    """
+    Track many products concurrently, each on its own interval.
+    
+    Args:
+        products (list): WatchedProduct entries to track
+        concurrency (int): Maximum number of extractions running at the same time
+        adaptive (bool): If True, adapt each product's interval to how often its price changes,
+                         starting from its watchlist interval
+    """
+    logger.info("Starting price tracker", extra={
+        "products": len(products), "concurrency": concurrency, "adaptive": adaptive,
+        "local_history_format": local_history_store.format,
+    })
+    
+    scheduler = TrackingScheduler(
+        products, check_product, concurrency=concurrency, policy=polling_policy if adaptive else None
+    )
+    await scheduler.run()
+
+
+def load_alert_rules(args):
+    """Load the default alert rules plus the ones the command line points to."""
+    rules = parse_rules(ALERT_DEFAULT_RULES)
+    if args.alert_rules:
+        rules += load_alert_rules_file(args.alert_rules)
+    if args.alert_rules_from_mongodb:
+        rules += load_alert_rules_from_mongodb()
+    return rules
+
+
+def load_products(args):
+    """Load the watchlist the command line points to, or None if it does not point to one."""
+    if args.watchlist_from_mongodb:
+        return load_watchlist_from_mongodb(TRACKING_INTERVAL)
+    if args.watchlist:
+        return load_watchlist_file(args.watchlist, TRACKING_INTERVAL)
+    return None
+
+
+async def run_distributed(args):
+    """
+    Run as the coordinator or as a worker of the shared work queue.
+    
+    The coordinator keeps the queue in step with the watchlist (the tracked URL
+    when there is none); workers claim due checks from it and store the results.
+    """
+    queue = get_work_queue(args.queue)
+    try:
+        if args.mode == "coordinator":
+            await run_coordinator(
+                queue, lambda: load_products(args) or [WatchedProduct.from_ref(BASE_URL, TRACKING_INTERVAL)]
+            )
+        else:
+            worker = TrackingWorker(
+                queue, check_product, worker_id=args.worker_id, concurrency=args.concurrency,
+                policy=polling_policy if args.adaptive else None,
+            )
+            await worker.run()
+    finally:
+        await asyncio.to_thread(queue.close)
+
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Track competitor product prices.")
+    parser.add_argument("--watchlist", default=WATCHLIST_FILE,
+                        help="File with one product URL or ASIN per line, optionally followed by an interval in seconds")
+    parser.add_argument("--watchlist-from-mongodb", action="store_true",
+                        help="Load the watchlist from the MongoDB watchlist collection")
+    parser.add_argument("--concurrency", type=int, default=TRACKER_CONCURRENCY,
+                        help="Maximum number of extractions running at the same time")
+    parser.add_argument("--mode", choices=["standalone", "coordinator", "worker"], default="standalone",
+                        help="standalone checks the watchlist itself; coordinator puts it on the shared work queue "
+                             "for any number of workers to check")
+    parser.add_argument("--queue", choices=["mongodb", "local"], default=WORK_QUEUE_BACKEND,
+                        help="Work queue shared by the coordinator and workers")
+    parser.add_argument("--worker-id", help="Name of this worker in the work queue (default: host:pid)")
+    parser.add_argument("--fixed-intervals", dest="adaptive", action="store_false", default=ADAPTIVE_POLLING,
+                        help="Check every product on its own fixed interval instead of adapting it to price changes")
+    parser.add_argument("--quote", nargs="+", metavar="PRODUCT",
+                        help="Print the current price of these product URLs or ASINs as JSON and exit")
+    parser.add_argument("--max-staleness", type=float,
+                        help="With --quote, oldest cached quote accepted in seconds")
+    parser.add_argument("--fast-start", action="store_true",
+                        help="Skip the price cache warm-up and the history compaction on exit, for short-lived jobs "
+                             "and quick restarts; each product's state is loaded on its first check instead")
+    parser.add_argument("--alert-rules", default=ALERT_RULES_FILE,
+                        help="JSON file with a list of alert rules, see ALERT_DEFAULT_RULES in config.py")
+    parser.add_argument("--alert-rules-from-mongodb", action="store_true",
+                        help="Load alert rules from the MongoDB alert_rules collection and reload them periodically")
+    parser.add_argument("--no-alerts", dest="alerts", action="store_false", default=ALERTS_ENABLED,
+                        help="Do not evaluate alert rules")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="Minimum log level, e.g. DEBUG or INFO")
+    parser.add_argument("--log-format", default=LOG_FORMAT, choices=["text", "json"],
+                        help="Log lines as key=value text or as JSON objects")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Serve Prometheus metrics at /metrics and JSON at /metrics.json on this port")
+    parser.add_argument("--metrics-json", default=METRICS_JSON_PATH,
+                        help="Write a JSON dump of every metric to this file on shutdown")
+    parser.add_argument("--snapshots", action="store_true", default=SNAPSHOT_STORE_ENABLED,
+                        help="Keep a compressed copy of every fetched product page for re-extraction")
+    return parser.parse_args()
+
+
+async def startup(args):
+    """
+    Start the services a run needs.
+    
+    Importing this module connects to nothing and starts nothing. MongoDB
+    connects on first use, and the crawl dependencies are imported by the first
+    check.
+    
+    Returns:
+        tuple: (metrics_server, rules_refresher) - the started metrics server and alert rule
+               reload task, each None when not started; pass them to shutdown()
+    """
+    configure_logging(args.log_level, args.log_format)
+    snapshot_store.enabled = args.snapshots
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(metrics, args.metrics_port).start()
+        logger.info("Serving metrics", extra={"port": metrics_server.port})
+    
+    alert_engine.enabled = args.alerts
+    rules_refresher = None
+    if args.alerts:
+        alert_engine.set_rules(await asyncio.to_thread(load_alert_rules, args))
+        logger.info("Alert rules loaded", extra={"rules": alert_engine.rule_count})
+        if args.alert_rules_from_mongodb:
+            rules_refresher = asyncio.create_task(refresh_alert_rules(alert_engine, lambda: load_alert_rules(args)))
+    return metrics_server, rules_refresher
 
 
-async def main():
+async def shutdown(args, metrics_server=None, rules_refresher=None):
+    """
+    Stop what startup() and the checks started, writing everything still buffered.
+    
+    Args:
+        args (argparse.Namespace): The command line options
+        metrics_server (MetricsServer, optional): Returned by startup()
+        rules_refresher (asyncio.Task, optional): Returned by startup()
+    """
+    if rules_refresher is not None:
+        rules_refresher.cancel()
+    # Shut down the warm browsers and HTTP sessions kept alive between ticks
+    await close_shared_clients()
+    # Store how long the current states lasted, then write any price records still waiting in the MongoDB queue
+    await flush_pending_heartbeats()
+    await mongo_write_pipeline.close()
+    await alert_dispatcher.close()
+    # Write buffered local history and compact partitions that are no longer written to
+    await asyncio.to_thread(local_history_store.close)
+    if not args.fast_start:
+        await asyncio.to_thread(local_history_store.compact)
+    snapshot_store.close()
+    await asyncio.to_thread(mongodb_handler.close)
+    
+    if args.metrics_json:
+        metrics.dump_json(args.metrics_json)
+    if metrics_server is not None:
+        metrics_server.stop()
+
+
+async def main(args):
     """
     Entry point of the script.
     """
-    await track_price()
+    metrics_server, rules_refresher = await startup(args)
+    try:
+        if args.quote:
+            quotes = await quote_service.get_quotes(args.quote, args.max_staleness)
+            print(json.dumps(quotes, indent=2, default=str))
+            return
+        
+        if args.mode != "standalone":
+            await run_distributed(args)
+            return
+        
+        products = load_products(args)
+        
+        if not args.fast_start:
+            # Warm the price state cache so change detection does not read storage on every tick
+            tracked = products or [WatchedProduct.from_ref(BASE_URL, TRACKING_INTERVAL)]
+            await asyncio.to_thread(price_state_cache.warm, [product.product_id for product in tracked])
+        
+        if products:
+            await track_watchlist(products, args.concurrency, args.adaptive)
+        else:
+            await track_price(adaptive=args.adaptive)
+    finally:
+        await shutdown(args, metrics_server, rules_refresher)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(parse_args()))
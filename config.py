@@ -1,5 +1,14 @@
 import os
 
+try:
+    from dotenv import load_dotenv
+except ImportError:  # Settings then come from the process environment only
+    load_dotenv = None
+
+# Read .env once, here, so every setting below and MONGODB_URI see its values
+if load_dotenv is not None:
+    load_dotenv()
+
 LLM_MODEL = "gemini/gemini-2.0-flash"
 
 API_TOKEN = os.getenv("GEMINI_API_KEY")
@@ -10,6 +19,111 @@ API_TOKEN = os.getenv("GEMINI_API_KEY")
 # The {page_number} placeholder will be replaced with the actual page number during crawling.
 BASE_URL = "https://www.amazon.com/Lenovo-V15-Business-Display-Numeric/dp/B0D3JLHQ8K/ref=sr_1_4?crid=PJSLU1RHELZZ&dib=eyJ2IjoiMSJ9.g6y9YwJTWMx-PRpmNCGgzF3Gbh8-aRtwpdYAE2WNc6hrS_jiyxBOASsRgOriQJPcWaUaXJquWauP8eY2lZJRAQtjT_ItsjnDJxFpUi2R4WKnvvkvcP-0-i9cGkqcJSo_e3X3FpZgBt9uZ1oQk-9xcSsDHGcT67uIt919pw1zf9RaRrsf6ea5oYPyHety8smZY8FVDy_RupckPWiHEnLI1dtGfGJBhLwv8RcacRPE8gs.0Bh0BThrqKSWnHEaOHqGceDUGDQoGzLvugQrt0-vwRs&dib_tag=se&keywords=laptop%2Blenovo&qid=1742796037&sprefix=%2Caps%2C186&sr=8-4&th=1"
 
+# Marketplace assumed for watchlist entries given as a bare ASIN.
+DEFAULT_MARKETPLACE = "amazon.com"
+
+# Watchlist of products to track concurrently: one product URL or ASIN per line,
+# optionally followed by a per-product interval in seconds. Leave as None to track BASE_URL only.
+WATCHLIST_FILE = None
+
+# Maximum number of product extractions running at the same time.
+TRACKER_CONCURRENCY = 8
+
+# Adaptive polling. Each product's next check is set from how often its price changed across
+# its recent observations, within [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL] seconds. A product is
+# polled POLL_CHECKS_PER_CHANGE times per expected change, backs off by POLL_BACKOFF_FACTOR
+# per check while its price is stable, and drops to the minimum right after a change.
+ADAPTIVE_POLLING = True
+POLL_MIN_INTERVAL = 10  # seconds
+POLL_MAX_INTERVAL = 3600  # seconds
+POLL_CHECKS_PER_CHANGE = 4
+POLL_BACKOFF_FACTOR = 1.5
+# Known deal windows, during which no product is polled less often than POLL_DEAL_WINDOW_INTERVAL,
+# and checks are pulled forward to the start of the next window. Either "HH:MM-HH:MM" for a daily
+# window or "<ISO start>/<ISO end>" for a one-off event, e.g. "2026-11-27T00:00/2026-12-01T00:00".
+DEAL_WINDOWS = []
+POLL_DEAL_WINDOW_INTERVAL = 60  # seconds
+# Upper bound on checks per hour across all products; intervals are stretched evenly to fit. None for no limit.
+POLL_BUDGET_PER_HOUR = None
+
+# Coordinator/worker mode. The coordinator keeps the watchlist in a shared work queue and
+# workers on any number of processes or hosts claim due checks from it. A claim is a lease
+# that expires unless the worker renews it, so checks of a crashed worker are picked up by
+# another one. "mongodb" shares the queue across hosts (their clocks must be in sync);
+# "local" is an SQLite file shared by the processes of one host.
+WORK_QUEUE_BACKEND = "mongodb"
+WORK_QUEUE_LOCAL_PATH = "work_queue.sqlite3"
+WORK_QUEUE_LEASE_SECONDS = 120
+WORK_QUEUE_HEARTBEAT_INTERVAL = 30  # seconds between lease renewals, well under the lease
+WORK_QUEUE_POLL_INTERVAL = 1.0  # seconds an idle worker waits before looking for due checks again
+WORK_QUEUE_RETRY_DELAY = 30  # seconds before retrying a failed check, doubled on every further failure
+WORK_QUEUE_MAX_ATTEMPTS = 5  # Failures in a row before a check waits for its regular interval again
+COORDINATOR_REFRESH_INTERVAL = 300  # seconds between watchlist reloads
+
+# Background MongoDB write pipeline. Records are queued and written with insert_many
+# when a batch fills up or the flush interval passes, whichever comes first.
+MONGO_WRITE_QUEUE_SIZE = 10000  # Producers wait when this many records are pending
+MONGO_WRITE_BATCH_SIZE = 500
+MONGO_WRITE_FLUSH_INTERVAL = 2.0  # seconds
+
+# Number of recent observations kept in memory per product for price change detection.
+PRICE_CACHE_HISTORY_SIZE = 10
+
+# The CSV history keeps a sidecar offset index with one entry every this many rows,
+# used to seek to a time range without scanning the whole file.
+HISTORY_INDEX_STRIDE = 1000
+
+# Local history sink. "parquet" writes batches to date- and product-partitioned Parquet files
+# under LOCAL_HISTORY_DIR (needs pyarrow); "csv" appends batches to competitor_history.csv.
+LOCAL_HISTORY_FORMAT = "parquet"
+LOCAL_HISTORY_DIR = "history"
+LOCAL_HISTORY_BATCH_SIZE = 1000  # Records buffered before a write
+LOCAL_HISTORY_FLUSH_INTERVAL = 30  # seconds
+LOCAL_HISTORY_COMPACT_AFTER_DAYS = 1  # Merge part files of partitions older than this
+
+# Only store price checks whose price, discount, rating and other fields differ from the
+# product's previous check. Each stored state carries first_seen/last_seen, and while a
+# state lasts it is re-stored as a heartbeat every HISTORY_HEARTBEAT_INTERVAL seconds so
+# last_seen stays current. Pages identical to the previous check are not parsed again.
+HISTORY_DELTA_WRITES = True
+HISTORY_HEARTBEAT_INTERVAL = 3600  # seconds
+
+# Price history analytics (src/analytics.py). Windows and frequencies are pandas offset strings.
+ANALYTICS_ROLLING_WINDOW = "1D"  # Window of the rolling min/max/mean, volatility and z-scores
+ANALYTICS_ZSCORE_THRESHOLD = 3.0  # Prices this many rolling standard deviations from the rolling mean are anomalies
+ANALYTICS_GAP_FREQUENCY = "1h"  # Prices are aligned to buckets of this size before comparing competitors
+ANALYTICS_READ_BATCH_SIZE = 50000  # Documents per MongoDB cursor batch when loading history
+
+# Keep per-product minute, hour and day OHLC rollups of price_history up to date as records are
+# written, in the price_rollups collection. Use backfill_rollups.py to build them for existing history.
+ROLLUPS_ENABLED = True
+ROLLUP_RESOLUTIONS = ("minute", "hour", "day")
+
+# Price alerts. Rules are JSON objects with a "type" (target_price, percent_drop, percent_change,
+# discount_appears, rating_below, rating_drop or undercut), a "threshold" and the "product_id" they
+# watch; rules without a product_id watch every product. They are loaded from ALERT_RULES_FILE (a
+# JSON list) or the MongoDB alert_rules collection, in addition to ALERT_DEFAULT_RULES.
+ALERTS_ENABLED = True
+ALERT_RULES_FILE = None
+ALERT_DEFAULT_RULES = [{"rule_id": "price-change", "type": "percent_change", "threshold": 1.0}]
+ALERT_RULES_REFRESH_INTERVAL = 300  # seconds between reloads of the alert_rules collection
+ALERT_COOLDOWN = 3600  # seconds a rule stays quiet after firing, unless the rule sets its own "cooldown"
+# Fired alerts are delivered in batches of up to ALERT_BATCH_SIZE, at least every
+# ALERT_FLUSH_INTERVAL seconds, to a JSON lines file and/or a webhook that receives {"alerts": [...]}.
+ALERT_FILE_PATH = "alerts.jsonl"
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL")
+ALERT_WEBHOOK_TIMEOUT = 10  # seconds
+ALERT_BATCH_SIZE = 100
+ALERT_FLUSH_INTERVAL = 5.0  # seconds
+ALERT_QUEUE_SIZE = 10000  # Alerts waiting for delivery before new ones are dropped
+
+# Single-run quotes (track_price(single_run=True) and --quote). Concurrent requests for the same
+# product share one extraction, and results are served from memory for up to QUOTE_CACHE_TTL
+# seconds, or less when a caller passes a smaller max staleness.
+QUOTE_CACHE_TTL = 60  # seconds
+QUOTE_CACHE_MAX_ENTRIES = 10000  # Least recently used quotes are evicted beyond this
+QUOTE_BATCH_CONCURRENCY = 8  # Extractions running at the same time for one batch lookup
+
 # CSS selector to target the main HTML element containing the product information.
 
 # CSS selector specifically for the price element on Amazon product pages
@@ -33,10 +147,91 @@ RATING_SELECTOR = "#acrPopover > span.a-declarative > a > span"
 
 NUM_OF_RATINGS ="#acrCustomerReviewText"
 
+# Fetch each product page once and parse every selector above from the same HTML document.
+# Set to False to fall back to the legacy mode that loads the page once per selector.
+SINGLE_FETCH_EXTRACTION = True
+
+# Try a plain HTTP request before loading the page in Chromium. The browser is only used
+# when the required selectors are missing or Amazon returns a bot-check page.
+HTTP_FAST_PATH = True
+HTTP_POOL_SIZE = 100  # Maximum number of pooled keep-alive connections
+HTTP_TIMEOUT = 15  # seconds
+HTTP_SKIP_AFTER_FAILURES = 3  # Go straight to the browser for a product after this many HTTP misses in a row
+HTTP_RETRY_AFTER = 3600  # seconds before trying HTTP again for such a product
+HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# Warm browser pool shared by all extraction calls for the lifetime of the tracker.
+BROWSER_POOL_SIZE = 2  # Number of Chromium instances kept alive
+BROWSER_MAX_USES = 50  # Recycle a browser after this many page leases
+BROWSER_MAX_RSS_MB = 1024  # Recycle a browser when its own processes exceed this RSS (needs psutil)
+
+# Browser profile used for product pages unless a watchlist entry picks another one.
+# "lean" blocks images, fonts, media, ads and third-party hosts and only waits for the
+# selectors we parse; "full" loads pages like a regular browser.
+BROWSER_PROFILE = "lean"
+LEAN_BLOCKED_RESOURCE_TYPES = ("image", "media", "font", "texttrack", "manifest")  # Playwright resource types
+# Hosts allowed to load in the lean profile: Amazon marketplaces and their static content CDNs
+LEAN_FIRST_PARTY_HOST_PATTERN = r"(^|\.)(amazon\.[a-z.]+|media-amazon\.com|ssl-images-amazon\.com|images-amazon\.com)$"
+# First-party requests that are still ads or telemetry
+LEAN_BLOCKED_URL_PATTERNS = ("amazon-adsystem.com", "/gp/uedata", "fls-na.amazon.", "unagi.amazon.", "/adsystem/")
+LEAN_WAIT_FOR_SELECTOR = f"{PRODUCT_NAME_SELECTOR}, {PRICE_SELECTOR}"  # Any of them being present is enough
+LEAN_PAGE_TIMEOUT = 20  # seconds
+
+
+# On-disk cache of LLM extraction results, keyed by product or page and a hash of the
+# page region the LLM was given. Repeated fallbacks for unchanged pages skip the LLM call.
+LLM_CACHE_PATH = "llm_cache.sqlite3"
+LLM_CACHE_TTL = 7 * 24 * 3600  # seconds
+LLM_CACHE_MAX_ENTRIES = 10000  # Least recently used entries are evicted beyond this
+
+# LLM extraction service: requests with the same instructions are packed into one prompt
+# up to the token budget, and at most LLM_MAX_CONCURRENCY prompts are in flight at once.
+LLM_MAX_CONCURRENCY = 4
+LLM_BATCH_TOKEN_BUDGET = 24000  # Estimated input tokens per batched prompt
+LLM_BATCH_WAIT = 0.2  # seconds to wait for more requests before sending a batch
+
+# Part of a product page the name fallback hashes to decide whether a cached name is still valid.
+# Tried one at a time in this order. The broader blocks also hold the price, so they only serve
+# pages without a title section.
+PRODUCT_NAME_REGION_SELECTORS = ("#titleSection", "#centerCol", "#ppd")
+
+# Keep the HTML of every fetched product page as compressed blobs named by their content hash,
+# so historical pages can be re-parsed with new selectors (see reextract.py).
+SNAPSHOT_STORE_ENABLED = False
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_COMPRESSION_LEVEL = 6  # zstd level when the zstandard package is installed, gzip level otherwise
+# Drop scripts, styles and comments before hashing and storing. The selectors only read the
+# DOM, and these parts carry per-request tokens that would make every tick a new blob.
+SNAPSHOT_STRIP_SCRIPTS = True
 
 # Maximum number of pages to crawl. Adjust this value based on how much data you want to scrape.
 MAX_PAGES = 3  # Example: Set to 5 to scrape 5 pages.
 
+# Duplicate detection for search crawls: products are matched on ASIN, then on near-identical
+# titles with MinHash/LSH. DEDUP_NUM_PERM must be a multiple of DEDUP_BANDS.
+# An in-memory entry takes roughly 0.75 KB with the defaults below, so 100000 entries use about 75 MB.
+DEDUP_MAX_ENTRIES = 100000  # Entries kept in memory before the oldest are evicted
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_SIMILARITY_THRESHOLD = 0.8  # Estimated Jaccard similarity of title shingles
+
+# Number of result pages fetched at the same time when crawling a category or search.
+CATEGORY_CRAWL_CONCURRENCY = 3
+
+# Logging and metrics. LOG_FORMAT is "text" (key=value) or "json" (one object per line).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+METRICS_NAMESPACE = "price_tracker"
+METRICS_PORT = None  # Serve /metrics (Prometheus) and /metrics.json on this port, e.g. 9108
+METRICS_JSON_PATH = None  # Write a JSON dump of every metric here on shutdown
+
 # Instructions for the LLM on what information to extract from the scraped content.
 # The LLM will extract the following details for each product:
 # - Name
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+
+
+class ProductData(BaseModel):
+    """
+    Represents the data structure of a product in Amazon search results.
+    """
+
+    name: str
+    price: str
+    rating: str
+    reviews_count: str
+    availability: str
+    description: str
+    url: str
+
+
+class ProductName(BaseModel):
+    """
+    Represents the product name extracted by the LLM fallback on a product page.
+    """
+
+    name: str
@@ -0,0 +1,180 @@
+"""
+Re-parse stored product page snapshots and backfill price_history.
+
+Every distinct snapshot blob is parsed once across a process pool, and the
+result is written to every price check that fetched that markup. Use it after
+fixing a broken selector to repair the history it missed, without re-crawling.
+
+Usage:
+    python reextract.py --selectors '{"price": "span.a-price .a-offscreen"}'
+    python reextract.py --product amazon.eg:B0XXXXXXXX --start 2025-01-01 --dry-run
+"""
+import os
+import json
+import logging
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from config import SNAPSHOT_DIR, LOG_LEVEL, LOG_FORMAT
+from src.snapshot_store import SnapshotStore
+from src.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# price_history fields written from each parsed field, and the value a selector miss parses to
+FIELD_MAPPING = {
+    "price_numeric": ("price_value", None),
+    "price": ("price_string", "Not available"),
+    "product_name": ("product_name", "Unknown Product"),
+    "discount": ("discount", None),
+    "bought_30_days": ("bought_30_days", "N/A"),
+    "rating": ("rating", "Not available"),
+    "num_ratings": ("num_ratings", "Not available"),
+}
+
+
+def parse_snapshot(task):
+    """
+    Parse one snapshot blob in a worker process.
+
+    Args:
+        task (tuple): (content_hash, snapshot directory, selector overrides)
+
+    Returns:
+        tuple: (content_hash, parsed fields or None if the blob is missing)
+    """
+    from src.price_extractor import parse_product_html
+
+    content_hash, directory, selectors = task
+    html = SnapshotStore(directory).load(content_hash)
+    if html is None:
+        return content_hash, None
+    return content_hash, parse_product_html(html, selectors)
+
+
+def to_update_fields(data, fields):
+    """Map parsed fields onto price_history fields, leaving out selector misses so they never overwrite good data."""
+    update = {}
+    for field in fields:
+        source, missing = FIELD_MAPPING[field]
+        value = data[source]
+        if value is not None and value != missing:
+            update[field] = value
+    return update
+
+
+def to_mongo_timestamp(timestamp):
+    # MongoDB keeps milliseconds, so the stored check matches the truncated timestamp
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+
+def load_selectors(value):
+    """Read selector overrides from a JSON string or a JSON file."""
+    if not value:
+        return {}
+    if os.path.isfile(value):
+        with open(value, mode="r", encoding="utf-8") as file:
+            return json.load(file)
+    return json.loads(value)
+
+
+def reextract(store, selectors=None, fields=None, product_id=None, start=None, end=None,
+              workers=None, batch_size=1000, insert_missing=False, dry_run=False):
+    """
+    Re-parse stored snapshots and write the results to price_history.
+
+    Args:
+        store (SnapshotStore): The snapshot store to read
+        selectors (dict, optional): Selector overrides by field, see DEFAULT_SELECTORS
+        fields (list, optional): price_history fields to backfill, all of FIELD_MAPPING if not given
+        product_id (str, optional): Only snapshots of this product
+        start (datetime, optional): Only snapshots at or after this time
+        end (datetime, optional): Only snapshots before this time
+        workers (int, optional): Parser processes, the CPU count if not given
+        batch_size (int): Price checks per MongoDB bulk write
+        insert_missing (bool): If True, also insert checks that were never stored
+        dry_run (bool): If True, parse and count without writing
+
+    Returns:
+        dict: Counts of snapshots, parsed blobs, missing blobs, updates and written documents
+    """
+    from src.mongodb_handler import mongodb_handler
+
+    fields = list(fields or FIELD_MAPPING)
+    snapshots = store.list_snapshots(product_id, start, end)
+    hashes = sorted({snapshot["content_hash"] for snapshot in snapshots})
+    summary = {"snapshots": len(snapshots), "blobs": len(hashes), "missing_blobs": 0, "updates": 0, "written": 0}
+    logger.info("Re-extracting snapshots", extra={"snapshots": len(snapshots), "blobs": len(hashes)})
+
+    # Identical markup is parsed once however many checks fetched it
+    parsed = {}
+    tasks = [(content_hash, store.directory, selectors) for content_hash in hashes]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+        for content_hash, data in executor.map(parse_snapshot, tasks, chunksize=chunksize):
+            if data is None:
+                summary["missing_blobs"] += 1
+                logger.warning("Snapshot blob is missing", extra={"content_hash": content_hash})
+                continue
+            parsed[content_hash] = to_update_fields(data, fields)
+
+    batch = []
+    for snapshot in snapshots:
+        update = parsed.get(snapshot["content_hash"])
+        if not update:
+            continue
+        update = dict(update, snapshot_id=snapshot["content_hash"])
+        batch.append((snapshot["product_id"], to_mongo_timestamp(snapshot["timestamp"]), update))
+        summary["updates"] += 1
+        if len(batch) >= batch_size:
+            if not dry_run:
+                summary["written"] += mongodb_handler.update_extracted_fields(batch, insert_missing)
+            batch = []
+    if batch and not dry_run:
+        summary["written"] += mongodb_handler.update_extracted_fields(batch, insert_missing)
+
+    logger.info("Re-extraction finished", extra=summary)
+    return summary
+
+
+def parse_args():
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Re-parse stored page snapshots and backfill price_history.")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="Directory of the snapshot store")
+    parser.add_argument("--selectors", help="JSON object, or a JSON file, mapping fields to new CSS selectors")
+    parser.add_argument("--fields", nargs="+", choices=list(FIELD_MAPPING),
+                        help="price_history fields to backfill (default: all)")
+    parser.add_argument("--product", help="Only re-extract this product ('<marketplace>:<ASIN>')")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat, help="Only snapshots at or after this time")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat, help="Only snapshots before this time")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Price checks per MongoDB bulk write")
+    parser.add_argument("--insert-missing", action="store_true",
+                        help="Also insert checks with no stored document, e.g. ones whose price failed to parse")
+    parser.add_argument("--dry-run", action="store_true", help="Parse and report without writing to MongoDB")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="Minimum log level, e.g. DEBUG or INFO")
+    parser.add_argument("--log-format", default=LOG_FORMAT, choices=["text", "json"],
+                        help="Log lines as key=value text or as JSON objects")
+    return parser.parse_args()
+
+
+def main(args):
+    """
+    Entry point of the script.
+    """
+    configure_logging(args.log_level, args.log_format)
+    store = SnapshotStore(args.snapshot_dir)
+    try:
+        summary = reextract(
+            store, selectors=load_selectors(args.selectors), fields=args.fields, product_id=args.product,
+            start=args.start, end=args.end, workers=args.workers, batch_size=args.batch_size,
+            insert_missing=args.insert_missing, dry_run=args.dry_run,
+        )
+    finally:
+        store.close()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,503 @@
+import json
+import asyncio
+import logging
+import datetime
+import itertools
+import urllib.request
+from collections import defaultdict
+
+from config import (
+    ALERT_DEFAULT_RULES, ALERT_COOLDOWN, ALERT_FILE_PATH, ALERT_WEBHOOK_URL, ALERT_WEBHOOK_TIMEOUT,
+    ALERT_BATCH_SIZE, ALERT_FLUSH_INTERVAL, ALERT_QUEUE_SIZE, ALERT_RULES_REFRESH_INTERVAL
+)
+from src.rollups import parse_discount_value, parse_rating_value
+from src.price_cache import price_state_cache
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+alerts_fired = metrics.counter("alerts_fired_total", "Alerts fired by rule type", ["rule_type"])
+alert_deliveries = metrics.counter(
+    "alert_deliveries_total", "Alerts handed to each sink by outcome", ["sink", "outcome"]
+)
+
+# Queued by close() to tell the dispatcher to deliver what it has and exit
+_STOP = object()
+
+
+class Observation:
+    """The fields of one price check that rules read, with discount and rating parsed once."""
+
+    __slots__ = ("price", "discount", "rating", "timestamp")
+
+    def __init__(self, price, discount=None, rating=None, timestamp=None):
+        self.price = price
+        self.discount = discount
+        self.rating = rating
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(
+            document.get("price_numeric"),
+            parse_discount_value(document.get("discount")),
+            parse_rating_value(document.get("rating")),
+            document.get("timestamp") or datetime.datetime.now(),
+        )
+
+
+def _change_percent(previous, current):
+    """Signed change from the previous to the current price in percent, or None if either is unknown."""
+    if previous is None or previous.price is None or current.price is None or previous.price <= 0:
+        return None
+    return (current.price - previous.price) / previous.price * 100
+
+
+def _target_price(rule, current, previous, engine):
+    return current.price is not None and current.price <= rule.threshold
+
+
+def _percent_drop(rule, current, previous, engine):
+    change = _change_percent(previous, current)
+    return change is not None and change <= -rule.threshold
+
+
+def _percent_change(rule, current, previous, engine):
+    change = _change_percent(previous, current)
+    return change is not None and abs(change) >= rule.threshold
+
+
+def _discount_appears(rule, current, previous, engine):
+    return current.discount is not None and current.discount != 0 and abs(current.discount) >= rule.threshold
+
+
+def _rating_below(rule, current, previous, engine):
+    return current.rating is not None and current.rating < rule.threshold
+
+
+def _rating_drop(rule, current, previous, engine):
+    if previous is None or previous.rating is None or current.rating is None:
+        return False
+    drop = previous.rating - current.rating
+    return drop > 0 and drop >= rule.threshold
+
+
+def _undercut(rule, current, previous, engine):
+    our_price = rule.our_price
+    if rule.our_product_id is not None:
+        ours = engine.latest(rule.our_product_id)
+        our_price = ours.price if ours is not None else None
+    if current.price is None or our_price is None:
+        return False
+    return current.price < our_price * (1 - rule.threshold / 100)
+
+
+# Condition of each rule type, and whether it needs a threshold
+CONDITIONS = {
+    "target_price": (_target_price, True),
+    "percent_drop": (_percent_drop, True),
+    "percent_change": (_percent_change, True),
+    "discount_appears": (_discount_appears, False),
+    "rating_below": (_rating_below, True),
+    "rating_drop": (_rating_drop, False),
+    "undercut": (_undercut, False),
+}
+
+
+class AlertRule:
+    """
+    One user-defined alert.
+
+    target_price fires when the price is at or below `threshold`; percent_drop
+    and percent_change when the price moved by at least `threshold` percent
+    since the previous check; discount_appears when a discount of at least
+    `threshold` percent is listed; rating_below when the rating is under
+    `threshold`; rating_drop when the rating fell by at least `threshold`; and
+    undercut when the price is more than `threshold` percent under our own,
+    either `our_price` or the latest price of `our_product_id`.
+    """
+
+    __slots__ = (
+        "rule_id", "type", "product_id", "threshold", "cooldown", "our_product_id", "our_price", "labels",
+        "condition",
+    )
+
+    def __init__(self, rule_id, type, product_id=None, threshold=None, cooldown=ALERT_COOLDOWN,
+                 our_product_id=None, our_price=None, labels=None):
+        if type not in CONDITIONS:
+            raise ValueError(f"Unknown alert rule type: {type}")
+        condition, needs_threshold = CONDITIONS[type]
+        if threshold is None and needs_threshold:
+            raise ValueError(f"Alert rule type {type} needs a threshold")
+        if type == "undercut" and our_product_id is None and our_price is None:
+            raise ValueError("Undercut alert rules need our_product_id or our_price")
+
+        self.rule_id = rule_id
+        self.type = type
+        self.product_id = product_id
+        self.threshold = float(threshold or 0)
+        self.cooldown = float(cooldown)
+        self.our_product_id = our_product_id
+        self.our_price = float(our_price) if our_price is not None else None
+        self.labels = labels or {}
+        self.condition = condition
+
+    @classmethod
+    def from_dict(cls, document):
+        """
+        Build a rule from a JSON object or MongoDB document.
+
+        Raises:
+            ValueError: If the rule type is unknown or a required field is missing
+        """
+        rule_id = document.get("rule_id") or document.get("_id")
+        if rule_id is None:
+            rule_id = f"{document.get('type')}:{document.get('product_id') or '*'}:{document.get('threshold')}"
+        return cls(
+            str(rule_id), document.get("type"), document.get("product_id"), document.get("threshold"),
+            document.get("cooldown", ALERT_COOLDOWN), document.get("our_product_id"), document.get("our_price"),
+            document.get("labels"),
+        )
+
+
+def parse_rules(documents, source="config"):
+    """
+    Build rules from documents, skipping the invalid ones.
+
+    Returns:
+        list: AlertRule entries
+    """
+    rules = []
+    for document in documents:
+        try:
+            rules.append(AlertRule.from_dict(document))
+        except (ValueError, TypeError) as e:
+            logger.warning("Skipping invalid alert rule", extra={"source": source, "rule": str(document), "error": str(e)})
+    return rules
+
+
+def load_alert_rules_file(path):
+    """
+    Load alert rules from a JSON file holding a list of rule objects.
+
+    Returns:
+        list: AlertRule entries
+    """
+    with open(path, mode='r', encoding='utf-8') as file:
+        documents = json.load(file)
+    if not isinstance(documents, list):
+        raise ValueError(f"Alert rules file must hold a JSON list: {path}")
+    return parse_rules(documents, source=path)
+
+
+def load_alert_rules_from_mongodb():
+    """Load alert rules from the MongoDB alert_rules collection."""
+    from src.mongodb_handler import mongodb_handler
+
+    return parse_rules(mongodb_handler.get_alert_rules(), source="mongodb")
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against every new price observation.
+
+    Rules are indexed by the product they watch, so a record is only checked
+    against its own rules and the few rules that watch every product. A rule
+    fires when its condition becomes true, then stays quiet until the condition
+    has been false again and its cooldown has passed, so a price sitting under
+    a target alerts once instead of on every check.
+
+    The debounce state lives in memory: after a restart, conditions that are
+    still true fire once more.
+    """
+
+    def __init__(self, rules=()):
+        self.enabled = True
+        self._by_product = {}
+        self._global = []
+        self._referenced = set()
+        # Latest observation of each product, used as the previous one of its next check
+        self._latest = {}
+        # (rule_id, product_id) pairs whose condition has stayed true since they fired
+        self._tripped = set()
+        self._fired_at = {}
+        self.set_rules(rules)
+
+    @property
+    def rule_count(self):
+        return sum(len(rules) for rules in self._by_product.values()) + len(self._global)
+
+    def set_rules(self, rules):
+        """
+        Replace the rules, keeping the debounce state of rules that are still present.
+
+        Args:
+            rules (iterable): AlertRule entries
+        """
+        by_product = defaultdict(list)
+        global_rules = []
+        referenced = set()
+        for rule in rules:
+            if rule.product_id is None:
+                global_rules.append(rule)
+            else:
+                by_product[rule.product_id].append(rule)
+            if rule.our_product_id is not None:
+                referenced.add(rule.our_product_id)
+
+        rule_ids = {rule.rule_id for rule in itertools.chain(global_rules, *by_product.values())}
+        self._by_product, self._global, self._referenced = dict(by_product), global_rules, referenced
+        self._tripped = {key for key in self._tripped if key[0] in rule_ids}
+        self._fired_at = {key: value for key, value in self._fired_at.items() if key[0] in rule_ids}
+
+    def latest(self, product_id):
+        """Return the latest observation of a product, or None if it has not been seen."""
+        return self._latest.get(product_id)
+
+    def forget(self, product_id):
+        """
+        Drop the latest observation and tripped rules of a product, e.g. after another worker checked it.
+
+        The next check compares against the price cache instead, and rules whose
+        condition is still true may fire again once their cooldown has passed.
+        """
+        self._latest.pop(product_id, None)
+        self._tripped = {key for key in self._tripped if key[1] != product_id}
+
+    def _previous(self, product_id):
+        previous = self._latest.get(product_id)
+        if previous is None:
+            # First check since startup: the price cache already holds this check, so its second to last is the previous one
+            price = price_state_cache.previous_price(product_id)
+            previous = Observation(price) if price is not None else None
+        return previous
+
+    def observe(self, document):
+        """
+        Evaluate the rules of a product against a new observation.
+
+        Args:
+            document (dict): The check, with product_id, price_numeric, discount, rating and timestamp
+
+        Returns:
+            list: The alerts that fired, as JSON-serializable dicts
+        """
+        product_id = document.get("product_id")
+        rules = self._by_product.get(product_id, ())
+        if not self.enabled or (not rules and not self._global and product_id not in self._referenced):
+            return []
+
+        current = Observation.from_document(document)
+        previous = self._previous(product_id)
+        alerts = []
+        for rule in itertools.chain(rules, self._global):
+            try:
+                matched = rule.condition(rule, current, previous, self)
+            except Exception as e:
+                logger.error("Error evaluating alert rule", extra={"rule_id": rule.rule_id, "error": str(e)})
+                continue
+
+            key = (rule.rule_id, product_id)
+            if not matched:
+                self._tripped.discard(key)
+                continue
+            if key in self._tripped:
+                continue
+            fired_at = self._fired_at.get(key)
+            if fired_at is not None and (current.timestamp - fired_at).total_seconds() < rule.cooldown:
+                continue
+
+            self._tripped.add(key)
+            self._fired_at[key] = current.timestamp
+            alerts.append(self._build_alert(rule, document, current, previous))
+
+        self._latest[product_id] = current
+        return alerts
+
+    def _build_alert(self, rule, document, current, previous):
+        alerts_fired.inc(rule_type=rule.type)
+        alert = {
+            "rule_id": rule.rule_id,
+            "rule_type": rule.type,
+            "threshold": rule.threshold,
+            "product_id": document.get("product_id"),
+            "product_name": document.get("product_name"),
+            "url": document.get("url"),
+            "price": current.price,
+            "previous_price": previous.price if previous is not None else None,
+            "discount": document.get("discount"),
+            "rating": document.get("rating"),
+            "timestamp": current.timestamp.isoformat(),
+            "labels": rule.labels,
+        }
+        logger.warning("Price alert", extra={
+            "rule_id": rule.rule_id, "rule_type": rule.type, "product_id": alert["product_id"],
+            "price": current.price, "previous_price": alert["previous_price"],
+        })
+        return alert
+
+
+class FileAlertSink:
+    """Appends alerts to a file, one JSON object per line."""
+
+    name = "file"
+
+    def __init__(self, path=ALERT_FILE_PATH):
+        self.path = path
+
+    def send(self, alerts):
+        with open(self.path, mode='a', encoding='utf-8') as file:
+            file.writelines(json.dumps(alert, default=str) + "\n" for alert in alerts)
+
+
+class WebhookAlertSink:
+    """POSTs each batch of alerts to a webhook as {"alerts": [...]}."""
+
+    name = "webhook"
+
+    def __init__(self, url=ALERT_WEBHOOK_URL, timeout=ALERT_WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alerts):
+        request = urllib.request.Request(
+            self.url, data=json.dumps({"alerts": alerts}, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def default_sinks():
+    """Build the sinks configured in config.py."""
+    sinks = []
+    if ALERT_FILE_PATH:
+        sinks.append(FileAlertSink(ALERT_FILE_PATH))
+    if ALERT_WEBHOOK_URL:
+        sinks.append(WebhookAlertSink(ALERT_WEBHOOK_URL))
+    return sinks
+
+
+class AlertDispatcher:
+    """
+    Batched, non-blocking delivery of fired alerts.
+
+    Alerts are put on a bounded queue and handed to every sink by a background
+    task once `batch_size` alerts are pending or `flush_interval` seconds have
+    passed. Sinks run in a worker thread, so a slow webhook never stalls the
+    event loop. When the queue is full new alerts are dropped rather than
+    slowing down the checks.
+    """
+
+    def __init__(self, sinks=None, max_queue_size=ALERT_QUEUE_SIZE, batch_size=ALERT_BATCH_SIZE,
+                 flush_interval=ALERT_FLUSH_INTERVAL):
+        self.sinks = default_sinks() if sinks is None else sinks
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = None
+        self._dispatcher = None
+
+    @property
+    def queue_depth(self):
+        """Number of alerts waiting to be delivered."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the background dispatcher if it is not running yet."""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._dispatcher = asyncio.create_task(self._run())
+
+    def submit(self, alerts):
+        """Queue alerts for delivery without waiting."""
+        if not alerts or not self.sinks:
+            return
+        self.start()
+        for alert in alerts:
+            try:
+                self._queue.put_nowait(alert)
+            except asyncio.QueueFull:
+                alert_deliveries.inc(sink="queue", outcome="dropped")
+                logger.error("Alert queue full, dropping alert", extra={"rule_id": alert["rule_id"]})
+
+    async def _collect_batch(self):
+        """
+        Wait for the first alert, then gather more until the batch is full or the interval ends.
+
+        Returns:
+            tuple: (batch, stop) - the alerts to deliver and whether shutdown was requested
+        """
+        alert = await self._queue.get()
+        if alert is _STOP:
+            return [], True
+
+        batch = [alert]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                alert = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            if alert is _STOP:
+                return batch, True
+            batch.append(alert)
+        return batch, False
+
+    async def _run(self):
+        while True:
+            batch, stop = await self._collect_batch()
+            for sink in self.sinks if batch else ():
+                try:
+                    await asyncio.to_thread(sink.send, batch)
+                    alert_deliveries.inc(len(batch), sink=sink.name, outcome="delivered")
+                except Exception as e:
+                    alert_deliveries.inc(len(batch), sink=sink.name, outcome="failed")
+                    logger.error("Error delivering alerts", extra={"sink": sink.name, "alerts": len(batch), "error": str(e)})
+            if stop:
+                return
+
+    async def close(self):
+        """Deliver every pending alert and stop the background dispatcher."""
+        if self._dispatcher is None:
+            return
+
+        if not self._dispatcher.done():
+            # The stop marker is queued behind pending alerts, so they are all delivered first
+            await self._queue.put(_STOP)
+            await self._dispatcher
+        self._dispatcher = None
+
+
+async def refresh_alert_rules(engine, load_rules, interval=ALERT_RULES_REFRESH_INTERVAL):
+    """
+    Reload the rules of an engine every `interval` seconds until cancelled.
+
+    Args:
+        engine (AlertEngine): The engine to update
+        load_rules (callable): Returns the current list of AlertRule entries
+        interval (float): Seconds between reloads
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            rules = await asyncio.to_thread(load_rules)
+            engine.set_rules(rules)
+            logger.info("Alert rules reloaded", extra={"rules": engine.rule_count})
+        except Exception as e:
+            logger.error("Error reloading alert rules", extra={"error": str(e)})
+
+
+# Create a singleton instance
+alert_engine = AlertEngine(parse_rules(ALERT_DEFAULT_RULES))
+alert_dispatcher = AlertDispatcher()
+
+metrics.gauge("alert_rules", "Alert rules being evaluated", function=lambda: alert_engine.rule_count)
+metrics.gauge(
+    "alert_queue_depth", "Alerts waiting to be delivered", function=lambda: alert_dispatcher.queue_depth
+)
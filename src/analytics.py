@@ -0,0 +1,343 @@
+import os
+import glob
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    ANALYTICS_ROLLING_WINDOW, ANALYTICS_ZSCORE_THRESHOLD, ANALYTICS_GAP_FREQUENCY, ANALYTICS_READ_BATCH_SIZE
+)
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pymongoarrow.api import find_pandas_all
+except ImportError:  # History is read through a plain cursor without pymongoarrow, only slower
+    find_pandas_all = None
+
+# Columns read from storage; everything else is derived from them
+HISTORY_COLUMNS = ["product_id", "asin", "marketplace", "timestamp", "price_numeric", "discount"]
+
+
+def prepare_history(frame):
+    """
+    Normalize raw history rows into the frame every analysis works on.
+
+    Rows without a price are dropped, the discount strings are parsed into a
+    numeric `discount_pct`, and rows are sorted by product and time so grouped
+    window operations can be assigned back by position.
+
+    Args:
+        frame (pandas.DataFrame): Rows with some or all of HISTORY_COLUMNS
+
+    Returns:
+        pandas.DataFrame: The history, one row per stored check
+    """
+    frame = frame.reindex(columns=HISTORY_COLUMNS).dropna(subset=["product_id", "timestamp", "price_numeric"])
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"])
+    frame["price_numeric"] = frame["price_numeric"].astype("float64")
+
+    # The local history has no asin/marketplace columns; they are part of the product key
+    key_parts = frame["product_id"].astype(str).str.rpartition(":")
+    frame["marketplace"] = frame["marketplace"].fillna(key_parts[0])
+    frame["asin"] = frame["asin"].fillna(key_parts[2])
+
+    frame["discount_pct"] = (
+        frame["discount"].astype("string").str.extract(r"(-?\d+(?:\.\d+)?)%", expand=False)
+        .astype("float64").abs().fillna(0.0)
+    )
+    frame["product_id"] = frame["product_id"].astype("category")
+    return frame.drop(columns="discount").sort_values(["product_id", "timestamp"], kind="stable").reset_index(drop=True)
+
+
+def _timestamp_query(start, end):
+    query = {}
+    if start is not None:
+        query["$gte"] = start
+    if end is not None:
+        query["$lt"] = end
+    return query
+
+
+def load_history_from_mongodb(product_ids=None, start=None, end=None, handler=None):
+    """
+    Load price history from MongoDB in one projected bulk read.
+
+    Args:
+        product_ids (iterable, optional): Products to load, every product if not given
+        start (datetime, optional): Only checks at or after this time
+        end (datetime, optional): Only checks before this time
+        handler (MongoDBHandler, optional): Connected handler, the shared one if not given
+
+    Returns:
+        pandas.DataFrame: See prepare_history
+    """
+    if handler is None:
+        from src.mongodb_handler import mongodb_handler as handler
+    if not handler.is_connected and not handler.connect():
+        raise ConnectionError("MongoDB is not reachable")
+
+    query = {"price_numeric": {"$ne": None}}
+    if product_ids is not None:
+        query["product_id"] = {"$in": list(product_ids)}
+    if start is not None or end is not None:
+        query["timestamp"] = _timestamp_query(start, end)
+    projection = {"_id": 0, **{column: 1 for column in HISTORY_COLUMNS}}
+
+    with metrics.time_stage("analytics_load"):
+        if find_pandas_all is not None:
+            # Decoded straight into Arrow buffers instead of one dict per document
+            frame = find_pandas_all(handler.collection, query, projection=projection)
+        else:
+            cursor = handler.collection.find(query, projection, batch_size=ANALYTICS_READ_BATCH_SIZE)
+            frame = pd.DataFrame(list(cursor), columns=HISTORY_COLUMNS)
+        return prepare_history(frame)
+
+
+def load_history_from_local(product_ids=None, start=None, end=None, store=None):
+    """
+    Load price history from the local Parquet or CSV history.
+
+    Parquet partitions outside the date range or product list are skipped by
+    path, and only the analysed columns are read from the rest.
+
+    Args:
+        Same as load_history_from_mongodb, plus:
+        store (LocalHistoryStore, optional): The local history, the shared one if not given
+
+    Returns:
+        pandas.DataFrame: See prepare_history
+    """
+    from src.history_store import HISTORY_FIELDNAMES, _partition_name
+
+    if store is None:
+        from src.data_storage import local_history_store as store
+    columns = [column for column in HISTORY_COLUMNS if column in HISTORY_FIELDNAMES]
+
+    with metrics.time_stage("analytics_load"):
+        if store.format == "parquet":
+            import pyarrow.dataset as ds
+            from src.history_store import history_schema
+
+            partitions = {_partition_name(product_id) for product_id in product_ids} if product_ids is not None else None
+            files = []
+            for path in glob.glob(os.path.join(store.directory, "date=*", "product=*", "*.parquet")):
+                date_dir, product_dir = path.split(os.sep)[-3:-1]
+                date = date_dir[len("date="):]
+                if start is not None and date < start.date().isoformat():
+                    continue
+                if end is not None and date > end.date().isoformat():
+                    continue
+                if partitions is not None and product_dir[len("product="):] not in partitions:
+                    continue
+                files.append(path)
+            table = ds.dataset(files, schema=history_schema(), format="parquet").to_table(columns=columns)
+            frame = table.to_pandas()
+        elif os.path.isfile(store.csv_filename):
+            frame = pd.read_csv(store.csv_filename, usecols=columns, dtype={"product_id": "string", "discount": "string"})
+        else:
+            frame = pd.DataFrame(columns=columns)
+
+        frame = prepare_history(frame)
+        mask = np.ones(len(frame), dtype=bool)
+        if product_ids is not None:
+            mask &= frame["product_id"].isin(list(product_ids)).to_numpy()
+        if start is not None:
+            mask &= (frame["timestamp"] >= start).to_numpy()
+        if end is not None:
+            mask &= (frame["timestamp"] < end).to_numpy()
+        return frame[mask].reset_index(drop=True)
+
+
+def load_history(product_ids=None, start=None, end=None, source="auto"):
+    """
+    Load price history for analysis.
+
+    Args:
+        product_ids (iterable, optional): Products to load, e.g. a whole watchlist; every product if not given
+        start (datetime, optional): Only checks at or after this time
+        end (datetime, optional): Only checks before this time
+        source (str): "mongodb", "local", or "auto" for MongoDB when it is reachable and the local history otherwise
+
+    Returns:
+        pandas.DataFrame: See prepare_history
+    """
+    if source == "local":
+        return load_history_from_local(product_ids, start, end)
+    if source == "mongodb":
+        return load_history_from_mongodb(product_ids, start, end)
+
+    try:
+        return load_history_from_mongodb(product_ids, start, end)
+    except ConnectionError:
+        logger.info("MongoDB is not reachable, analysing the local history instead")
+        return load_history_from_local(product_ids, start, end)
+
+
+def _rolling(frame, column, window, **kwargs):
+    # Per-product time-based windows; frame is sorted by product and time, so results line up by position
+    return frame.set_index("timestamp").groupby("product_id", observed=True, sort=False)[column].rolling(window, **kwargs)
+
+
+def rolling_stats(frame, window=ANALYTICS_ROLLING_WINDOW):
+    """
+    Rolling min, max, mean and volatility of each product's price.
+
+    Windows are time-based, so they stay correct when checks are irregular,
+    e.g. with change-only history, where heartbeats sample stable periods.
+    Volatility is the standard deviation of log returns within the window.
+
+    Args:
+        frame (pandas.DataFrame): History from load_history
+        window (str): Window length as a pandas offset, e.g. "1D" or "7D"
+
+    Returns:
+        pandas.DataFrame: The frame with rolling_min, rolling_max, rolling_mean and volatility columns
+    """
+    rolling = _rolling(frame, "price_numeric", window)
+    log_returns = np.log(frame["price_numeric"].where(frame["price_numeric"] > 0)).groupby(
+        frame["product_id"], observed=True, sort=False
+    ).diff()
+
+    return frame.assign(
+        rolling_min=rolling.min().to_numpy(),
+        rolling_max=rolling.max().to_numpy(),
+        rolling_mean=rolling.mean().to_numpy(),
+        volatility=_rolling(frame.assign(log_return=log_returns), "log_return", window).std().to_numpy(),
+    )
+
+
+def zscore_anomalies(frame, window=ANALYTICS_ROLLING_WINDOW, threshold=ANALYTICS_ZSCORE_THRESHOLD, min_periods=5):
+    """
+    Flag prices far from the product's recent prices.
+
+    Each price is compared with the mean and standard deviation of the same
+    product's prices in the preceding window, excluding the price itself.
+
+    Args:
+        frame (pandas.DataFrame): History from load_history
+        window (str): Window length as a pandas offset
+        threshold (float): Absolute z-score from which a price is an anomaly
+        min_periods (int): Prices the window needs before z-scores are computed
+
+    Returns:
+        pandas.DataFrame: The frame with zscore and anomaly columns
+    """
+    rolling = _rolling(frame, "price_numeric", window, closed="left", min_periods=min_periods)
+    mean = rolling.mean().to_numpy()
+    std = rolling.std().to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscore = np.where(std > 0, (frame["price_numeric"].to_numpy() - mean) / std, np.nan)
+    return frame.assign(zscore=zscore, anomaly=np.abs(np.nan_to_num(zscore)) >= threshold)
+
+
+def discount_trends(frame, frequency="1D"):
+    """
+    Average discount depth per period and its linear trend per product.
+
+    Args:
+        frame (pandas.DataFrame): History from load_history
+        frequency (str): Period as a pandas offset
+
+    Returns:
+        tuple: (per-period frame with product_id, timestamp and discount_pct,
+                per-product frame with periods, mean_discount, latest_discount and
+                slope_per_day, the least-squares change in discount points per day)
+    """
+    periods = frame.groupby(
+        ["product_id", pd.Grouper(key="timestamp", freq=frequency)], observed=True
+    )["discount_pct"].mean().reset_index()
+
+    # Closed-form least squares over every product at once
+    days = ((periods["timestamp"] - periods["timestamp"].min()) / pd.Timedelta(days=1)).to_numpy()
+    discount = periods["discount_pct"].to_numpy()
+    sums = pd.DataFrame({
+        "product_id": periods["product_id"], "x": days, "y": discount, "xy": days * discount, "xx": days * days,
+    }).groupby("product_id", observed=True).agg(
+        periods=("x", "size"), x=("x", "sum"), y=("y", "sum"), xy=("xy", "sum"), xx=("xx", "sum"),
+    )
+    denominator = sums["periods"] * sums["xx"] - sums["x"] ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (sums["periods"] * sums["xy"] - sums["x"] * sums["y"]) / denominator, 0.0)
+
+    trends = pd.DataFrame({
+        "periods": sums["periods"],
+        "mean_discount": sums["y"] / sums["periods"],
+        "latest_discount": periods.groupby("product_id", observed=True)["discount_pct"].last(),
+        "slope_per_day": slope,
+    })
+    return periods, trends
+
+
+def price_gaps(frame, groups=None, frequency=ANALYTICS_GAP_FREQUENCY):
+    """
+    Compare the prices of competing listings over time.
+
+    Prices are aligned to buckets of `frequency`, carried forward while a
+    listing has no newer check, and compared with the cheapest listing of the
+    same group in each bucket.
+
+    Args:
+        frame (pandas.DataFrame): History from load_history
+        groups (dict, optional): Group name by product_id; listings of the same ASIN
+                                 across marketplaces are grouped if not given
+        frequency (str): Bucket size as a pandas offset
+
+    Returns:
+        pandas.DataFrame: One row per group, bucket and product with price, group_min,
+                          gap_pct (price above the cheapest listing) and cheapest
+    """
+    group_key = frame["asin"] if groups is None else frame["product_id"].astype(str).map(groups)
+    bucketed = pd.DataFrame({
+        "group": group_key,
+        "bucket": frame["timestamp"].dt.floor(frequency),
+        "product_id": frame["product_id"].astype(str),
+        "price": frame["price_numeric"],
+    }).dropna(subset=["group"])
+
+    results = []
+    # Groups are small, so each gets its own dense bucket x listing matrix
+    for group, rows in bucketed.groupby("group", sort=False):
+        if rows["product_id"].nunique() < 2:
+            continue
+        wide = rows.pivot_table(index="bucket", columns="product_id", values="price", aggfunc="last").ffill()
+        group_min = wide.min(axis=1)
+        long = wide.reset_index().melt(id_vars="bucket", var_name="product_id", value_name="price")
+        long = long.dropna(subset=["price"])
+        long["group"] = group
+        long["group_min"] = long["bucket"].map(group_min)
+        results.append(long)
+
+    if not results:
+        return pd.DataFrame(columns=["group", "bucket", "product_id", "price", "group_min", "gap_pct", "cheapest"])
+    gaps = pd.concat(results, ignore_index=True)
+    gaps["gap_pct"] = gaps["price"] / gaps["group_min"] - 1
+    gaps["cheapest"] = gaps["gap_pct"] <= 0
+    return gaps[["group", "bucket", "product_id", "price", "group_min", "gap_pct", "cheapest"]]
+
+
+def summarize(frame):
+    """
+    Per-product summary of the loaded history.
+
+    Returns:
+        pandas.DataFrame: first_seen, last_seen, checks, last_price, min_price, max_price,
+                          mean_price, volatility (std of log returns) and last_discount by product
+    """
+    log_returns = np.log(frame["price_numeric"].where(frame["price_numeric"] > 0)).groupby(
+        frame["product_id"], observed=True, sort=False
+    ).diff()
+    grouped = frame.assign(log_return=log_returns).groupby("product_id", observed=True)
+    return grouped.agg(
+        first_seen=("timestamp", "first"),
+        last_seen=("timestamp", "last"),
+        checks=("price_numeric", "size"),
+        last_price=("price_numeric", "last"),
+        min_price=("price_numeric", "min"),
+        max_price=("price_numeric", "max"),
+        mean_price=("price_numeric", "mean"),
+        volatility=("log_return", "std"),
+        last_discount=("discount_pct", "last"),
+    )
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import weakref
+import datetime
+import itertools
+from contextlib import asynccontextmanager
+from crawl4ai import AsyncWebCrawler
+
+from config import BROWSER_POOL_SIZE, BROWSER_MAX_USES, BROWSER_MAX_RSS_MB
+from src.scraper import get_browser_config
+from src.browser_profiles import get_browser_profile
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:  # Memory based recycling is disabled without psutil
+    psutil = None
+
+
+class BrowserLease:
+    """A page session leased from a pooled browser."""
+
+    def __init__(self, crawler, session_id):
+        self.crawler = crawler
+        self.session_id = session_id
+        self.session_ids = [session_id]
+
+    def session(self, suffix):
+        """Return a derived session ID that is cleaned up together with the lease."""
+        session_id = f"{self.session_id}{suffix}"
+        self.session_ids.append(session_id)
+        return session_id
+
+
+class _PooledBrowser:
+    """A warm crawler instance, the processes it started and the number of leases it has served."""
+
+    def __init__(self, crawler, pids=()):
+        self.crawler = crawler
+        self.pids = pids
+        self.uses = 0
+
+    def rss_mb(self):
+        """Return the RSS of this browser's process tree in MB, or None if unknown."""
+        if psutil is None or not self.pids:
+            return None
+        total = 0
+        for pid in self.pids:
+            try:
+                process = psutil.Process(pid)
+                total += sum(p.memory_info().rss for p in [process, *process.children(recursive=True)])
+            except psutil.Error:
+                # The driver is gone, so the browser is dead or closing
+                continue
+        return total / (1024 * 1024)
+
+
+# Browser starts are serialized per event loop so the processes each one spawns can be told apart
+_start_locks = weakref.WeakKeyDictionary()
+
+
+def _start_lock():
+    loop = asyncio.get_running_loop()
+    if loop not in _start_locks:
+        _start_locks[loop] = asyncio.Lock()
+    return _start_locks[loop]
+
+
+def _child_pids():
+    try:
+        return {child.pid for child in psutil.Process().children()}
+    except psutil.Error:
+        return set()
+
+
+class BrowserPool:
+    """
+    Pool of long-lived browsers shared across tracking ticks.
+
+    Browsers are started lazily up to `size`, lease a fresh session (browser
+    context and page) per extraction call, and are recycled after `max_uses`
+    leases or when the RSS of its own process tree passes `max_rss_mb`. Every
+    browser of a pool is started with the same browser profile.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES,
+                 max_rss_mb=BROWSER_MAX_RSS_MB, browser_config_factory=get_browser_config, profile=None):
+        self.profile = get_browser_profile(profile)
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self.browser_config_factory = browser_config_factory
+        self._idle = []
+        self._browsers = set()
+        self._created = 0
+        self._condition = None
+        self._session_counter = itertools.count()
+        self._closed = False
+
+    def _ensure_loop_state(self):
+        # asyncio primitives are created on first use so they bind to the running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+    async def _start_browser(self):
+        crawler = AsyncWebCrawler(config=self.browser_config_factory(self.profile))
+        await self.profile.install(crawler)
+        if psutil is None:
+            await crawler.start()
+            browser = _PooledBrowser(crawler)
+        else:
+            # The Playwright driver the crawler spawns is a new child of this process, Chromium runs under it
+            async with _start_lock():
+                before = _child_pids()
+                await crawler.start()
+                browser = _PooledBrowser(crawler, tuple(_child_pids() - before))
+        self._browsers.add(browser)
+        return browser
+
+    async def _acquire(self):
+        self._ensure_loop_state()
+        async with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                await self._condition.wait()
+
+        # Start the browser outside the lock so other leases are not blocked on startup
+        try:
+            return await self._start_browser()
+        except Exception:
+            async with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    async def _close_browser(self, browser):
+        self._browsers.discard(browser)
+        try:
+            await browser.crawler.close()
+        except Exception as e:
+            logger.warning("Error closing pooled browser", extra={"error": str(e)})
+
+    def browser_rss_mb(self):
+        """Return the RSS in MB of every running browser of the pool, skipping unknown ones."""
+        sizes = (browser.rss_mb() for browser in list(self._browsers))
+        return [rss_mb for rss_mb in sizes if rss_mb is not None]
+
+    async def _release(self, browser, browser_lease, healthy):
+        browser.uses += 1
+
+        for session_id in browser_lease.session_ids:
+            try:
+                await browser.crawler.crawler_strategy.kill_session(session_id)
+            except Exception:
+                # The session may already be gone if the page crashed
+                pass
+
+        rss_mb = browser.rss_mb()
+        recycle = (
+            not healthy
+            or self._closed
+            or browser.uses >= self.max_uses
+            or (rss_mb is not None and rss_mb > self.max_rss_mb)
+        )
+        if recycle:
+            await self._close_browser(browser)
+
+        async with self._condition:
+            if recycle:
+                self._created -= 1
+            else:
+                self._idle.append(browser)
+            self._condition.notify()
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        Lease a page session from a warm browser.
+
+        Yields:
+            BrowserLease: The crawler to use and the session ID reserved for this call
+        """
+        with metrics.time_stage("browser_acquire"):
+            browser = await self._acquire()
+        session_id = f"price_tracker_{datetime.datetime.now().timestamp()}_{next(self._session_counter)}"
+        browser_lease = BrowserLease(browser.crawler, session_id)
+        healthy = True
+        try:
+            yield browser_lease
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            await self._release(browser, browser_lease, healthy)
+
+    async def close(self):
+        """Shut down every idle browser. Leased browsers are closed when they are returned."""
+        self._closed = True
+        if self._condition is None:
+            return
+        async with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._condition.notify_all()
+        for browser in idle:
+            await self._close_browser(browser)
+
+
+# One pool per browser profile, created on first use so unused profiles start no browsers
+_browser_pools = {}
+
+
+def get_browser_pool(profile=None):
+    """Return the shared browser pool of a profile, the configured default if not given."""
+    name = get_browser_profile(profile).name
+    if name not in _browser_pools:
+        _browser_pools[name] = BrowserPool(profile=name)
+    return _browser_pools[name]
+
+
+async def close_browser_pools():
+    """Shut down the browsers of every profile; the next lease starts a new pool."""
+    pools = list(_browser_pools.values())
+    _browser_pools.clear()
+    for pool in pools:
+        await pool.close()
+
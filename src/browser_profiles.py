@@ -0,0 +1,127 @@
+import re
+from urllib.parse import urlsplit
+from crawl4ai import CrawlerRunConfig, CacheMode
+
+from config import (
+    BROWSER_PROFILE, LEAN_BLOCKED_RESOURCE_TYPES, LEAN_FIRST_PARTY_HOST_PATTERN,
+    LEAN_BLOCKED_URL_PATTERNS, LEAN_WAIT_FOR_SELECTOR, LEAN_PAGE_TIMEOUT
+)
+
+
+class BrowserProfile:
+    """
+    How pages are loaded by the browsers of a pool.
+
+    A lean profile aborts requests for blocked resource types, ads and hosts that
+    are not first party, and after DOMContentLoaded waits only until
+    `wait_for_selector` is present. The full profile loads pages like a regular browser.
+    """
+
+    def __init__(self, name, blocked_resource_types=(), first_party_host_pattern=None,
+                 blocked_url_patterns=(), wait_until="domcontentloaded", wait_for_selector=None,
+                 page_timeout=None, verbose=True):
+        self.name = name
+        self.blocked_resource_types = frozenset(blocked_resource_types)
+        self.first_party_host = re.compile(first_party_host_pattern) if first_party_host_pattern else None
+        self.blocked_url_patterns = tuple(blocked_url_patterns)
+        self.wait_until = wait_until
+        self.wait_for_selector = wait_for_selector
+        self.page_timeout = page_timeout
+        self.verbose = verbose
+
+    @property
+    def blocks_requests(self):
+        return bool(self.blocked_resource_types or self.first_party_host or self.blocked_url_patterns)
+
+    def should_block(self, url, resource_type, is_main_document=False):
+        """Whether a request made while loading a page is aborted. The page itself is never blocked."""
+        if is_main_document:
+            return False
+        if resource_type in self.blocked_resource_types:
+            return True
+        if any(pattern in url for pattern in self.blocked_url_patterns):
+            return True
+        if self.first_party_host is not None and not url.startswith(("data:", "blob:", "raw:")):
+            host = urlsplit(url).hostname or ""
+            return self.first_party_host.search(host) is None
+        return False
+
+    def run_config(self, session_id, wait_for_selector=True, **kwargs):
+        """
+        Build the run config for loading a page with this profile.
+
+        Args:
+            session_id (str): Session the page is loaded in
+            wait_for_selector (bool | str): Wait for the profile's selector (True), a
+                specific CSS selector (str), or not at all (False)
+            **kwargs: Extra CrawlerRunConfig settings
+
+        Returns:
+            CrawlerRunConfig: Fresh-fetch config for the page
+        """
+        if wait_for_selector is True:
+            wait_for_selector = self.wait_for_selector
+        if wait_for_selector:
+            kwargs.setdefault("wait_for", f"css:{wait_for_selector}")
+        if self.page_timeout:
+            kwargs.setdefault("page_timeout", int(self.page_timeout * 1000))
+        return CrawlerRunConfig(
+            cache_mode=CacheMode.BYPASS,  # Always get fresh data
+            session_id=session_id,
+            wait_until=self.wait_until,
+            verbose=self.verbose,
+            **kwargs,
+        )
+
+    async def install(self, crawler):
+        """Register the request blocking hook of this profile on a crawler before it starts."""
+        if not self.blocks_requests:
+            return
+
+        async def block_request(route):
+            request = route.request
+            is_main_document = request.is_navigation_request() and request.frame.parent_frame is None
+            if self.should_block(request.url, request.resource_type, is_main_document):
+                await route.abort()
+            else:
+                await route.continue_()
+
+        async def on_page_context_created(page, context, **kwargs):
+            # Sessions can share a context; route it once
+            if not getattr(context, "_profile_routed", False):
+                context._profile_routed = True
+                await context.route("**/*", block_request)
+            return page
+
+        crawler.crawler_strategy.set_hook("on_page_context_created", on_page_context_created)
+
+
+BROWSER_PROFILES = {
+    "lean": BrowserProfile(
+        "lean",
+        blocked_resource_types=LEAN_BLOCKED_RESOURCE_TYPES,
+        first_party_host_pattern=LEAN_FIRST_PARTY_HOST_PATTERN,
+        blocked_url_patterns=LEAN_BLOCKED_URL_PATTERNS,
+        wait_until="domcontentloaded",
+        wait_for_selector=LEAN_WAIT_FOR_SELECTOR,
+        page_timeout=LEAN_PAGE_TIMEOUT,
+        verbose=False,
+    ),
+    "full": BrowserProfile("full"),
+}
+
+
+def get_browser_profile(name=None):
+    """
+    Look up a browser profile by name.
+
+    Args:
+        name (str, optional): Profile name, the configured default if not given
+
+    Returns:
+        BrowserProfile: The profile
+    """
+    name = name or BROWSER_PROFILE
+    if name not in BROWSER_PROFILES:
+        raise ValueError(f"Unknown browser profile '{name}', expected one of {sorted(BROWSER_PROFILES)}")
+    return BROWSER_PROFILES[name]
@@ -0,0 +1,194 @@
+import json
+import hashlib
+import datetime
+import threading
+
+from config import HISTORY_DELTA_WRITES, HISTORY_HEARTBEAT_INTERVAL
+from src.history_store import to_history_row
+from src.snapshot_store import strip_volatile_markup
+from src.metrics import metrics
+
+history_observations = metrics.counter(
+    "history_observations_total", "Price checks by whether they were stored as a change, a heartbeat or skipped",
+    ["result"],
+)
+
+# Fields that define a product's state; a check differing in any of them is stored as a change
+STATE_FIELDS = ("product_name", "price", "price_numeric", "discount", "bought_30_days", "rating", "num_ratings")
+
+
+def page_hash(html):
+    """Hash a fetched page, ignoring the scripts, styles and comments that change on every request."""
+    return hashlib.sha256(strip_volatile_markup(html).encode("utf-8", errors="replace")).hexdigest()
+
+
+def state_hash(document):
+    """Hash the state fields of a price document or local history row."""
+    # Projected onto the local history columns so documents and rows read back from either store compare equal
+    row = to_history_row(document)
+    return hashlib.sha256(
+        json.dumps([row[field] for field in STATE_FIELDS], default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class ProductState:
+    """The current state of one product: its latest document and how long it has lasted."""
+
+    def __init__(self, state_hash, document, first_seen, last_seen, last_written, page_hash=None, parsed=None):
+        self.state_hash = state_hash
+        self.document = document
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.last_written = last_written
+        self.page_hash = page_hash
+        self.parsed = parsed
+
+
+class ChangeTracker:
+    """
+    Decides which price checks are stored.
+
+    A check is stored when its state fields differ from the product's current
+    state (a "change"), and again every `heartbeat_interval` seconds while the
+    state lasts (a "heartbeat"). Every stored document carries the first_seen
+    and last_seen times of its state, so the history is the list of state
+    transitions and the latest heartbeat of each state gives how long it lasted.
+
+    The parsed fields of the last page are kept too, so a page identical to the
+    previous check of the product is not parsed again.
+    """
+
+    def __init__(self, enabled=HISTORY_DELTA_WRITES, heartbeat_interval=HISTORY_HEARTBEAT_INTERVAL):
+        self.enabled = enabled
+        self.heartbeat_interval = datetime.timedelta(seconds=heartbeat_interval)
+        self._states = {}
+        self._loaded = set()
+        # Stored states are loaded in a worker thread
+        self._lock = threading.Lock()
+
+    def cached_extraction(self, product_id, page_hash):
+        """
+        Return a copy of the fields parsed from the product's previous page if this page is identical.
+
+        Returns:
+            dict: The parsed fields, or None if the page has to be parsed
+        """
+        if not self.enabled or product_id is None:
+            return None
+        state = self._states.get(product_id)
+        if state is None or state.page_hash != page_hash or state.parsed is None:
+            return None
+        return dict(state.parsed)
+
+    def remember_page(self, product_id, page_hash, parsed):
+        """Keep the fields parsed from a product's page for the next check."""
+        if not self.enabled or product_id is None:
+            return
+        with self._lock:
+            state = self._states.get(product_id)
+            if state is not None:
+                state.page_hash = page_hash
+                state.parsed = dict(parsed)
+            else:
+                # No check was stored yet; the page is remembered once the first one is
+                self._states[product_id] = ProductState(None, None, None, None, None, page_hash, dict(parsed))
+
+    def forget(self, product_id):
+        """Drop a product's state so it is reloaded from storage, e.g. after another worker checked it."""
+        with self._lock:
+            self._states.pop(product_id, None)
+            self._loaded.discard(product_id)
+
+    def is_loaded(self, product_id):
+        """Whether the product's stored state was loaded."""
+        return product_id in self._loaded
+
+    def ensure_loaded(self, product_id):
+        """Load a product's latest stored state the first time it is checked, so a restart is not a change."""
+        if product_id in self._loaded:
+            return
+
+        from src.mongodb_handler import mongodb_handler
+
+        latest = mongodb_handler.get_latest_price(product_id)
+        if latest is None:
+            from src.data_storage import local_history_store
+
+            rows = local_history_store.read_last(product_id, 1)
+            latest = rows[-1] if rows else None
+
+        with self._lock:
+            self._loaded.add(product_id)
+            state = self._states.get(product_id)
+            if latest is None or (state is not None and state.state_hash is not None):
+                return
+            if state is None:
+                state = self._states[product_id] = ProductState(None, None, None, None, None)
+            state.state_hash = state_hash(latest)
+            state.first_seen = latest.get("first_seen") or latest["timestamp"]
+            state.last_seen = latest.get("last_seen") or latest["timestamp"]
+            state.last_written = latest["timestamp"]
+
+    def observe(self, document):
+        """
+        Record a price check and decide whether to store it.
+
+        Args:
+            document (dict): The price document of the check
+
+        Returns:
+            dict: The document to store with its first_seen, last_seen and record_type
+                  ("change" or "heartbeat") set, or None if the check is not stored
+        """
+        product_id = document["product_id"]
+        timestamp = document["timestamp"]
+        if not self.enabled:
+            return document
+
+        current_hash = state_hash(document)
+        with self._lock:
+            state = self._states.get(product_id)
+            if state is None:
+                state = self._states[product_id] = ProductState(None, None, None, None, None)
+
+            if state.state_hash != current_hash:
+                record_type = "change"
+                state.state_hash = current_hash
+                state.first_seen = timestamp
+            elif state.last_written is None or timestamp - state.last_written >= self.heartbeat_interval:
+                record_type = "heartbeat"
+            else:
+                record_type = None
+
+            state.document = document
+            state.last_seen = timestamp
+            if record_type is None:
+                history_observations.inc(result="unchanged")
+                return None
+            state.last_written = timestamp
+
+        history_observations.inc(result=record_type)
+        return dict(document, first_seen=state.first_seen, last_seen=timestamp, record_type=record_type)
+
+    def pending_heartbeats(self):
+        """
+        Return a heartbeat for every state seen since it was last stored.
+
+        Written on shutdown so the stored last_seen of each state is not up to a
+        heartbeat interval behind.
+        """
+        heartbeats = []
+        with self._lock:
+            for state in self._states.values():
+                if state.document is None or state.last_written is None or state.last_seen <= state.last_written:
+                    continue
+                heartbeats.append(dict(
+                    state.document, timestamp=state.last_seen, first_seen=state.first_seen,
+                    last_seen=state.last_seen, record_type="heartbeat",
+                ))
+                state.last_written = state.last_seen
+        return heartbeats
+
+
+# Create a singleton instance
+change_tracker = ChangeTracker()
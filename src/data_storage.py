@@ -1,46 +1,40 @@
-import os
-import csv
+import asyncio
 import datetime
 from config import BASE_URL
+from src.utils import split_product_id
 from src.mongodb_handler import mongodb_handler
+from src.price_cache import price_state_cache
+from src.change_tracker import change_tracker
+from src.history_store import LocalHistoryStore, write_csv_rows, to_history_row
+from src.metrics import metrics
 
 # Constants
 # Define the CSV filename
 CSV_FILENAME = "competitor_history.csv"
 
-def save_price_to_csv(price_value, price_string, product_name, discount, rating, num_ratings, timestamp):
-    """
-    Save the price data to a CSV file.
-    
-    Args:
-        price_value (float): Numeric price value for calculations
-        price_string (str): Original price string with currency
-        product_name (str): Name of the product
-        discount (str): Discount percentage if available
-        rating (str): Product rating
-        num_ratings (str): Number of ratings
-        timestamp (datetime): When the price was checked
-    """
-    file_exists = os.path.isfile(CSV_FILENAME)
-    
-    with open(CSV_FILENAME, mode='a', newline='', encoding='utf-8') as file:
-        fieldnames = ['timestamp', 'product_name', 'price', 'price_numeric', 'discount', 'rating', 'num_ratings']
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        writer.writerow({
-            'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'product_name': product_name,
-            'price': price_string,
-            'price_numeric': price_value,
-            'discount': discount,
-            'rating': rating,
-            'num_ratings': num_ratings
-        })
+# Buffered local history sink used by save_price_record
+local_history_store = LocalHistoryStore(CSV_FILENAME)
+
+def build_price_document(price_value, price_string, product_name, discount, rating, num_ratings, timestamp, product_id=None, bought_30_days=None, snapshot_id=None):
+    """Build the price_history document stored for one price check."""
+    marketplace, asin = split_product_id(product_id)
+    return {
+        'product_id': product_id,
+        'asin': asin,
+        'marketplace': marketplace,
+        'timestamp': timestamp,
+        'product_name': product_name,
+        'price': price_string,
+        'price_numeric': price_value,
+        'discount': discount,
+        'bought_30_days': bought_30_days,
+        'rating': rating,
+        'num_ratings': num_ratings,
+        # Content hash of the stored page, for re-extraction with new selectors
+        'snapshot_id': snapshot_id
+    }
 
-def save_price_to_mongodb(price_value, price_string, product_name, discount, rating, num_ratings, timestamp):
+def save_price_to_mongodb(price_value, price_string, product_name, discount, rating, num_ratings, timestamp, product_id=None):
     """
     Save the price data to MongoDB and CSV.
     
@@ -52,26 +46,82 @@ def save_price_to_mongodb(price_value, price_string, product_name, discount, rat
         rating (str): Product rating
         num_ratings (str): Number of ratings
         timestamp (datetime): When the price was checked
+        product_id (str, optional): Product key ('<marketplace>:<ASIN>') the record belongs to
     """
     from src.mongodb_handler import mongodb_handler
     
     # Save to CSV first
-    save_price_to_csv(price_value, price_string, product_name, discount, rating, num_ratings, timestamp)
+    save_price_to_csv(
+        price_value, price_string, product_name, discount,
+        rating=rating, num_ratings=num_ratings, timestamp=timestamp, product_id=product_id
+    )
     
     # Then save to MongoDB
-    price_data = {
-        'timestamp': timestamp,
-        'product_name': product_name,
-        'price': price_string,
-        'price_numeric': price_value,
-        'discount': discount,
-        'rating': rating,
-        'num_ratings': num_ratings
-    }
+    price_data = build_price_document(
+        price_value, price_string, product_name, discount, rating, num_ratings, timestamp, product_id
+    )
     
     mongodb_handler.insert_price_data(price_data)  # Changed from insert_price to insert_price_data
+    price_state_cache.record(product_id, price_value, timestamp)
 
-def save_price_to_csv(price_value, price_string, product_name, discount, bought_30_days=None, rating=None, num_ratings=None, timestamp=None):
+async def save_price_record(price_value, price_string, product_name, discount, rating, num_ratings, timestamp, product_id=None, bought_30_days=None, snapshot_id=None):
+    """
+    Save the price data to the buffered local history and the batched MongoDB write pipeline.
+    
+    Unlike save_price_to_mongodb, both writes happen in batches off the event loop, so
+    the caller only waits when the MongoDB write queue is full. With delta writes on,
+    checks that match the product's current state are only stored as periodic heartbeats.
+    
+    Args:
+        Same as save_price_to_mongodb, plus:
+        bought_30_days (str, optional): Number of items bought in last 30 days
+        snapshot_id (str, optional): Content hash of the stored page snapshot
+    """
+    price_data = build_price_document(
+        price_value, price_string, product_name, discount, rating, num_ratings, timestamp,
+        product_id, bought_30_days, snapshot_id
+    )
+    
+    if change_tracker.enabled and not change_tracker.is_loaded(product_id):
+        await asyncio.to_thread(change_tracker.ensure_loaded, product_id)
+    # Loaded off the event loop here, so check_price_change finds the product cached
+    if price_value is not None and not price_state_cache.is_loaded(product_id):
+        await asyncio.to_thread(price_state_cache.ensure_loaded, product_id)
+    price_state_cache.record(product_id, price_value, timestamp)
+    
+    price_data = change_tracker.observe(price_data)
+    if price_data is not None:
+        await _store_price_document(price_data)
+
+async def flush_pending_heartbeats():
+    """Store a final heartbeat for every state seen since its last stored check, e.g. on shutdown."""
+    for price_data in change_tracker.pending_heartbeats():
+        await _store_price_document(price_data)
+
+async def flush_price_records():
+    """
+    Write the buffered local history and every price record queued for MongoDB, and wait for both.
+    
+    save_price_record only queues its writes, so single-run callers whose event
+    loop ends right after a check call this before returning.
+    """
+    from src.write_pipeline import mongo_write_pipeline
+    
+    await mongo_write_pipeline.flush()
+    await asyncio.to_thread(local_history_store.flush)
+
+async def _store_price_document(price_data):
+    from src.write_pipeline import mongo_write_pipeline
+    
+    local_history_store.append(price_data)
+    if local_history_store.flush_due():
+        await asyncio.to_thread(local_history_store.flush)
+    
+    # Only waits when the write queue is full
+    with metrics.time_stage("mongo_enqueue"):
+        await mongo_write_pipeline.put(price_data)
+
+def save_price_to_csv(price_value, price_string, product_name, discount, bought_30_days=None, rating=None, num_ratings=None, timestamp=None, product_id=None):
     """
     Save the price data to a CSV file.
     
@@ -84,26 +134,10 @@ def save_price_to_csv(price_value, price_string, product_name, discount, bought_
         rating (float, optional): Product rating
         num_ratings (int, optional): Number of ratings
         timestamp (datetime, optional): When the price was checked
+        product_id (str, optional): Product key the record belongs to
     """
-    file_exists = os.path.isfile(CSV_FILENAME)
-    
-    with open(CSV_FILENAME, mode='a', newline='', encoding='utf-8') as file:
-        fieldnames = [
-            'timestamp', 'product_name', 'price', 'price_numeric', 
-            'discount', 'bought_30_days', 'rating', 'num_ratings'
-        ]
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        writer.writerow({
-            'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp else datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'product_name': product_name,
-            'price': price_string,
-            'price_numeric': price_value,
-            'discount': discount,
-            'bought_30_days': bought_30_days or 'N/A',
-            'rating': rating or 'N/A',
-            'num_ratings': num_ratings or 'N/A'
-        })
\ No newline at end of file
+    with metrics.time_stage("csv_write"):
+        write_csv_rows(CSV_FILENAME, [to_history_row(build_price_document(
+            price_value, price_string, product_name, discount, rating, num_ratings,
+            timestamp or datetime.datetime.now(), product_id, bought_30_days
+        ))])
@@ -0,0 +1,229 @@
+import re
+import sqlite3
+import hashlib
+import random
+from array import array
+from collections import OrderedDict
+from urllib.parse import unquote
+
+from config import DEDUP_MAX_ENTRIES, DEDUP_NUM_PERM, DEDUP_BANDS, DEDUP_SIMILARITY_THRESHOLD
+from src.utils import extract_asin
+
+# Mersenne prime used by the MinHash permutations
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_DIGEST_MASK = (1 << 64) - 1
+
+
+def normalize_title(title: str) -> str:
+    """Lower-case a product title and strip punctuation and repeated whitespace."""
+    title = re.sub(r"[^\w\s]", " ", (title or "").lower())
+    return re.sub(r"\s+", " ", title).strip()
+
+
+def _shingles(text: str, size: int = 4):
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHasher:
+    """MinHash signatures of character shingles, for estimating Jaccard similarity of titles."""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, seed: int = 1):
+        generator = random.Random(seed)
+        self.num_perm = num_perm
+        self._permutations = [
+            (generator.randint(1, _PRIME - 1), generator.randint(0, _PRIME - 1)) for _ in range(num_perm)
+        ]
+
+    def signature(self, text: str) -> array:
+        hashes = [_hash64(shingle) for shingle in _shingles(text)]
+        return array("Q", (
+            min(((a * value + b) % _PRIME) & _MAX_HASH for value in hashes)
+            for a, b in self._permutations
+        ))
+
+    @staticmethod
+    def similarity(first: array, second: array) -> float:
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+class _MemoryStore:
+    """
+    Bounded in-memory store; the oldest entries are evicted beyond `max_entries`.
+
+    Only signatures are kept per entry. Band keys are integers recomputed from
+    the signature on eviction, and a bucket holds a bare item ID until a second
+    entry shares it, which is the case for almost every bucket.
+    """
+
+    def __init__(self, max_entries: int, band_keys):
+        self.max_entries = max_entries
+        self._band_keys = band_keys
+        self._asins = OrderedDict()
+        self._signatures = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+
+    def has_asin(self, asin):
+        return asin in self._asins
+
+    def add_asin(self, asin):
+        self._asins[asin] = None
+        if len(self._asins) > self.max_entries:
+            self._asins.popitem(last=False)
+
+    def candidates(self, band_keys):
+        found = set()
+        for key in band_keys:
+            bucket = self._buckets.get(key)
+            if isinstance(bucket, set):
+                found.update(bucket)
+            elif bucket is not None:
+                found.add(bucket)
+        return [(item_id, self._signatures[item_id]) for item_id in found if item_id in self._signatures]
+
+    def add_signature(self, signature, band_keys):
+        item_id = self._next_id
+        self._next_id += 1
+        self._signatures[item_id] = signature
+        for key in band_keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = item_id
+            elif isinstance(bucket, set):
+                bucket.add(item_id)
+            else:
+                self._buckets[key] = {bucket, item_id}
+
+        if len(self._signatures) > self.max_entries:
+            old_id, old_signature = self._signatures.popitem(last=False)
+            for key in self._band_keys(old_signature):
+                bucket = self._buckets.get(key)
+                if bucket == old_id:
+                    del self._buckets[key]
+                elif isinstance(bucket, set):
+                    bucket.discard(old_id)
+                    if len(bucket) == 1:
+                        self._buckets[key] = bucket.pop()
+
+    def close(self):
+        pass
+
+
+class _SqliteStore:
+    """Persistent store for crawls that span processes or outgrow memory."""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS asins (asin TEXT PRIMARY KEY);"
+            "CREATE TABLE IF NOT EXISTS signatures (item_id INTEGER PRIMARY KEY, signature BLOB);"
+            "CREATE TABLE IF NOT EXISTS bands (band_key TEXT, item_id INTEGER);"
+            "CREATE INDEX IF NOT EXISTS bands_band_key ON bands (band_key);"
+        )
+
+    def has_asin(self, asin):
+        return self._connection.execute("SELECT 1 FROM asins WHERE asin = ?", (asin,)).fetchone() is not None
+
+    def add_asin(self, asin):
+        self._connection.execute("INSERT OR IGNORE INTO asins (asin) VALUES (?)", (asin,))
+        self._connection.commit()
+
+    @staticmethod
+    def _band_key_text(key):
+        # Stored as "<band>:<hex digest>", the format written before band keys were integers
+        return f"{key >> 64}:{(key & _DIGEST_MASK).to_bytes(8, 'big').hex()}"
+
+    def candidates(self, band_keys):
+        placeholders = ",".join("?" * len(band_keys))
+        rows = self._connection.execute(
+            f"SELECT DISTINCT s.item_id, s.signature FROM bands b JOIN signatures s ON s.item_id = b.item_id "
+            f"WHERE b.band_key IN ({placeholders})",
+            [self._band_key_text(key) for key in band_keys],
+        ).fetchall()
+        return [(item_id, array("Q", bytes(blob))) for item_id, blob in rows]
+
+    def add_signature(self, signature, band_keys):
+        cursor = self._connection.execute(
+            "INSERT INTO signatures (signature) VALUES (?)", (signature.tobytes(),)
+        )
+        self._connection.executemany(
+            "INSERT INTO bands (band_key, item_id) VALUES (?, ?)",
+            [(self._band_key_text(key), cursor.lastrowid) for key in band_keys],
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class ProductDeduplicator:
+    """
+    Detects duplicate products across a search crawl.
+
+    Products are matched first on the ASIN parsed from their URL. Products
+    without an ASIN are matched on their normalized title with MinHash and
+    locality-sensitive hashing, which also catches titles that differ slightly
+    between listings and sponsored slots. Memory is bounded by `max_entries`, or
+    the store is kept on disk when `path` is given.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = DEDUP_MAX_ENTRIES, num_perm: int = DEDUP_NUM_PERM,
+                 bands: int = DEDUP_BANDS, threshold: float = DEDUP_SIMILARITY_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.store = _SqliteStore(path) if path else _MemoryStore(max_entries, self._band_keys)
+
+    def _band_keys(self, signature):
+        # The band number sits above the 64-bit digest so equal rows in different bands never share a bucket
+        return [
+            (band << 64) | int.from_bytes(hashlib.blake2b(
+                signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8
+            ).digest(), "big")
+            for band in range(self.bands)
+        ]
+
+    def check_and_add(self, product: dict) -> bool:
+        """
+        Check a product against everything seen so far and remember it.
+
+        Args:
+            product (dict): Extracted product with 'url' and 'name'
+
+        Returns:
+            bool: True if the product is a duplicate
+        """
+        # Sponsored slots link through a redirect with the product path URL-encoded
+        asin = extract_asin(unquote(product.get("url") or ""))
+        if asin and self.store.has_asin(asin):
+            return True
+
+        title = normalize_title(product.get("name", ""))
+        signature = self.hasher.signature(title) if title else None
+        band_keys = self._band_keys(signature) if title else []
+
+        if not asin and title:
+            for _, candidate in self.store.candidates(band_keys):
+                if MinHasher.similarity(signature, candidate) >= self.threshold:
+                    return True
+
+        if asin:
+            self.store.add_asin(asin)
+        if title:
+            # Titles of ASIN products are kept too, so listings without an ASIN can match them
+            self.store.add_signature(signature, band_keys)
+        return False
+
+    def close(self):
+        """Release the underlying store."""
+        self.store.close()
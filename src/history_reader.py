@@ -0,0 +1,216 @@
+import os
+import csv
+import json
+import logging
+import bisect
+import hashlib
+import datetime
+
+from config import HISTORY_INDEX_STRIDE
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Size of the blocks read backwards from the end of the file
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Leading bytes of an indexed file hashed to notice when it was replaced; appends never change them
+FINGERPRINT_SIZE = 4096
+
+
+def _read_header(file):
+    """Return the CSV header of an open binary file and the offset of the first data row."""
+    file.seek(0)
+    header_line = file.readline()
+    fieldnames = next(csv.reader([header_line.decode('utf-8')]), [])
+    return fieldnames, len(header_line)
+
+
+def _parse_line(line, fieldnames):
+    values = next(csv.reader([line.decode('utf-8')]), None)
+    if not values:
+        return None
+    return dict(zip(fieldnames, values))
+
+
+def _iter_lines_backwards(file, stop_offset, block_size=TAIL_BLOCK_SIZE):
+    """Yield the complete lines of a binary file from the last one back to `stop_offset`."""
+    file.seek(0, os.SEEK_END)
+    position = file.tell()
+    remainder = b''
+
+    while position > stop_offset:
+        read_size = min(block_size, position - stop_offset)
+        position -= read_size
+        file.seek(position)
+        block = file.read(read_size) + remainder
+        lines = block.split(b'\n')
+        # The first piece may be the tail of a line that starts in the previous block
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            if line.strip():
+                yield line
+
+    if remainder.strip():
+        yield remainder
+
+
+def read_last_records(path, n, product_id=None, predicate=None):
+    """
+    Read the last `n` records of a CSV history file by seeking backwards from its end.
+
+    Only the tail of the file is read, so the cost depends on how far back the
+    records are, not on the size of the history.
+
+    Args:
+        path (str): Path to the CSV history file
+        n (int): Number of records to return
+        product_id (str, optional): Only return records of this product
+        predicate (callable, optional): Only return records for which predicate(row) is true
+
+    Returns:
+        list: Matching rows as dicts, oldest first
+    """
+    if n <= 0 or not os.path.isfile(path):
+        return []
+
+    records = []
+    with open(path, mode='rb') as file:
+        fieldnames, data_offset = _read_header(file)
+        for line in _iter_lines_backwards(file, data_offset):
+            row = _parse_line(line, fieldnames)
+            if row is None:
+                continue
+            if product_id is not None and row.get('product_id') != product_id:
+                continue
+            if predicate is not None and not predicate(row):
+                continue
+            records.append(row)
+            if len(records) >= n:
+                break
+
+    records.reverse()
+    return records
+
+
+def _index_path(path):
+    return f"{path}.idx"
+
+
+def _empty_index():
+    return {"scanned_to": 0, "rows_since_entry": 0, "entries": []}
+
+
+def _fingerprint(file, scanned_to):
+    file.seek(0)
+    return hashlib.blake2b(file.read(min(scanned_to, FINGERPRINT_SIZE)), digest_size=8).hexdigest()
+
+
+def update_offset_index(path, stride=HISTORY_INDEX_STRIDE):
+    """
+    Bring the sidecar offset index of a CSV history file up to date.
+
+    The index records the byte offset and timestamp of every `stride`-th row. Only
+    rows appended since the last update are scanned. The index is rebuilt if the
+    history file was truncated or replaced, which is noticed from its inode and a
+    hash of its first bytes.
+
+    Returns:
+        dict: The index ('scanned_to', 'rows_since_entry', 'entries', 'inode', 'fingerprint')
+    """
+    index_path = _index_path(path)
+    index = _empty_index()
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path, mode='r', encoding='utf-8') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            logger.warning("Rebuilding unreadable history index", extra={"path": index_path})
+
+    if not os.path.isfile(path):
+        return index
+    stat = os.stat(path)
+
+    with open(path, mode='rb') as file:
+        if (stat.st_size < index["scanned_to"] or index.get("inode") != stat.st_ino
+                or index.get("fingerprint") != _fingerprint(file, index["scanned_to"])):
+            index = _empty_index()
+        if stat.st_size == index["scanned_to"]:
+            return index
+
+        fieldnames, data_offset = _read_header(file)
+        offset = max(index["scanned_to"], data_offset)
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b'\n'):
+                # Partially written row, index it on the next update
+                break
+            if index["rows_since_entry"] % stride == 0:
+                row = _parse_line(line, fieldnames)
+                if row and row.get('timestamp'):
+                    index["entries"].append([row['timestamp'], offset])
+                    index["rows_since_entry"] = 0
+            index["rows_since_entry"] += 1
+            offset += len(line)
+        index["scanned_to"] = offset
+        index["inode"] = stat.st_ino
+        index["fingerprint"] = _fingerprint(file, offset)
+
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, mode='w', encoding='utf-8') as file:
+        json.dump(index, file)
+    os.replace(temp_path, index_path)
+    return index
+
+
+def read_time_range(path, start, end=None, product_id=None):
+    """
+    Read the records of a CSV history file within a time range.
+
+    Uses the sidecar offset index to seek close to `start` instead of scanning
+    the file from the beginning. Rows are assumed to be appended in time order.
+
+    Args:
+        path (str): Path to the CSV history file
+        start (datetime): Only records at or after this time
+        end (datetime, optional): Only records before this time
+        product_id (str, optional): Only return records of this product
+
+    Returns:
+        list: Matching rows as dicts, oldest first
+    """
+    if not os.path.isfile(path):
+        return []
+
+    index = update_offset_index(path)
+    start_key = start.strftime(TIMESTAMP_FORMAT)
+    end_key = end.strftime(TIMESTAMP_FORMAT) if end is not None else None
+
+    # Start from the last indexed row strictly before `start`; rows with equal timestamps may precede it
+    timestamps = [entry[0] for entry in index["entries"]]
+    position = bisect.bisect_left(timestamps, start_key) - 1
+
+    records = []
+    with open(path, mode='rb') as file:
+        fieldnames, data_offset = _read_header(file)
+        file.seek(index["entries"][position][1] if position >= 0 else data_offset)
+        for line in file:
+            row = _parse_line(line, fieldnames)
+            if row is None:
+                continue
+            timestamp = row.get('timestamp', '')
+            if timestamp < start_key:
+                continue
+            if end_key is not None and timestamp >= end_key:
+                break
+            if product_id is not None and row.get('product_id') != product_id:
+                continue
+            records.append(row)
+
+    return records
+
+
+def parse_timestamp(value):
+    """Parse a timestamp written to the CSV history."""
+    return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
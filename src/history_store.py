@@ -0,0 +1,296 @@
+import os
+import re
+import csv
+import glob
+import logging
+import datetime
+import itertools
+import threading
+import importlib.util
+
+from config import (
+    LOCAL_HISTORY_FORMAT, LOCAL_HISTORY_DIR, LOCAL_HISTORY_BATCH_SIZE,
+    LOCAL_HISTORY_FLUSH_INTERVAL, LOCAL_HISTORY_COMPACT_AFTER_DAYS
+)
+from src.history_reader import read_last_records, read_time_range, parse_timestamp, TIMESTAMP_FORMAT
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# The Parquet sink needs pyarrow, the CSV sink works without it. pyarrow is only imported by the
+# first Parquet read or write, so importing this module stays cheap for commands that never do one.
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+_parquet_modules = None
+
+# Fixed column order of the local history, shared by the CSV and Parquet sinks
+HISTORY_FIELDNAMES = [
+    'timestamp', 'product_name', 'price', 'price_numeric',
+    'discount', 'bought_30_days', 'rating', 'num_ratings', 'product_id'
+]
+
+
+def _parquet():
+    """Import pyarrow on first use and return (pyarrow, pyarrow.parquet, the history schema)."""
+    global _parquet_modules
+    if _parquet_modules is None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([
+            ('timestamp', pa.timestamp('us')),
+            ('product_name', pa.string()),
+            ('price', pa.string()),
+            ('price_numeric', pa.float64()),
+            ('discount', pa.string()),
+            ('bought_30_days', pa.string()),
+            ('rating', pa.string()),
+            ('num_ratings', pa.string()),
+            ('product_id', pa.string()),
+        ])
+        _parquet_modules = (pa, pq, schema)
+    return _parquet_modules
+
+
+def history_schema():
+    """Return the pyarrow schema of the Parquet history."""
+    return _parquet()[2]
+
+
+def to_history_row(document):
+    """Project a price document onto the fixed local history columns."""
+    return {
+        'timestamp': document.get('timestamp') or datetime.datetime.now(),
+        'product_name': document.get('product_name'),
+        'price': document.get('price'),
+        'price_numeric': document.get('price_numeric'),
+        'discount': document.get('discount'),
+        'bought_30_days': document.get('bought_30_days') or 'N/A',
+        'rating': document.get('rating') or 'N/A',
+        'num_ratings': document.get('num_ratings') or 'N/A',
+        'product_id': document.get('product_id') or '',
+    }
+
+
+def write_csv_rows(filename, rows):
+    """Append history rows to a CSV file with a single open, writing the header for a new file."""
+    file_exists = os.path.isfile(filename)
+
+    with open(filename, mode='a', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=HISTORY_FIELDNAMES)
+
+        if not file_exists:
+            writer.writeheader()
+
+        writer.writerows(
+            dict(row, timestamp=row['timestamp'].strftime(TIMESTAMP_FORMAT)) for row in rows
+        )
+
+
+def _partition_name(product_id):
+    # Product keys contain ':' and, for pages without an ASIN, whole URLs
+    return re.sub(r'[^A-Za-z0-9._-]', '_', product_id or 'unknown')
+
+
+class LocalHistoryStore:
+    """
+    Buffered local history sink.
+
+    Records are buffered in memory and written in batches, either appended to
+    the CSV history or, with the "parquet" format, as Parquet files partitioned
+    by date and product:
+
+        <directory>/date=YYYY-MM-DD/product=<product>/part-*.parquet
+
+    Partitions older than `compact_after_days` are compacted into a single file.
+    """
+
+    def __init__(self, csv_filename, history_format=LOCAL_HISTORY_FORMAT, directory=LOCAL_HISTORY_DIR,
+                 batch_size=LOCAL_HISTORY_BATCH_SIZE, flush_interval=LOCAL_HISTORY_FLUSH_INTERVAL,
+                 compact_after_days=LOCAL_HISTORY_COMPACT_AFTER_DAYS):
+        if history_format == "parquet" and not PYARROW_AVAILABLE:
+            logger.warning("pyarrow is not installed, writing the local history as CSV instead of Parquet")
+            history_format = "csv"
+
+        self.csv_filename = csv_filename
+        self.format = history_format
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_after_days = compact_after_days
+        self._buffer = []
+        self._last_flush = datetime.datetime.now()
+        self._part_counter = itertools.count()
+        self._lock = threading.Lock()
+        # Serializes writers, so a flush and a compaction never touch the same partition at once
+        self._write_lock = threading.Lock()
+
+    def append(self, document):
+        """Buffer a price document."""
+        with self._lock:
+            self._buffer.append(to_history_row(document))
+
+    def flush_due(self):
+        """Whether the buffer is full or the flush interval has passed."""
+        if not self._buffer:
+            return False
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return (datetime.datetime.now() - self._last_flush).total_seconds() >= self.flush_interval
+
+    def flush(self):
+        """Write every buffered record."""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = datetime.datetime.now()
+        if not rows:
+            return 0
+
+        with self._write_lock, metrics.time_stage("local_history_write"):
+            if self.format == "parquet":
+                self._write_parquet(rows)
+            else:
+                write_csv_rows(self.csv_filename, rows)
+        return len(rows)
+
+    def _partition_dir(self, date, product_id):
+        return os.path.join(
+            self.directory, f"date={date.isoformat()}", f"product={_partition_name(product_id)}"
+        )
+
+    def _write_parquet(self, rows):
+        partitions = {}
+        for row in rows:
+            key = (row['timestamp'].date(), row['product_id'])
+            partitions.setdefault(key, []).append(row)
+
+        pa, pq, schema = _parquet()
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+        for (date, product_id), partition_rows in partitions.items():
+            partition_dir = self._partition_dir(date, product_id)
+            os.makedirs(partition_dir, exist_ok=True)
+            table = pa.Table.from_pylist(partition_rows, schema=schema)
+            path = os.path.join(partition_dir, f"part-{stamp}-{next(self._part_counter)}.parquet")
+            pq.write_table(table, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+
+    def compact(self, today=None):
+        """
+        Merge the part files of every partition older than `compact_after_days` into one file.
+
+        Returns:
+            int: Number of partitions compacted
+        """
+        if self.format != "parquet" or not os.path.isdir(self.directory):
+            return 0
+
+        pa, pq, schema = _parquet()
+        today = today or datetime.date.today()
+        cutoff = today - datetime.timedelta(days=self.compact_after_days)
+        compacted = 0
+
+        for date_dir in glob.glob(os.path.join(self.directory, "date=*")):
+            try:
+                date = datetime.date.fromisoformat(os.path.basename(date_dir)[len("date="):])
+            except ValueError:
+                continue
+            if date >= cutoff:
+                continue
+
+            for partition_dir in glob.glob(os.path.join(date_dir, "product=*")):
+                files = glob.glob(os.path.join(partition_dir, "*.parquet"))
+                if len(files) <= 1:
+                    continue
+
+                with self._write_lock:
+                    table = pa.concat_tables([pq.read_table(path, schema=schema) for path in files])
+                    target = os.path.join(partition_dir, "data.parquet")
+                    pq.write_table(table.sort_by('timestamp'), f"{target}.tmp")
+                    os.replace(f"{target}.tmp", target)
+                    for path in files:
+                        if path != target:
+                            os.remove(path)
+                compacted += 1
+
+        return compacted
+
+    def _read_partition(self, partition_dir):
+        files = glob.glob(os.path.join(partition_dir, "*.parquet"))
+        if not files:
+            return []
+        pa, pq, schema = _parquet()
+        table = pa.concat_tables([pq.read_table(path, schema=schema) for path in files])
+        return sorted(table.to_pylist(), key=lambda row: row['timestamp'])
+
+    def _date_dirs_newest_first(self):
+        return sorted(glob.glob(os.path.join(self.directory, "date=*")), reverse=True)
+
+    def read_last(self, product_id, n, lookback_days=30):
+        """
+        Read the last `n` records of a product that have a numeric price.
+
+        Returns:
+            list: Rows as dicts with a datetime 'timestamp' and float 'price_numeric', oldest first
+        """
+        if self.format != "parquet":
+            rows = read_last_records(
+                self.csv_filename, n, product_id=product_id,
+                predicate=lambda row: bool(row.get('price_numeric'))
+            )
+            return [row for row in map(_parse_csv_row, rows) if row is not None]
+
+        records = []
+        for date_dir in self._date_dirs_newest_first()[:lookback_days]:
+            partition_dir = os.path.join(date_dir, f"product={_partition_name(product_id)}")
+            rows = [row for row in self._read_partition(partition_dir) if row['price_numeric'] is not None]
+            records = rows + records
+            if len(records) >= n:
+                break
+        return records[-n:]
+
+    def read_latest_by_product(self, n, lookback_days=7):
+        """
+        Read the last `n` records with a numeric price of every product.
+
+        Only the last `lookback_days` of history are read.
+
+        Returns:
+            dict: product_id -> rows as dicts, oldest first
+        """
+        latest = {}
+        if self.format != "parquet":
+            # The offset index seeks to the lookback window instead of reading the whole history
+            start = datetime.datetime.now() - datetime.timedelta(days=lookback_days)
+            for row in map(_parse_csv_row, read_time_range(self.csv_filename, start)):
+                if row is None:
+                    continue
+                rows = latest.setdefault(row['product_id'] or None, [])
+                rows.append(row)
+                if len(rows) > n:
+                    del rows[0]
+            return latest
+
+        for date_dir in self._date_dirs_newest_first()[:lookback_days]:
+            for partition_dir in glob.glob(os.path.join(date_dir, "product=*")):
+                rows = [row for row in self._read_partition(partition_dir) if row['price_numeric'] is not None]
+                if not rows:
+                    continue
+                product_id = rows[0]['product_id'] or None
+                known = latest.get(product_id, [])
+                if len(known) < n:
+                    latest[product_id] = (rows + known)[-n:]
+        return latest
+
+    def close(self):
+        """Flush buffered records."""
+        self.flush()
+
+
+def _parse_csv_row(row):
+    try:
+        return dict(
+            row,
+            timestamp=parse_timestamp(row['timestamp']),
+            price_numeric=float(row['price_numeric']),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
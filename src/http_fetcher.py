@@ -0,0 +1,119 @@
+import time
+import asyncio
+import logging
+import aiohttp
+
+from config import (
+    HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_HEADERS, HTTP_SKIP_AFTER_FAILURES, HTTP_RETRY_AFTER
+)
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Text that only appears on Amazon's robot check / captcha pages
+BOT_CHECK_MARKERS = (
+    "/errors/validateCaptcha",
+    "Enter the characters you see below",
+    "Type the characters you see in this image",
+    "<title>Robot Check</title>",
+    "api-services-support@amazon.com",
+)
+
+
+def is_bot_check(html):
+    """Check whether a page is a bot-check page instead of the requested content."""
+    return any(marker in html for marker in BOT_CHECK_MARKERS)
+
+
+class HttpFetcher:
+    """Pooled keep-alive HTTP client for pages that do not need a browser."""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT, headers=HTTP_HEADERS):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.headers = headers
+        self._session = None
+
+    def _get_session(self):
+        # The session is created on first use so it binds to the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+        return self._session
+
+    async def fetch(self, url):
+        """
+        Fetch a page over HTTP.
+
+        Returns:
+            tuple: (status, html) - html is None if the request failed
+        """
+        try:
+            with metrics.time_stage("http_fetch"):
+                async with self._get_session().get(url) as response:
+                    return response.status, await response.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("HTTP fetch failed", extra={"url": url, "error": str(e)})
+            return None, None
+
+    async def close(self):
+        """Close the pooled connections; the next fetch opens a new session."""
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+
+
+class FetchPathTracker:
+    """
+    Remembers per product which fetch path produced a complete extraction.
+
+    After `skip_after_failures` HTTP misses in a row a product goes straight to
+    the browser, and HTTP is tried again once `retry_after` seconds have passed.
+    """
+
+    def __init__(self, skip_after_failures=HTTP_SKIP_AFTER_FAILURES, retry_after=HTTP_RETRY_AFTER):
+        self.skip_after_failures = skip_after_failures
+        self.retry_after = retry_after
+        self._stats = {}
+
+    def _get(self, product_id):
+        return self._stats.setdefault(product_id, {
+            "last_path": None, "http_successes": 0, "http_failures": 0,
+            "browser_fetches": 0, "consecutive_http_failures": 0, "skip_http_until": 0.0,
+        })
+
+    def should_try_http(self, product_id):
+        """Whether the HTTP fast path should be tried for a product."""
+        return time.monotonic() >= self._get(product_id)["skip_http_until"]
+
+    def record_http(self, product_id, success):
+        """Record the outcome of an HTTP fast path attempt."""
+        stats = self._get(product_id)
+        if success:
+            stats["last_path"] = "http"
+            stats["http_successes"] += 1
+            stats["consecutive_http_failures"] = 0
+        else:
+            stats["http_failures"] += 1
+            stats["consecutive_http_failures"] += 1
+            if stats["consecutive_http_failures"] >= self.skip_after_failures:
+                stats["skip_http_until"] = time.monotonic() + self.retry_after
+                stats["consecutive_http_failures"] = 0
+
+    def record_browser(self, product_id):
+        """Record that the browser path was used for a product."""
+        stats = self._get(product_id)
+        stats["last_path"] = "browser"
+        stats["browser_fetches"] += 1
+
+    def get_stats(self, product_id):
+        """Return the fetch path statistics of a product."""
+        return dict(self._get(product_id))
+
+
+# Create singleton instances
+http_fetcher = HttpFetcher()
+fetch_path_tracker = FetchPathTracker()
@@ -0,0 +1,123 @@
+import time
+import hashlib
+import sqlite3
+import threading
+
+from config import LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES
+from src.metrics import metrics
+
+cache_requests = metrics.counter("cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+
+
+def content_hash(content):
+    """Return a stable hash of the page content an LLM extraction was run on."""
+    return hashlib.sha256(content.encode('utf-8', errors='replace')).hexdigest()
+
+
+class LLMResultCache:
+    """
+    Persistent cache of LLM extraction results.
+
+    Entries are keyed by a scope (which extraction), an ID (product or page) and a
+    hash of the page region the LLM was given, so a result is reused for as long
+    as that region stays the same. Entries expire after `ttl` seconds, and the
+    least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened lazily so importing the module does not touch the disk
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, scope TEXT, item_id TEXT, value TEXT, "
+                "created REAL, last_access REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def make_key(scope, item_id, region_hash):
+        return f"{scope}:{item_id}:{region_hash}"
+
+    def get(self, scope, item_id, region_hash):
+        """
+        Look up a cached result.
+
+        Returns:
+            str: The cached result, or None on a miss or an expired entry
+        """
+        key = self.make_key(scope, item_id, region_hash)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    connection.commit()
+                self.misses += 1
+                cache_requests.inc(cache="llm", result="miss")
+                return None
+
+            connection.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            connection.commit()
+            self.hits += 1
+            cache_requests.inc(cache="llm", result="hit")
+            return row[0]
+
+    def set(self, scope, item_id, region_hash, value):
+        """Store a result and evict the least recently used entries beyond the size limit."""
+        key = self.make_key(scope, item_id, region_hash)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, scope, item_id, value, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, item_id, value, now, now),
+            )
+            connection.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            connection.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the number of stored entries."""
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        """Close the cache database."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Create a singleton instance
+llm_cache = LLMResultCache()
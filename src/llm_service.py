@@ -0,0 +1,244 @@
+import re
+import json
+import logging
+import asyncio
+import hashlib
+import itertools
+from typing import List, Type
+
+from pydantic import BaseModel, ValidationError
+
+from config import (
+    LLM_MODEL, API_TOKEN, LLM_MAX_CONCURRENCY, LLM_BATCH_TOKEN_BUDGET, LLM_BATCH_WAIT
+)
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+llm_requests = metrics.counter("llm_requests_total", "LLM extraction requests, queued or coalesced", ["result"])
+llm_batch_size = metrics.histogram(
+    "llm_batch_size", "Documents per LLM prompt", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate used to size batches (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _parse_json_response(text: str):
+    # Models sometimes wrap JSON in a markdown code fence
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    return json.loads(fenced.group(1) if fenced else text)
+
+
+class _PendingRequest:
+    def __init__(self, source_id: str, content: str, future: asyncio.Future):
+        self.source_id = source_id
+        self.content = content
+        self.future = future
+
+
+class LLMExtractionService:
+    """
+    Batches, limits and coalesces LLM extraction requests.
+
+    Requests that share instructions and output model are packed into a single
+    prompt until the estimated token budget is reached or `batch_wait` seconds
+    pass. Each document is tagged with a source ID and the model answers with a
+    JSON object keyed by those IDs, which maps the outputs back to their
+    requests. Identical concurrent requests share one call, and at most
+    `max_concurrency` prompts are sent to the provider at the same time.
+    """
+
+    def __init__(self, model=LLM_MODEL, api_token=API_TOKEN, max_concurrency=LLM_MAX_CONCURRENCY,
+                 batch_token_budget=LLM_BATCH_TOKEN_BUDGET, batch_wait=LLM_BATCH_WAIT):
+        self.model = model
+        self.api_token = api_token
+        self.max_concurrency = max_concurrency
+        self.batch_token_budget = batch_token_budget
+        self.batch_wait = batch_wait
+        self.calls = 0
+        self.requests = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._pending = {}
+        self._timers = {}
+        # Running sends; the event loop only keeps weak references to tasks
+        self._tasks = set()
+        self._semaphore = None
+        self._source_ids = itertools.count(1)
+
+    async def extract(self, instruction: str, content: str, output_model: Type[BaseModel], many: bool = False):
+        """
+        Extract structured data from a document.
+
+        Args:
+            instruction (str): What to extract
+            content (str): The document text
+            output_model (Type[BaseModel]): Model each extracted item is validated against
+            many (bool): If True, the document holds a list of items
+
+        Returns:
+            A list of output_model instances if many is True, otherwise one instance or None
+        """
+        schema = json.dumps(output_model.model_json_schema(), sort_keys=True)
+        request_key = hashlib.sha256(
+            "\0".join([instruction, schema, str(many), content]).encode("utf-8", errors="replace")
+        ).hexdigest()
+
+        future = self._in_flight.get(request_key)
+        if future is not None:
+            self.coalesced += 1
+            llm_requests.inc(result="coalesced")
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[request_key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(request_key, None))
+            self.requests += 1
+            llm_requests.inc(result="queued")
+            self._enqueue((instruction, schema, many), _PendingRequest(
+                f"S{next(self._source_ids)}", content, future
+            ))
+
+        # Shielded so a cancelled caller does not cancel the result other callers share
+        raw_result = await asyncio.shield(future)
+        return self._validate(raw_result, output_model, many)
+
+    def _validate(self, raw_result, output_model, many):
+        if not many:
+            if isinstance(raw_result, list):
+                raw_result = raw_result[0] if raw_result else None
+            try:
+                return output_model.model_validate(raw_result) if raw_result else None
+            except ValidationError as e:
+                logger.warning("Discarding invalid LLM result", extra={"error": str(e)})
+                return None
+
+        if isinstance(raw_result, dict):
+            # A single item or a wrapper object such as {"products": [...]}
+            lists = [value for value in raw_result.values() if isinstance(value, list)]
+            raw_result = lists[0] if lists else [raw_result]
+
+        items = []
+        for item in raw_result or []:
+            try:
+                items.append(output_model.model_validate(item))
+            except ValidationError as e:
+                logger.warning("Discarding invalid LLM item", extra={"error": str(e)})
+        return items
+
+    def _enqueue(self, group_key, request):
+        pending = self._pending.setdefault(group_key, [])
+        pending.append(request)
+
+        if sum(estimate_tokens(item.content) for item in pending) >= self.batch_token_budget:
+            self._flush(group_key)
+        elif group_key not in self._timers:
+            self._timers[group_key] = asyncio.get_running_loop().call_later(
+                self.batch_wait, self._flush, group_key
+            )
+
+    def _flush(self, group_key):
+        timer = self._timers.pop(group_key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(group_key, [])
+
+        # Split into batches that fit the token budget; an oversized document goes alone
+        batch, batch_tokens = [], 0
+        for request in pending:
+            tokens = estimate_tokens(request.content)
+            if batch and batch_tokens + tokens > self.batch_token_budget:
+                self._start_send(group_key, batch)
+                batch, batch_tokens = [], 0
+            batch.append(request)
+            batch_tokens += tokens
+        if batch:
+            self._start_send(group_key, batch)
+
+    def _start_send(self, group_key, batch):
+        task = asyncio.ensure_future(self._send(group_key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Send the pending requests, wait for every send and drop state bound to the running event loop."""
+        for group_key in list(self._pending):
+            self._flush(group_key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._semaphore = None
+
+    def _build_messages(self, group_key, batch):
+        instruction, schema, many = group_key
+        result_shape = "a JSON array of items" if many else "a single JSON object"
+        documents = "\n\n".join(f"SOURCE {request.source_id}\n{request.content}" for request in batch)
+        return [
+            {"role": "system", "content": "You extract structured data from documents and answer only with JSON."},
+            {"role": "user", "content": (
+                f"{instruction}\n\n"
+                f"Each document below starts with a line 'SOURCE <id>'. Return one JSON object that maps "
+                f"every source id to its result. Each result is {result_shape} following this JSON schema:\n"
+                f"{schema}\n\n{documents}"
+            )},
+        ]
+
+    async def _send(self, group_key, batch: List[_PendingRequest]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        try:
+            # litellm is the client crawl4ai itself uses for LLM extraction
+            from litellm import acompletion
+
+            async with self._semaphore:
+                self.calls += 1
+                llm_batch_size.observe(len(batch))
+                with metrics.time_stage("llm_call"):
+                    response = await acompletion(
+                        model=self.model,
+                        api_key=self.api_token,
+                        messages=self._build_messages(group_key, batch),
+                        response_format={"type": "json_object"},
+                    )
+            results = _parse_json_response(response.choices[0].message.content)
+            if not isinstance(results, dict):
+                raise ValueError("LLM response is not a JSON object keyed by source id")
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        for request in batch:
+            if request.future.done():
+                continue
+            if request.source_id in results:
+                request.future.set_result(results[request.source_id])
+            else:
+                request.future.set_exception(
+                    ValueError(f"LLM response has no result for source {request.source_id}")
+                )
+
+    def stats(self):
+        """Return request, call and coalescing counters."""
+        return {"requests": self.requests, "calls": self.calls, "coalesced": self.coalesced}
+
+
+# Create a singleton instance
+llm_service = LLMExtractionService()
+
+
+class BatchedLLMExtraction:
+    """Extraction settings for pages processed through the shared LLM extraction service."""
+
+    def __init__(self, instruction: str, output_format: Type[BaseModel], service: LLMExtractionService = None):
+        self.instruction = instruction
+        self.output_format = output_format
+        self.service = service or llm_service
+
+    async def extract(self, content: str) -> List[dict]:
+        """Extract every item in a document and return them as dicts."""
+        items = await self.service.extract(self.instruction, content, self.output_format, many=True)
+        return [item.model_dump() for item in items]
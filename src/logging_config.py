@@ -0,0 +1,60 @@
+import json
+import logging
+import datetime
+
+from config import LOG_LEVEL, LOG_FORMAT
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is a structured field
+_RESERVED_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the level, logger, message and every `extra` field."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Human readable lines with the `extra` fields appended as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Set up leveled logging for the tracker.
+
+    Args:
+        level (str): Minimum level, e.g. "DEBUG" or "INFO"
+        log_format (str): "json" for one JSON object per line, "text" for key=value lines
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if log_format == "json" else KeyValueFormatter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
@@ -0,0 +1,286 @@
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from config import METRICS_NAMESPACE
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+    def to_dict(self):
+        with self._lock:
+            return {",".join(key) or "total": value for key, value in sorted(self._values.items())}
+
+
+class Gauge:
+    """Current value that can go up and down, or is read from a callback when collected."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def _current(self):
+        if self.function is not None:
+            try:
+                return {(): self.function()}
+            except Exception:
+                return {}
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        return [(self.name, key, (), value) for key, value in sorted(self._current().items())]
+
+    def to_dict(self):
+        return {",".join(key) or "value": value for key, value in sorted(self._current().items())}
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), cumulative))
+                samples.append((f"{self.name}_sum", key, (), series["sum"]))
+                samples.append((f"{self.name}_count", key, (), series["count"]))
+        return samples
+
+    def _quantile(self, series, q):
+        # Upper bound of the bucket the quantile falls into
+        target = q * series["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["counts"]):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                ",".join(key) or "total": {
+                    "count": series["count"],
+                    "sum": round(series["sum"], 6),
+                    "mean": round(series["sum"] / series["count"], 6) if series["count"] else None,
+                    "p50_le": _format_value(self._quantile(series, 0.5)),
+                    "p99_le": _format_value(self._quantile(series, 0.99)),
+                }
+                for key, series in sorted(self._series.items())
+            }
+
+
+class StageRun:
+    """One timed run of a stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.failed = False
+
+
+class MetricsRegistry:
+    """
+    Collects the tracker's counters, gauges and histograms.
+
+    Metrics are rendered in the Prometheus text exposition format for scraping,
+    or as a JSON document for dumps. Stage timings go into a single histogram
+    labelled by stage, with a counter of successful and failed runs per stage.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.stage_seconds = self.histogram("stage_seconds", "Time spent in each stage", ["stage"])
+        self.stage_total = self.counter("stage_total", "Stage runs by outcome", ["stage", "outcome"])
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        full_name = f"{self.namespace}_{name}" if self.namespace else name
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = metric_class(full_name, *args, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"Metric {full_name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Return the counter with this name, registering it on first use."""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        """Return the gauge with this name, registering it on first use."""
+        return self._register(Gauge, name, documentation, labelnames, function)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Return the histogram with this name, registering it on first use."""
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    @contextmanager
+    def time_stage(self, stage):
+        """
+        Time a block of code as one run of a stage.
+
+        The duration is recorded whether the block succeeds or raises, and the
+        run is counted with outcome "success" or "failure". Blocks that fail
+        without raising mark the yielded run with `run.failed = True`.
+        """
+        run = StageRun(stage)
+        start = time.perf_counter()
+        outcome = "failure"
+        try:
+            yield run
+            outcome = "failure" if run.failed else "success"
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage=stage)
+            self.stage_total.inc(stage=stage, outcome=outcome)
+
+    def render_prometheus(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Return every metric as plain data for a JSON dump."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {"type": metric.kind, "values": metric.to_dict()} for metric in metrics}
+
+    def dump_json(self, path):
+        """Write every metric to a JSON file."""
+        with open(path, mode="w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+class MetricsServer:
+    """Serves /metrics in the Prometheus format and /metrics.json from a background thread."""
+
+    def __init__(self, registry, port, host="0.0.0.0"):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(registry.to_dict()).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = registry.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Create a singleton instance
+metrics = MetricsRegistry()
@@ -1,15 +1,38 @@
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
 import os
+import logging
 
-# Load environment variables
-load_dotenv()
+from config import ROLLUPS_ENABLED, ROLLUP_RESOLUTIONS
+from src.metrics import metrics
+from src.utils import split_product_id
+from src.rollups import aggregate_documents
 
-# MongoDB Configuration
+logger = logging.getLogger(__name__)
+
+# Sort directions, the same values as pymongo.ASCENDING and pymongo.DESCENDING. pymongo itself is
+# only imported by the first connect, so importing this module does not load the driver.
+ASCENDING = 1
+DESCENDING = -1
+
+# MongoDB Configuration, with MONGODB_URI read from the environment or .env (see config.py)
 MONGODB_URI = os.getenv('MONGODB_URI')
 DB_NAME = "price_tracker_db"
 COLLECTION_NAME = "price_history"
+WATCHLIST_COLLECTION_NAME = "watchlist"
+WORK_QUEUE_COLLECTION_NAME = "work_queue"
+ROLLUP_COLLECTION_NAME = "price_rollups"
+ALERT_RULES_COLLECTION_NAME = "alert_rules"
+
+# Store price_history as a MongoDB time-series collection (MongoDB 5.0+) keyed by product_id.
+# Only applies when the collection does not exist yet; otherwise a regular collection is used.
+USE_TIMESERIES_COLLECTION = os.getenv('MONGODB_TIMESERIES', 'false').lower() == 'true'
+
+# Fields returned by the history query helpers. With delta writes, first_seen/last_seen give
+# the span of the state a document belongs to, and record_type whether it was a change or a heartbeat.
+PRICE_PROJECTION = {
+    "_id": 0, "product_id": 1, "timestamp": 1, "product_name": 1, "price": 1, "price_numeric": 1,
+    "discount": 1, "bought_30_days": 1, "rating": 1, "num_ratings": 1,
+    "first_seen": 1, "last_seen": 1, "record_type": 1,
+}
 
 class MongoDBHandler:
     """Handler for MongoDB operations"""
@@ -19,24 +42,75 @@ class MongoDBHandler:
         self.db = None
         self.collection = None
         self.is_connected = False
+        self.rollups_enabled = ROLLUPS_ENABLED
         
-    def connect(self):
-        """Establish connection to MongoDB"""
+    def connect(self, uri=None, client=None):
+        """
+        Establish connection to MongoDB
+
+        Args:
+            uri (str, optional): Connection string, MONGODB_URI if not given
+            client (optional): An existing client to use instead, e.g. a local mongod or mongomock client
+        """
         try:
-            self.client = MongoClient(MONGODB_URI, server_api=ServerApi('1'))
+            if client is None:
+                from pymongo.mongo_client import MongoClient
+                from pymongo.server_api import ServerApi
+                
+                client = MongoClient(uri or MONGODB_URI, server_api=ServerApi('1'))
+            self.client = client
             self.db = self.client[DB_NAME]
             self.collection = self.db[COLLECTION_NAME]
             
             # Test connection
             self.client.admin.command('ping')
-            print("Successfully connected to MongoDB!")
+            logger.info("Connected to MongoDB", extra={"database": DB_NAME})
+            self.ensure_schema()
             self.is_connected = True
             return True
         except Exception as e:
-            print(f"MongoDB connection error: {e}")
+            logger.error("MongoDB connection error", extra={"error": str(e)})
             self.is_connected = False
             return False
     
+    def close(self):
+        """Close the client; the next query connects again"""
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+        self.db = None
+        self.collection = None
+        self.is_connected = False
+    
+    def ensure_schema(self):
+        """Create the price_history collection and the indexes the query helpers rely on"""
+        try:
+            if USE_TIMESERIES_COLLECTION and COLLECTION_NAME not in self.db.list_collection_names():
+                self.db.create_collection(
+                    COLLECTION_NAME,
+                    timeseries={"timeField": "timestamp", "metaField": "product_id", "granularity": "seconds"},
+                )
+            
+            # Latest-price and history lookups per product
+            self.collection.create_index(
+                [("product_id", ASCENDING), ("timestamp", DESCENDING)], name="product_id_timestamp"
+            )
+            # Lookups by ASIN across marketplaces
+            self.collection.create_index(
+                [("asin", ASCENDING), ("marketplace", ASCENDING), ("timestamp", DESCENDING)],
+                name="asin_marketplace_timestamp"
+            )
+            self.db[WATCHLIST_COLLECTION_NAME].create_index("product_id", name="product_id")
+            self.db[ALERT_RULES_COLLECTION_NAME].create_index("product_id", name="product_id")
+            # One rollup per product, resolution and bucket, read as time ranges
+            self.db[ROLLUP_COLLECTION_NAME].create_index(
+                [("product_id", ASCENDING), ("resolution", ASCENDING), ("bucket", ASCENDING)],
+                name="product_id_resolution_bucket", unique=True
+            )
+        except Exception as e:
+            # Queries still work without the indexes, only slower
+            logger.warning("Error creating MongoDB indexes", extra={"error": str(e)})
+    
     def insert_price_data(self, price_document):
         """Insert price data into MongoDB collection"""
         if not self.is_connected:
@@ -44,50 +118,249 @@ class MongoDBHandler:
                 return None
         
         try:
-            result = self.collection.insert_one(price_document)
-            print(f"Price data saved to MongoDB with ID: {result.inserted_id}")
+            with metrics.time_stage("mongo_write"):
+                result = self.collection.insert_one(price_document)
+            logger.debug("Price data saved to MongoDB", extra={"inserted_id": str(result.inserted_id)})
+            self.update_rollups([price_document])
             return result.inserted_id
         except Exception as e:
-            print(f"Error inserting data into MongoDB: {e}")
+            logger.error("Error inserting data into MongoDB", extra={"error": str(e)})
             return None
     
-    def get_previous_prices(self, limit=2):
-        """Get the most recent price entries"""
+    def insert_many_price_data(self, price_documents):
+        """Insert a batch of price documents into MongoDB collection"""
+        if not price_documents:
+            return 0
+        if not self.is_connected:
+            if not self.connect():
+                return 0
+        
+        from pymongo.errors import BulkWriteError
+        try:
+            # Unordered so one bad document does not stop the rest of the batch
+            with metrics.time_stage("mongo_write"):
+                result = self.collection.insert_many(price_documents, ordered=False)
+            self.update_rollups(price_documents)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # The rest of the batch was still written, so it is rolled up and counted
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            self.update_rollups([document for index, document in enumerate(price_documents) if index not in failed])
+            logger.error("Error inserting some documents into MongoDB",
+                         extra={"documents": len(price_documents), "failed": len(failed), "error": str(e)})
+            return e.details.get("nInserted", 0)
+        except Exception as e:
+            logger.error("Error inserting documents into MongoDB",
+                         extra={"documents": len(price_documents), "error": str(e)})
+            return 0
+    
+    def update_rollups(self, price_documents):
+        """
+        Merge newly inserted price documents into the minute, hour and day rollups.
+        
+        A failed merge is logged and does not fail the insert; backfill_rollups.py
+        rebuilds the affected range.
+        
+        Returns:
+            int: Number of rollup buckets written
+        """
+        if not self.rollups_enabled or not price_documents:
+            return 0
+        
+        buckets = aggregate_documents(price_documents, ROLLUP_RESOLUTIONS)
+        if not buckets:
+            return 0
+        try:
+            with metrics.time_stage("rollup_write"):
+                self.db[ROLLUP_COLLECTION_NAME].bulk_write(
+                    [bucket.merge_operation() for bucket in buckets], ordered=False
+                )
+            return len(buckets)
+        except Exception as e:
+            logger.error("Error updating price rollups", extra={"buckets": len(buckets), "error": str(e)})
+            return 0
+    
+    def get_rollups(self, product_id, resolution="hour", start=None, end=None):
+        """
+        Get a product's rollups at one resolution, oldest first.
+        
+        With change-only history a bucket only exists when a check was stored in
+        it; the close of the previous bucket carries over until then.
+        
+        Args:
+            product_id (str): Product key ('<marketplace>:<ASIN>')
+            resolution (str): "minute", "hour" or "day"
+            start (datetime, optional): Only buckets starting at or after this time
+            end (datetime, optional): Only buckets starting before this time
+        """
+        if not self.is_connected:
+            if not self.connect():
+                return []
+        
+        query = {"product_id": product_id, "resolution": resolution}
+        if start is not None or end is not None:
+            query["bucket"] = {}
+            if start is not None:
+                query["bucket"]["$gte"] = start
+            if end is not None:
+                query["bucket"]["$lt"] = end
+        
+        try:
+            return list(self.db[ROLLUP_COLLECTION_NAME].find(
+                query, {"_id": 0, "rating_time": 0}, sort=[("bucket", ASCENDING)]
+            ))
+        except Exception as e:
+            logger.error("Error retrieving price rollups from MongoDB", extra={"product_id": product_id, "error": str(e)})
+            return []
+    
+    def update_extracted_fields(self, updates, insert_missing=False):
+        """
+        Overwrite the parsed fields of existing price checks, e.g. after re-extracting snapshots.
+        
+        Checks are matched on (product_id, timestamp). Updating arbitrary fields of a
+        time-series collection needs MongoDB 7.0 or later.
+        
+        Args:
+            updates (list): (product_id, timestamp, fields) tuples, where fields maps
+                            price_history field names to their new values
+            insert_missing (bool): If True, insert checks that have no document, such as ones
+                                   whose price failed to parse or that delta writes skipped
+        
+        Returns:
+            int: Number of documents modified or inserted
+        """
+        if not updates:
+            return 0
+        if not self.is_connected:
+            if not self.connect():
+                return 0
+        
+        from pymongo import UpdateOne
+        
+        operations = []
+        for product_id, timestamp, fields in updates:
+            marketplace, asin = split_product_id(product_id)
+            operations.append(UpdateOne(
+                {"product_id": product_id, "timestamp": timestamp},
+                {"$set": fields, "$setOnInsert": {"asin": asin, "marketplace": marketplace}},
+                upsert=insert_missing,
+            ))
+        
+        try:
+            # Unordered so one failed update does not stop the rest of the batch
+            with metrics.time_stage("mongo_write"):
+                result = self.collection.bulk_write(operations, ordered=False)
+            return result.modified_count + result.upserted_count
+        except Exception as e:
+            logger.error("Error updating documents in MongoDB", extra={"documents": len(operations), "error": str(e)})
+            return 0
+    
+    def get_previous_prices(self, limit=2, product_id=None):
+        """Get the most recent price entries, optionally for a single product"""
         if not self.is_connected:
             if not self.connect():
                 return []
         
+        query = {"price_numeric": {"$ne": None}}
+        if product_id is not None:
+            query["product_id"] = product_id
+        
         try:
+            # Served by the (product_id, timestamp) index when a product is given
             return list(self.collection.find(
-                {"price_numeric": {"$ne": None}},
-                sort=[("timestamp", -1)],
+                query,
+                PRICE_PROJECTION,
+                sort=[("timestamp", DESCENDING)],
                 limit=limit
             ))
         except Exception as e:
-            print(f"Error retrieving data from MongoDB: {e}")
+            logger.error("Error retrieving data from MongoDB", extra={"error": str(e)})
+            return []
+    
+    def get_latest_price(self, product_id):
+        """Get the most recent price entry of a product"""
+        entries = self.get_previous_prices(limit=1, product_id=product_id)
+        return entries[0] if entries else None
+    
+    def get_price_history(self, product_id, start=None, end=None, limit=None):
+        """
+        Get the price history of a product, newest first.
+        
+        Args:
+            product_id (str): Product key ('<marketplace>:<ASIN>')
+            start (datetime, optional): Only entries at or after this time
+            end (datetime, optional): Only entries before this time
+            limit (int, optional): Maximum number of entries
+        """
+        if not self.is_connected:
+            if not self.connect():
+                return []
+        
+        query = {"product_id": product_id}
+        if start is not None or end is not None:
+            query["timestamp"] = {}
+            if start is not None:
+                query["timestamp"]["$gte"] = start
+            if end is not None:
+                query["timestamp"]["$lt"] = end
+        
+        try:
+            cursor = self.collection.find(query, PRICE_PROJECTION, sort=[("timestamp", DESCENDING)])
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        except Exception as e:
+            logger.error("Error retrieving price history from MongoDB", extra={"product_id": product_id, "error": str(e)})
+            return []
+    
+    def get_recent_prices_by_product(self, product_ids, limit=10):
+        """Get the most recent (timestamp, price) pairs of each given product that has any, oldest first"""
+        if not self.is_connected:
+            if not self.connect():
+                return {}
+        
+        recent = {}
+        try:
+            for product_id in product_ids:
+                # One (product_id, timestamp) index walk per product reads `limit` documents at most
+                entries = self.collection.find(
+                    {"product_id": product_id, "price_numeric": {"$ne": None}},
+                    {"_id": 0, "timestamp": 1, "price_numeric": 1},
+                    sort=[("timestamp", DESCENDING)],
+                    limit=limit,
+                )
+                observations = [(entry["timestamp"], entry["price_numeric"]) for entry in entries]
+                if observations:
+                    recent[product_id] = observations[::-1]
+        except Exception as e:
+            logger.error("Error retrieving recent prices from MongoDB", extra={"error": str(e)})
+            return {}
+        return recent
+    
+    def get_watchlist(self):
+        """Get the products to track from the watchlist collection"""
+        if not self.is_connected:
+            if not self.connect():
+                return []
+        
+        try:
+            return list(self.db[WATCHLIST_COLLECTION_NAME].find({"enabled": {"$ne": False}}))
+        except Exception as e:
+            logger.error("Error retrieving watchlist from MongoDB", extra={"error": str(e)})
+            return []
+    
+    def get_alert_rules(self):
+        """Get the enabled alert rules from the alert_rules collection"""
+        if not self.is_connected:
+            if not self.connect():
+                return []
+        
+        try:
+            return list(self.db[ALERT_RULES_COLLECTION_NAME].find({"enabled": {"$ne": False}}))
+        except Exception as e:
+            logger.error("Error retrieving alert rules from MongoDB", extra={"error": str(e)})
             return []
 
 # Create a singleton instance
 mongodb_handler = MongoDBHandler()
 
-
-def save_price_to_mongodb(price_value, price_string, product_name, discount, bought_30_days, rating, num_ratings, timestamp):
-    """
-    Save the price data to MongoDB.
-    """
-    price_data = {
-        'timestamp': timestamp,
-        'product_name': product_name,
-        'price': price_string,
-        'price_numeric': price_value,
-        'discount': discount,
-        'bought_30_days': bought_30_days,
-        'rating': rating,
-        'num_ratings': num_ratings
-    }
-    
-    try:
-        mongodb_handler.db.prices.insert_one(price_data)
-        print(f"Successfully saved price data to MongoDB")
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
\ No newline at end of file
@@ -0,0 +1,162 @@
+import logging
+import datetime
+
+from config import (
+    POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_CHECKS_PER_CHANGE, POLL_BACKOFF_FACTOR,
+    DEAL_WINDOWS, POLL_DEAL_WINDOW_INTERVAL, POLL_BUDGET_PER_HOUR
+)
+from src.price_cache import price_state_cache
+from src.price_analyzer import PRICE_CHANGE_THRESHOLD
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+poll_intervals = metrics.histogram(
+    "poll_interval_seconds", "Intervals until the next check of a product",
+    buckets=(10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400),
+)
+
+
+class DealWindow:
+    """A period during which prices move more than usual, either daily or one-off."""
+
+    def __init__(self, start, end, daily=False):
+        """
+        Args:
+            start (datetime.time or datetime.datetime): Start of the window
+            end (datetime.time or datetime.datetime): End of the window
+            daily (bool): If True, start and end are times of day and the window repeats every day
+        """
+        self.start = start
+        self.end = end
+        self.daily = daily
+
+    @classmethod
+    def parse(cls, value):
+        """Parse "HH:MM-HH:MM" as a daily window or "<ISO start>/<ISO end>" as a one-off window."""
+        if "/" in value:
+            start, end = value.split("/", 1)
+            return cls(datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end))
+        start, end = value.split("-", 1)
+        return cls(datetime.time.fromisoformat(start), datetime.time.fromisoformat(end), daily=True)
+
+    def contains(self, now):
+        if not self.daily:
+            return self.start <= now < self.end
+        time_of_day = now.time()
+        if self.start <= self.end:
+            return self.start <= time_of_day < self.end
+        # Windows like 22:00-02:00 span midnight
+        return time_of_day >= self.start or time_of_day < self.end
+
+    def next_start(self, now):
+        """Return when the window next opens after `now`, or None if it never will."""
+        if not self.daily:
+            return self.start if self.start > now else None
+        start = datetime.datetime.combine(now.date(), self.start)
+        return start if start > now else start + datetime.timedelta(days=1)
+
+
+class AdaptivePollingPolicy:
+    """
+    Chooses when each product is checked next.
+
+    The interval follows the product's recent change rate, read from the same
+    observations check_price_change compares: a product is checked
+    `checks_per_change` times per expected change, backs off geometrically while
+    its price is stable, and drops to the minimum interval right after a change.
+    Deal windows cap the interval and pull checks forward to the window start.
+    With a budget, every interval is stretched by the same factor so the total
+    number of checks per hour stays within it.
+    """
+
+    def __init__(self, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL,
+                 checks_per_change=POLL_CHECKS_PER_CHANGE, backoff_factor=POLL_BACKOFF_FACTOR,
+                 deal_windows=DEAL_WINDOWS, deal_window_interval=POLL_DEAL_WINDOW_INTERVAL,
+                 budget_per_hour=POLL_BUDGET_PER_HOUR, history=price_state_cache):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.checks_per_change = checks_per_change
+        self.backoff_factor = backoff_factor
+        self.deal_windows = [
+            window if isinstance(window, DealWindow) else DealWindow.parse(window) for window in deal_windows
+        ]
+        self.deal_window_interval = deal_window_interval
+        self.budget_per_hour = budget_per_hour
+        self.history = history
+        # Interval of every product before the budget is applied
+        self._intervals = {}
+
+    def _clamp(self, interval):
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def change_rate(self, product_id):
+        """
+        Count the significant price changes across a product's recent observations.
+
+        Returns:
+            tuple: (number of changes, seconds the observations span)
+        """
+        observations = self.history.get_recent(product_id)
+        if len(observations) < 2:
+            return 0, 0.0
+
+        changes = 0
+        for (_, previous), (_, current) in zip(observations, observations[1:]):
+            if previous and abs(current - previous) / previous >= PRICE_CHANGE_THRESHOLD:
+                changes += 1
+        span = (observations[-1][0] - observations[0][0]).total_seconds()
+        return changes, span
+
+    def _apply_deal_windows(self, interval, now):
+        for window in self.deal_windows:
+            if window.contains(now):
+                interval = min(interval, self.deal_window_interval)
+            else:
+                start = window.next_start(now)
+                if start is not None:
+                    interval = min(interval, max((start - now).total_seconds(), self.min_interval))
+        return interval
+
+    def _apply_budget(self, product_id, interval):
+        self._intervals[product_id] = interval
+        if not self.budget_per_hour:
+            return interval
+        checks_per_hour = sum(3600 / value for value in self._intervals.values())
+        if checks_per_hour <= self.budget_per_hour:
+            return interval
+        return interval * checks_per_hour / self.budget_per_hour
+
+    def next_interval(self, product, result=None, now=None):
+        """
+        Compute the seconds until a product's next check.
+
+        Args:
+            product (WatchedProduct): The product that was just checked; its `interval`
+                                      is updated to the new base interval
+            result (dict, optional): The check result, with 'price_changed' set when a change was detected
+            now (datetime, optional): Current time, for the deal windows
+
+        Returns:
+            float: Seconds until the next check
+        """
+        now = now or datetime.datetime.now()
+        if result and result.get("price_changed"):
+            interval = self.min_interval
+        else:
+            changes, span = self.change_rate(product.product_id)
+            if changes:
+                interval = span / changes / self.checks_per_change
+            else:
+                interval = (product.interval or self.min_interval) * self.backoff_factor
+        interval = self._clamp(interval)
+        product.interval = interval
+
+        interval = self._apply_budget(product.product_id, self._apply_deal_windows(interval, now))
+        poll_intervals.observe(interval)
+        logger.debug("Next check scheduled", extra={"product_id": product.product_id, "interval": round(interval, 1)})
+        return interval
+
+
+# Create a singleton instance
+polling_policy = AdaptivePollingPolicy()
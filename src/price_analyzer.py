@@ -1,17 +1,25 @@
-import os
-import csv
-from src.mongodb_handler import mongodb_handler
-from src.data_storage import CSV_FILENAME
+import logging
+
+from src.price_cache import price_state_cache
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 # Constants
 PRICE_CHANGE_THRESHOLD = 0.01  # 1% threshold for price change notifications
 
-def check_price_change(current_price):
+def check_price_change(current_price, product_id=None):
     """
     Check if there's a significant price change compared to the last recorded price.
     
+    The previous price comes from the in-memory price state cache, which already
+    holds the current observation once it has been saved. save_price_record
+    loads the stored history of products that were not part of the cache warm-up
+    in a worker thread, so this only reads storage for callers that skip it.
+    
     Args:
         current_price (float): The current price value
+        product_id (str, optional): Only compare against history of this product
         
     Returns:
         tuple: (bool, float) - Whether there's a significant change and the percentage change
@@ -20,40 +28,18 @@ def check_price_change(current_price):
         return False, 0
     
     try:
-        # First try to get the previous price from MongoDB
-        previous_entries = mongodb_handler.get_previous_prices(limit=2)
-        
-        if len(previous_entries) > 1:
+        with metrics.time_stage("change_check"):
+            price_state_cache.ensure_loaded(product_id)
+            
             # Get the second-to-last entry (previous price)
-            previous_price = previous_entries[1].get('price_numeric')
-            if previous_price is not None:
-                # Calculate percentage change
-                if previous_price > 0:
-                    percent_change = abs(current_price - previous_price) / previous_price
-                    return percent_change >= PRICE_CHANGE_THRESHOLD, percent_change
-        
-        # Fallback to CSV if MongoDB doesn't have enough data
-        if not os.path.isfile(CSV_FILENAME):
-            return False, 0
+            previous_price = price_state_cache.previous_price(product_id)
         
-        with open(CSV_FILENAME, mode='r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            rows = list(reader)
-            
-            if len(rows) <= 1:  # Not enough data for comparison
-                return False, 0
-            
-            # Get the previous price (second to last entry)
-            previous_price = rows[-2].get('price_numeric')
-            if previous_price and previous_price != '':
-                previous_price = float(previous_price)
-                
-                # Calculate percentage change
-                if previous_price > 0:
-                    percent_change = abs(current_price - previous_price) / previous_price
-                    return percent_change >= PRICE_CHANGE_THRESHOLD, percent_change
+        # Calculate percentage change
+        if previous_price is not None and previous_price > 0:
+            percent_change = abs(current_price - previous_price) / previous_price
+            return percent_change >= PRICE_CHANGE_THRESHOLD, percent_change
     
     except Exception as e:
-        print(f"Error checking price change: {e}")
+        logger.error("Error checking price change", extra={"product_id": product_id, "error": str(e)})
     
     return False, 0
\ No newline at end of file
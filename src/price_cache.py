@@ -0,0 +1,128 @@
+import logging
+import threading
+from collections import deque
+
+from config import PRICE_CACHE_HISTORY_SIZE
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+cache_requests = metrics.counter("cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+
+
+def _observation_key(timestamp):
+    # CSV history only keeps whole seconds, so compare observations at that precision
+    return timestamp.replace(microsecond=0)
+
+
+class PriceStateCache:
+    """
+    In-memory cache of the last N price observations of each product.
+
+    The cache is warmed from storage at startup and updated in place on every
+    insert, so change detection reads the previous price without any I/O.
+    Products that were not part of the warm-up are loaded from storage once,
+    the first time they are looked up.
+    """
+
+    def __init__(self, history_size=PRICE_CACHE_HISTORY_SIZE):
+        self.history_size = history_size
+        self._observations = {}
+        self._loaded = set()
+        # Warm-up runs in a worker thread while the tracker may already be recording
+        self._lock = threading.Lock()
+
+    def _merge(self, product_id, observations):
+        """Merge (timestamp, price) pairs into a product's history, keeping the newest N."""
+        with self._lock:
+            existing = self._observations.get(product_id, ())
+            merged = {_observation_key(timestamp): (timestamp, price) for timestamp, price in observations}
+            for timestamp, price in existing:
+                merged[_observation_key(timestamp)] = (timestamp, price)
+            newest = sorted(merged.values(), key=lambda item: item[0])[-self.history_size:]
+            self._observations[product_id] = deque(newest, maxlen=self.history_size)
+            self._loaded.add(product_id)
+
+    def record(self, product_id, price_value, timestamp):
+        """Record a new observation for a product."""
+        if price_value is None:
+            return
+        with self._lock:
+            history = self._observations.get(product_id)
+            if history is None:
+                history = self._observations[product_id] = deque(maxlen=self.history_size)
+            history.append((timestamp, price_value))
+
+    def get_recent(self, product_id):
+        """Return the cached (timestamp, price) observations of a product, oldest first."""
+        return list(self._observations.get(product_id, ()))
+
+    def previous_price(self, product_id):
+        """
+        Return the price observed before the latest one.
+
+        Returns:
+            float: The previous price, or None if fewer than two observations are known.
+        """
+        history = self._observations.get(product_id)
+        if not history or len(history) < 2:
+            return None
+        return history[-2][1]
+
+    def is_loaded(self, product_id):
+        """Whether the cache holds the stored history of a product."""
+        return product_id in self._loaded
+
+    def forget(self, product_id):
+        """Drop a product's cached history so the next lookup reloads it from storage."""
+        with self._lock:
+            self._observations.pop(product_id, None)
+            self._loaded.discard(product_id)
+
+    def warm(self, product_ids=()):
+        """
+        Load the last N observations of the given products from MongoDB, or from the local history.
+
+        Args:
+            product_ids (iterable): Products to load, marked as loaded even when they have no history yet
+        """
+        from src.mongodb_handler import mongodb_handler
+
+        product_ids = list(product_ids)
+        recent_by_product = mongodb_handler.get_recent_prices_by_product(product_ids, limit=self.history_size)
+        if not recent_by_product:
+            from src.data_storage import local_history_store
+
+            recent_by_product = {
+                product_id: [(row['timestamp'], row['price_numeric']) for row in rows]
+                for product_id, rows in local_history_store.read_latest_by_product(self.history_size).items()
+            }
+
+        for product_id, observations in recent_by_product.items():
+            self._merge(product_id, observations)
+        for product_id in product_ids:
+            self._merge(product_id, ())
+
+        logger.info("Price cache warmed", extra={"products": len(recent_by_product)})
+
+    def ensure_loaded(self, product_id):
+        """Load a product's stored history the first time it is looked up."""
+        if product_id in self._loaded:
+            cache_requests.inc(cache="price_state", result="hit")
+            return
+        cache_requests.inc(cache="price_state", result="miss")
+
+        from src.mongodb_handler import mongodb_handler
+
+        entries = mongodb_handler.get_previous_prices(limit=self.history_size, product_id=product_id)
+        observations = [(entry['timestamp'], entry['price_numeric']) for entry in entries]
+        if not observations:
+            from src.data_storage import local_history_store
+
+            rows = local_history_store.read_last(product_id, self.history_size)
+            observations = [(row['timestamp'], row['price_numeric']) for row in rows]
+        self._merge(product_id, observations)
+
+
+# Create a singleton instance
+price_state_cache = PriceStateCache()
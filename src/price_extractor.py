@@ -1,172 +1,418 @@
 import re
 import json
+import logging
+import asyncio
 import datetime
-from crawl4ai import AsyncWebCrawler, LLMExtractionStrategy, LLMConfig, CrawlerRunConfig, CacheMode
+from bs4 import BeautifulSoup
+from crawl4ai import LLMExtractionStrategy, LLMConfig, CrawlerRunConfig, CacheMode
 
-from config import BASE_URL, API_TOKEN, LLM_MODEL, PRICE_SELECTOR, PRODUCT_NAME_SELECTOR, DISCOUNT_SELECTOR, RATING_SELECTOR, NUM_OF_RATINGS
-from src.scraper import get_browser_config
+from config import (
+    BASE_URL, API_TOKEN, LLM_MODEL, PRICE_SELECTOR, PRODUCT_NAME_SELECTOR, DISCOUNT_SELECTOR,
+    RATING_SELECTOR, NUM_OF_RATINGS, NUM_OF_BOUGHT_IN_30_DAYS_SELECTOR, SINGLE_FETCH_EXTRACTION,
+    HTTP_FAST_PATH, PRODUCT_NAME_REGION_SELECTORS
+)
+from src.browser_pool import get_browser_pool
+from src.browser_profiles import get_browser_profile
+from src.http_fetcher import http_fetcher, fetch_path_tracker, is_bot_check
+from src.llm_cache import llm_cache, content_hash
+from src.llm_service import llm_service
+from src.metrics import metrics
+from src.snapshot_store import snapshot_store
+from src.change_tracker import change_tracker, page_hash
+from models.product import ProductName
 
+logger = logging.getLogger(__name__)
 
-async def extract_product_price(url):
+selector_results = metrics.counter(
+    "selector_total", "Product page selector lookups by field and result", ["field", "result"]
+)
+fetch_paths = metrics.counter("fetch_path_total", "Product extractions by the fetch path that served them", ["path"])
+
+# Selector for each parsed field, overridable when re-extracting stored snapshots
+DEFAULT_SELECTORS = {
+    "price": PRICE_SELECTOR,
+    "product_name": PRODUCT_NAME_SELECTOR,
+    "discount": DISCOUNT_SELECTOR,
+    "bought_30_days": NUM_OF_BOUGHT_IN_30_DAYS_SELECTOR,
+    "rating": RATING_SELECTOR,
+    "num_ratings": NUM_OF_RATINGS,
+}
+
+NAME_INSTRUCTION = (
+    "Extract only the exact product name from this Amazon product page. "
+    "Return the data in JSON format with key 'name'."
+)
+
+
+def _strip_tags(html):
+    """Remove all HTML tags from a fragment and return the stripped text."""
+    return re.sub(r'<[^>]+>', '', html).strip()
+
+
+def parse_price(price_text):
     """
-    Extract the current price of a product from its URL.
-    
+    Parse the text of the price element.
+
     Args:
-        url (str): The product URL to scrape
-        
+        price_text (str): Text content of the price element
+
     Returns:
-        tuple: (price_value, price_string, product_name, discount, rating, num_ratings, timestamp)
+        tuple: (price_value, price_string)
     """
-    browser_config = get_browser_config()
-    
-    # Create a session ID with timestamp to avoid caching
-    session_id = f"price_tracker_{datetime.datetime.now().timestamp()}"
-    
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        # First, extract the price directly using the CSS selector
-        price_result = await crawler.arun(
-            url=url,
-            config=CrawlerRunConfig(
-                cache_mode=CacheMode.BYPASS,  # Always get fresh data
-                css_selector=PRICE_SELECTOR,  # Use the price selector from config
-                session_id=session_id,
-            ),
-        )
-        
-        # Extract price from the selector result
-        price_string = "Not available"
-        price_value = None
-        
-        if price_result.success and price_result.cleaned_html:
-            # Extract just the text content by removing all HTML tags
-            price_text = re.sub(r'<[^>]+>', '', price_result.cleaned_html).strip()
-            
-            # Fix for repeated prices - extract only the first price pattern
-            price_match = re.search(r'(\d{1,3}(?:,\d{3})*(?:\.\d+)?)', price_text)
-            if price_match:
-                price_text = price_match.group(1)
-                # For Amazon Egypt, we need to add the currency
-                price_string = f"$ {price_text}"
-                # Extract numeric value
-                try:
-                    price_value = float(re.sub(r'[^\d.]', '', price_text))
-                except ValueError:
-                    print(f"Could not convert price '{price_text}' to numeric value")
-        
-        # Extract discount information using the provided CSS selector
-        discount_result = await crawler.arun(
-            url=url,
-            config=CrawlerRunConfig(
-                cache_mode=CacheMode.BYPASS,
-                css_selector=DISCOUNT_SELECTOR,
-                session_id=f"{session_id}_discount",
-            ),
-        )
-        
-        discount = "No discount"
-        if discount_result.success and discount_result.cleaned_html:
-            # Clean up the discount text by removing HTML tags
-            discount_text = re.sub(r'<[^>]+>', '', discount_result.cleaned_html).strip()
-            # Extract just the percentage value if it exists
-            discount_match = re.search(r'(-?\d+(?:\.\d+)?)%', discount_text)
-            if discount_match:
-                discount = f"{discount_match.group(0)}"
-            else:
-                discount = discount_text
-        
-        # Extract product name using CSS selector instead of LLM
-        name_result = await crawler.arun(
-            url=url,
-            config=CrawlerRunConfig(
-                cache_mode=CacheMode.BYPASS,
-                css_selector=PRODUCT_NAME_SELECTOR,  # Use the product name selector from config
-                session_id=f"{session_id}_name",
-            ),
-        )
-        
-        product_name = "Unknown Product"
-        if name_result.success and name_result.cleaned_html:
-            # Clean up the product name by removing HTML tags
-            product_name = re.sub(r'<[^>]+>', '', name_result.cleaned_html).strip()
-        
-        # Extract rating using CSS selector
-        rating_result = await crawler.arun(
-            url=url,
-            config=CrawlerRunConfig(
-                cache_mode=CacheMode.BYPASS,
-                css_selector=RATING_SELECTOR,
-                session_id=f"{session_id}_rating",
-            ),
-        )
-        
-        rating = "Not available"
-        if rating_result.success and rating_result.cleaned_html:
-            # Clean up the rating text by removing HTML tags
-            rating_text = re.sub(r'<[^>]+>', '', rating_result.cleaned_html).strip()
-            # Extract just the rating value if it exists
-            rating_match = re.search(r'(\d+(?:\.\d+)?)', rating_text)
-            if rating_match:
-                rating = f"{rating_match.group(1)} out of 5"
-            else:
-                rating = rating_text
-        
-        # Extract number of ratings using CSS selector
-        num_ratings_result = await crawler.arun(
+    price_string = "Not available"
+    price_value = None
+
+    # Fix for repeated prices - extract only the first price pattern
+    price_match = re.search(r'(\d{1,3}(?:,\d{3})*(?:\.\d+)?)', price_text or "")
+    if price_match:
+        price_text = price_match.group(1)
+        # For Amazon Egypt, we need to add the currency
+        price_string = f"$ {price_text}"
+        # Extract numeric value
+        try:
+            price_value = float(re.sub(r'[^\d.]', '', price_text))
+        except ValueError:
+            logger.warning("Could not convert price to a numeric value", extra={"price_text": price_text})
+
+    return price_value, price_string
+
+
+def parse_discount(discount_text):
+    """Parse the text of the discount element into a percentage string."""
+    if not discount_text:
+        return "No discount"
+    # Extract just the percentage value if it exists
+    discount_match = re.search(r'(-?\d+(?:\.\d+)?)%', discount_text)
+    if discount_match:
+        return f"{discount_match.group(0)}"
+    return discount_text
+
+
+def parse_rating(rating_text):
+    """Parse the text of the rating element into an 'X out of 5' string."""
+    if not rating_text:
+        return "Not available"
+    # Extract just the rating value if it exists
+    rating_match = re.search(r'(\d+(?:\.\d+)?)', rating_text)
+    if rating_match:
+        return f"{rating_match.group(1)} out of 5"
+    return rating_text
+
+
+def parse_num_ratings(num_ratings_text):
+    """Parse the text of the ratings count element."""
+    if not num_ratings_text:
+        return "Not available"
+    # Extract just the number if it exists
+    num_ratings_match = re.search(r'(\d{1,3}(?:,\d{3})*)', num_ratings_text)
+    if num_ratings_match:
+        return num_ratings_match.group(1)
+    return num_ratings_text
+
+
+def parse_product_html(html, selectors=None):
+    """
+    Extract every configured selector from a single product page document.
+
+    Args:
+        html (str): Raw HTML of the product page
+        selectors (dict, optional): Selectors to use instead of DEFAULT_SELECTORS, by field
+
+    Returns:
+        dict: Parsed fields (price_value, price_string, product_name, discount,
+              bought_30_days, rating, num_ratings)
+    """
+    selectors = {**DEFAULT_SELECTORS, **(selectors or {})}
+    with metrics.time_stage("selector_extraction"):
+        soup = BeautifulSoup(html, "lxml")
+
+        def select_text(field, selector):
+            element = soup.select_one(selector)
+            text = element.get_text(" ", strip=True) if element else ""
+            selector_results.inc(field=field, result="hit" if text else "miss")
+            return text
+
+        price_value, price_string = parse_price(select_text("price", selectors["price"]))
+
+        # The "bought in past month" selector is generic, so keep the first match that mentions it
+        bought_30_days = "N/A"
+        for element in soup.select(selectors["bought_30_days"]):
+            text = element.get_text(" ", strip=True)
+            if "bought" in text.lower():
+                bought_30_days = text
+                break
+        selector_results.inc(field="bought_30_days", result="miss" if bought_30_days == "N/A" else "hit")
+
+        return {
+            "price_value": price_value,
+            "price_string": price_string,
+            "product_name": select_text("product_name", selectors["product_name"]) or "Unknown Product",
+            "discount": parse_discount(select_text("discount", selectors["discount"])),
+            "bought_30_days": bought_30_days,
+            "rating": parse_rating(select_text("rating", selectors["rating"])),
+            "num_ratings": parse_num_ratings(select_text("num_ratings", selectors["num_ratings"])),
+        }
+
+
+def _parse_unless_unchanged(html, product_id):
+    """Parse a product page, reusing the fields of the product's previous page when it is identical."""
+    if not change_tracker.enabled:
+        return parse_product_html(html)
+
+    current_hash = page_hash(html)
+    data = change_tracker.cached_extraction(product_id, current_hash)
+    if data is None:
+        data = parse_product_html(html)
+    data["page_hash"] = current_hash
+    return data
+
+
+def _remember_page(data, product_id):
+    if "page_hash" in data:
+        change_tracker.remember_page(product_id, data.pop("page_hash"), data)
+
+
+async def _extract_name_with_llm(lease, url):
+    """
+    Fall back to LLM extraction when the product name selector misses.
+
+    Args:
+        lease (BrowserLease): The leased browser session
+        url (str): The page URL, or a "raw:" document that was already fetched
+
+    Returns:
+        str: The product name, or "Unknown Product"
+    """
+    llm_strategy = LLMExtractionStrategy(
+        llm_config=LLMConfig(provider=LLM_MODEL, api_token=API_TOKEN),
+        instruction=NAME_INSTRUCTION,
+        extraction_type="json",
+        input_format="markdown",
+        verbose=True,
+    )
+
+    # Run the crawler for product name with LLM
+    name_result = await lease.crawler.arun(
+        url=url,
+        config=CrawlerRunConfig(
+            cache_mode=CacheMode.BYPASS,
+            extraction_strategy=llm_strategy,
+            session_id=lease.session("_name_llm"),
+        ),
+    )
+
+    product_name = "Unknown Product"
+    if name_result.success and name_result.extracted_content:
+        try:
+            data = json.loads(name_result.extracted_content)
+            if isinstance(data, list) and data:
+                data = data[0] if isinstance(data[0], dict) else {"name": "Unknown Product"}
+            elif not isinstance(data, dict):
+                data = {"name": "Unknown Product"}
+
+            product_name = data.get("name", "Unknown Product")
+        except json.JSONDecodeError:
+            logger.warning("Error parsing product name JSON", extra={"url": url[:200]})
+
+    return product_name
+
+
+def name_region(html):
+    """Return the text of the page region the product name fallback depends on."""
+    soup = BeautifulSoup(html, "lxml")
+    # One selector at a time: a selector group would return whichever match comes first in the page
+    region = next(
+        (match for match in (soup.select_one(selector) for selector in PRODUCT_NAME_REGION_SELECTORS) if match),
+        None,
+    )
+    if region is None:
+        region = soup.title or soup
+    return region.get_text(" ", strip=True)
+
+
+async def _extract_name_with_cache(html, cache_id):
+    """
+    Ask the LLM for the product name using only the title region of an already
+    fetched page, reusing a cached result while that region is unchanged.
+    """
+    region = name_region(html)
+    region_hash = content_hash(region)
+    cached_name = await asyncio.to_thread(llm_cache.get, "product_name", cache_id, region_hash)
+    if cached_name is not None:
+        return cached_name
+
+    try:
+        # Batched with other fallbacks and coalesced with identical in-flight requests
+        with metrics.time_stage("llm_fallback"):
+            result = await llm_service.extract(NAME_INSTRUCTION, region, ProductName)
+    except Exception as e:
+        logger.error("Error extracting product name with LLM", extra={"product_id": cache_id, "error": str(e)})
+        return "Unknown Product"
+
+    if result is None or not result.name:
+        return "Unknown Product"
+
+    await asyncio.to_thread(llm_cache.set, "product_name", cache_id, region_hash, result.name)
+    return result.name
+
+
+async def _extract_single_fetch(lease, url, cache_id, profile):
+    """
+    Load the product page once and parse every selector from that document.
+
+    Returns:
+        tuple: (parsed fields, page HTML or None if the fetch failed)
+    """
+    with metrics.time_stage("navigation") as run:
+        page_result = await lease.crawler.arun(
             url=url,
-            config=CrawlerRunConfig(
-                cache_mode=CacheMode.BYPASS,
-                css_selector=NUM_OF_RATINGS,
-                session_id=f"{session_id}_num_ratings",
-            ),
+            config=profile.run_config(lease.session_id),
         )
-        
-        num_ratings = "Not available"
-        if num_ratings_result.success and num_ratings_result.cleaned_html:
-            # Clean up the number of ratings text by removing HTML tags
-            num_ratings_text = re.sub(r'<[^>]+>', '', num_ratings_result.cleaned_html).strip()
-            # Extract just the number if it exists
-            num_ratings_match = re.search(r'(\d{1,3}(?:,\d{3})*)', num_ratings_text)
-            if num_ratings_match:
-                num_ratings = num_ratings_match.group(1)
-            else:
-                num_ratings = num_ratings_text
-        
-        # If CSS selector fails, fall back to LLM extraction
-        if product_name == "Unknown Product":
-            instruction = (
-                "Extract only the exact product name from this Amazon product page. "
-                "Return the data in JSON format with key 'name'."
-            )
-            
-            llm_strategy = LLMExtractionStrategy(
-                llm_config=LLMConfig(provider=LLM_MODEL, api_token=API_TOKEN),
-                instruction=instruction,
-                extraction_type="json",
-                input_format="markdown",
-                verbose=True,
-            )
-            
-            # Run the crawler for product name with LLM
-            name_result = await crawler.arun(
+        run.failed = not (page_result.success and page_result.html)
+
+    if run.failed:
+        logger.error("Error fetching product page", extra={"url": url, "error": page_result.error_message})
+        return parse_product_html(""), None
+
+    data = _parse_unless_unchanged(page_result.html, cache_id)
+
+    # If CSS selector fails, run the LLM over the document we already have instead of reloading it
+    if data["product_name"] == "Unknown Product":
+        data["product_name"] = await _extract_name_with_cache(page_result.html, cache_id)
+
+    _remember_page(data, cache_id)
+    return data, page_result.html
+
+
+def has_required_fields(data):
+    """Whether an extraction found the selectors the tracker cannot do without."""
+    return data["price_value"] is not None and data["product_name"] != "Unknown Product"
+
+
+async def _extract_http(url, product_id=None):
+    """
+    Fetch the product page with a plain HTTP request and parse it.
+
+    Returns:
+        tuple: (parsed fields, page HTML), or (None, None) if the browser is needed
+    """
+    status, html = await http_fetcher.fetch(url)
+    if status != 200 or not html:
+        return None, None
+    if is_bot_check(html):
+        logger.info("Bot check page returned over HTTP, escalating to browser", extra={"url": url})
+        return None, None
+
+    data = _parse_unless_unchanged(html, product_id)
+    if not has_required_fields(data):
+        return None, None
+    _remember_page(data, product_id)
+    return data, html
+
+
+async def _extract_multi_fetch(lease, url, profile):
+    """Legacy mode: load the product page once per selector."""
+    async def fetch_selector_text(css_selector, suffix):
+        with metrics.time_stage("navigation") as run:
+            result = await lease.crawler.arun(
                 url=url,
-                config=CrawlerRunConfig(
-                    cache_mode=CacheMode.BYPASS,
-                    extraction_strategy=llm_strategy,
-                    session_id=f"{session_id}_name_llm",
+                config=profile.run_config(
+                    lease.session(suffix) if suffix else lease.session_id,
+                    css_selector=css_selector,  # Target specific content on the page
                 ),
             )
-            
-            if name_result.success and name_result.extracted_content:
-                try:
-                    data = json.loads(name_result.extracted_content)
-                    if isinstance(data, list) and data:
-                        data = data[0] if isinstance(data[0], dict) else {"name": "Unknown Product"}
-                    elif not isinstance(data, dict):
-                        data = {"name": "Unknown Product"}
-                    
-                    product_name = data.get("name", "Unknown Product")
-                except json.JSONDecodeError:
-                    print("Error parsing product name JSON")
-        
-        timestamp = datetime.datetime.now()
-        return price_value, price_string, product_name, discount, rating, num_ratings, timestamp
\ No newline at end of file
+            run.failed = not result.success
+        if result.success and result.cleaned_html:
+            # Extract just the text content by removing all HTML tags
+            return _strip_tags(result.cleaned_html)
+        return ""
+
+    price_value, price_string = parse_price(await fetch_selector_text(PRICE_SELECTOR, ""))
+    discount = parse_discount(await fetch_selector_text(DISCOUNT_SELECTOR, "_discount"))
+    product_name = await fetch_selector_text(PRODUCT_NAME_SELECTOR, "_name") or "Unknown Product"
+    rating = parse_rating(await fetch_selector_text(RATING_SELECTOR, "_rating"))
+    num_ratings = parse_num_ratings(await fetch_selector_text(NUM_OF_RATINGS, "_num_ratings"))
+
+    # If CSS selector fails, fall back to LLM extraction
+    if product_name == "Unknown Product":
+        product_name = await _extract_name_with_llm(lease, url)
+
+    return {
+        "price_value": price_value,
+        "price_string": price_string,
+        "product_name": product_name,
+        "discount": discount,
+        "bought_30_days": "N/A",
+        "rating": rating,
+        "num_ratings": num_ratings,
+    }
+
+
+async def extract_product_data(url, single_fetch=SINGLE_FETCH_EXTRACTION, product_id=None, fast_path=HTTP_FAST_PATH,
+                               browser_profile=None):
+    """
+    Extract the current price and product details from a product URL.
+
+    Args:
+        url (str): The product URL to scrape
+        single_fetch (bool): If True, load the page once and parse all selectors from it
+        product_id (str, optional): Product key used to remember which fetch path works
+        fast_path (bool): If True, try a plain HTTP request before using the browser
+        browser_profile (str, optional): Browser profile for the page, the configured default if not given
+
+    Returns:
+        dict: The extracted fields plus the 'timestamp' of the check, the 'fetch_path' used
+              and the 'snapshot_id' of the stored page (None when snapshots are off)
+    """
+    path_key = product_id or url
+
+    data, html = None, None
+    if fast_path and fetch_path_tracker.should_try_http(path_key):
+        data, html = await _extract_http(url, path_key)
+        fetch_path_tracker.record_http(path_key, data is not None)
+        if data is not None:
+            fetch_paths.inc(path="http")
+            data["fetch_path"] = "http"
+
+    if data is None:
+        # Lease a page from the warm browser pool instead of launching a new browser per call
+        profile = get_browser_profile(browser_profile)
+        async with get_browser_pool(profile.name).lease() as lease:
+            if single_fetch:
+                data, html = await _extract_single_fetch(lease, url, path_key, profile)
+            else:
+                # Only fragments are fetched in this mode, so there is no page to snapshot
+                data = await _extract_multi_fetch(lease, url, profile)
+
+        fetch_path_tracker.record_browser(path_key)
+        fetch_paths.inc(path="browser")
+        data["fetch_path"] = "browser"
+
+    data["timestamp"] = datetime.datetime.now()
+    data["snapshot_id"] = None
+    if html and snapshot_store.enabled:
+        try:
+            data["snapshot_id"] = await asyncio.to_thread(
+                snapshot_store.save, html, path_key, url, data["timestamp"], data["fetch_path"]
+            )
+        except OSError as e:
+            # Losing a snapshot must never lose the price check itself
+            logger.error("Error storing page snapshot", extra={"url": url, "error": str(e)})
+    return data
+
+
+async def extract_product_price(url):
+    """
+    Extract the current price of a product from its URL.
+
+    Args:
+        url (str): The product URL to scrape
+
+    Returns:
+        tuple: (price_value, price_string, product_name, discount, rating, num_ratings, timestamp)
+    """
+    data = await extract_product_data(url)
+    return (
+        data["price_value"], data["price_string"], data["product_name"], data["discount"],
+        data["rating"], data["num_ratings"], data["timestamp"]
+    )
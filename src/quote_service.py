@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+import datetime
+from collections import OrderedDict
+
+from config import QUOTE_CACHE_TTL, QUOTE_CACHE_MAX_ENTRIES, QUOTE_BATCH_CONCURRENCY
+from src.scheduler import WatchedProduct
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+quote_requests = metrics.counter(
+    "quote_requests_total", "Quote requests by how they were served", ["source"]
+)
+
+
+class QuoteService:
+    """
+    Fresh price quotes for single-run callers such as an API.
+
+    A quote is served from memory when the last successful check of the product
+    is no older than the caller's max staleness. Otherwise the product is
+    checked, and every request for it that arrives while the check runs waits
+    for that same check instead of starting its own. Failed checks are returned
+    to their waiters but never cached.
+
+    A check is only handed out once `flush` has run, so the records it stored
+    are written even when the caller's event loop ends right after the quote.
+    """
+
+    def __init__(self, check_product, ttl=QUOTE_CACHE_TTL, max_entries=QUOTE_CACHE_MAX_ENTRIES,
+                 batch_concurrency=QUOTE_BATCH_CONCURRENCY, flush=None):
+        """
+        Args:
+            check_product (callable): Coroutine function that checks a WatchedProduct and returns its result
+            ttl (float): Seconds a quote is kept, and the staleness accepted by default
+            max_entries (int): Quotes kept before the least recently used are evicted
+            batch_concurrency (int): Checks running at the same time for one batch lookup
+            flush (callable, optional): Coroutine function that writes what a check queued for storage
+        """
+        self.check_product = check_product
+        self.flush = flush
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.batch_concurrency = batch_concurrency
+        # product_id -> (monotonic time the check finished, result), least recently used first
+        self._cache = OrderedDict()
+        self._in_flight = {}
+
+    @property
+    def size(self):
+        return len(self._cache)
+
+    def _cached(self, product_id, max_staleness):
+        entry = self._cache.get(product_id)
+        if entry is None:
+            return None
+        fetched_at, result = entry
+        age = time.monotonic() - fetched_at
+        if age > self.ttl:
+            del self._cache[product_id]
+            return None
+        if age > max_staleness:
+            return None
+        self._cache.move_to_end(product_id)
+        return age, result
+
+    def _store(self, product_id, fetched_at, result):
+        self._cache[product_id] = (fetched_at, result)
+        self._cache.move_to_end(product_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _check(self, product):
+        try:
+            result = await self.check_product(product)
+        except Exception as e:
+            logger.exception("Error checking product for a quote", extra={"product_id": product.product_id})
+            result = {
+                "product_id": product.product_id,
+                "error": str(e),
+                "timestamp": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+        if self.flush is not None:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error writing the records of a quote", extra={"product_id": product.product_id})
+        fetched_at = time.monotonic()
+        if "error" not in result:
+            self._store(product.product_id, fetched_at, result)
+        return fetched_at, result
+
+    async def get_quote(self, product, max_staleness=None):
+        """
+        Get the price of a product, no older than `max_staleness` seconds.
+
+        Args:
+            product (WatchedProduct or str): The product, or its URL or ASIN
+            max_staleness (float, optional): Oldest quote accepted in seconds, capped at the TTL;
+                                             0 always waits for a check
+
+        Returns:
+            dict: The check result, with quote_age in seconds and quote_source
+                  ("cache", "coalesced" or "check")
+        """
+        if not isinstance(product, WatchedProduct):
+            product = WatchedProduct.from_ref(product, self.ttl)
+        max_staleness = self.ttl if max_staleness is None else min(max_staleness, self.ttl)
+
+        cached = self._cached(product.product_id, max_staleness)
+        if cached is not None:
+            age, result = cached
+            quote_requests.inc(source="cache")
+            return dict(result, quote_age=round(age, 3), quote_source="cache")
+
+        task = self._in_flight.get(product.product_id)
+        if task is None:
+            source = "check"
+            task = self._in_flight[product.product_id] = asyncio.create_task(self._check(product))
+            task.add_done_callback(lambda _: self._in_flight.pop(product.product_id, None))
+        else:
+            source = "coalesced"
+        quote_requests.inc(source=source)
+
+        # Shielded so a caller that gives up does not cancel the check the others are waiting for
+        fetched_at, result = await asyncio.shield(task)
+        return dict(result, quote_age=round(time.monotonic() - fetched_at, 3), quote_source=source)
+
+    async def get_quotes(self, products, max_staleness=None):
+        """
+        Get the prices of many products in one call.
+
+        Cached quotes are returned right away and at most `batch_concurrency`
+        checks run at the same time for the rest.
+
+        Args:
+            products (iterable): WatchedProduct entries, URLs or ASINs
+            max_staleness (float, optional): Oldest quote accepted in seconds
+
+        Returns:
+            dict: Quote of every product keyed by product ID
+        """
+        unique = {}
+        for product in products:
+            if not isinstance(product, WatchedProduct):
+                product = WatchedProduct.from_ref(product, self.ttl)
+            unique[product.product_id] = product
+
+        staleness = self.ttl if max_staleness is None else min(max_staleness, self.ttl)
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def quote(product):
+            if self._cached(product.product_id, staleness) is not None or product.product_id in self._in_flight:
+                # Served from memory or by a check that is already running, so no slot is needed
+                return await self.get_quote(product, max_staleness)
+            async with semaphore:
+                return await self.get_quote(product, max_staleness)
+
+        results = await asyncio.gather(*(quote(product) for product in unique.values()))
+        return dict(zip(unique, results))
+
+    def invalidate(self, product_id=None):
+        """Drop the cached quote of a product, or of every product."""
+        if product_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(product_id, None)
@@ -0,0 +1,155 @@
+import re
+
+# Bucket start of a timestamp at each rollup resolution
+RESOLUTIONS = {
+    "minute": lambda timestamp: timestamp.replace(second=0, microsecond=0),
+    "hour": lambda timestamp: timestamp.replace(minute=0, second=0, microsecond=0),
+    "day": lambda timestamp: timestamp.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def parse_discount_value(discount):
+    """Parse a discount string such as "-15%" into a signed number, or None if there is no discount."""
+    match = re.search(r'(-?\d+(?:\.\d+)?)%', discount or "")
+    return float(match.group(1)) if match else None
+
+
+def parse_rating_value(rating):
+    """Parse a rating string such as "4.5 out of 5" into a number, or None if there is no rating."""
+    match = re.search(r'(\d+(?:\.\d+)?)', rating or "")
+    return float(match.group(1)) if match else None
+
+
+class RollupBucket:
+    """
+    Open/high/low/close price, deepest discount, last rating and sample count of
+    one product in one time bucket.
+
+    Discounts are stored signed, as listed ("-15%" is -15.0), so min_discount is
+    the deepest markdown seen in the bucket.
+    """
+
+    def __init__(self, product_id, resolution, bucket):
+        self.product_id = product_id
+        self.resolution = resolution
+        self.bucket = bucket
+        self.open = self.high = self.low = self.close = None
+        self.open_time = self.close_time = None
+        self.min_discount = None
+        self.last_rating = None
+        self.rating_time = None
+        self.samples = 0
+
+    def add(self, document):
+        """Add a price document, in any order relative to the ones already added."""
+        price = document.get("price_numeric")
+        timestamp = document["timestamp"]
+        if price is None:
+            return
+
+        if self.open_time is None or timestamp < self.open_time:
+            self.open, self.open_time = price, timestamp
+        if self.close_time is None or timestamp >= self.close_time:
+            self.close, self.close_time = price, timestamp
+        self.high = price if self.high is None else max(self.high, price)
+        self.low = price if self.low is None else min(self.low, price)
+
+        discount = parse_discount_value(document.get("discount"))
+        if discount is not None:
+            self.min_discount = discount if self.min_discount is None else min(self.min_discount, discount)
+        rating = parse_rating_value(document.get("rating"))
+        if rating is not None and (self.rating_time is None or timestamp >= self.rating_time):
+            self.last_rating, self.rating_time = rating, timestamp
+        self.samples += 1
+
+    def key(self):
+        return {"product_id": self.product_id, "resolution": self.resolution, "bucket": self.bucket}
+
+    def to_document(self):
+        return dict(
+            self.key(), open=self.open, high=self.high, low=self.low, close=self.close,
+            open_time=self.open_time, close_time=self.close_time, min_discount=self.min_discount,
+            last_rating=self.last_rating, rating_time=self.rating_time, samples=self.samples,
+        )
+
+    def merge_operation(self):
+        """
+        Build an upsert that merges this bucket into the stored one.
+
+        The merge runs as an update pipeline (MongoDB 4.2+), so open, close and
+        the last rating follow the earliest and latest timestamps no matter which
+        order batches arrive in, and concurrent writers never overwrite each other.
+        """
+        from pymongo import UpdateOne
+
+        def take_if(condition, value, field):
+            return {"$cond": [condition, value, f"${field}"]}
+
+        earlier = {"$or": [{"$eq": [{"$ifNull": ["$open_time", None]}, None]}, {"$lt": [self.open_time, "$open_time"]}]}
+        later = {"$or": [{"$eq": [{"$ifNull": ["$close_time", None]}, None]}, {"$gte": [self.close_time, "$close_time"]}]}
+        newer_rating = {"$and": [
+            self.rating_time is not None,
+            {"$or": [{"$eq": [{"$ifNull": ["$rating_time", None]}, None]}, {"$gte": [self.rating_time, "$rating_time"]}]},
+        ]}
+
+        return UpdateOne(self.key(), [{"$set": {
+            "open": take_if(earlier, self.open, "open"),
+            "open_time": {"$min": ["$open_time", self.open_time]},
+            "close": take_if(later, self.close, "close"),
+            "close_time": {"$max": ["$close_time", self.close_time]},
+            "high": {"$max": ["$high", self.high]},
+            "low": {"$min": ["$low", self.low]},
+            "min_discount": {"$min": ["$min_discount", self.min_discount]},
+            "last_rating": take_if(newer_rating, self.last_rating, "last_rating"),
+            "rating_time": {"$max": ["$rating_time", self.rating_time]},
+            "samples": {"$add": [{"$ifNull": ["$samples", 0]}, self.samples]},
+        }}], upsert=True)
+
+    def replace_operation(self):
+        """Build an upsert that replaces the stored bucket, for rebuilding rollups from scratch."""
+        from pymongo import ReplaceOne
+
+        return ReplaceOne(self.key(), self.to_document(), upsert=True)
+
+
+def aggregate_documents(documents, resolutions=tuple(RESOLUTIONS)):
+    """
+    Roll a batch of price documents up into buckets.
+
+    Returns:
+        list: RollupBucket entries, one per product, resolution and bucket in the batch
+    """
+    buckets = {}
+    for document in documents:
+        if document.get("price_numeric") is None or document.get("timestamp") is None:
+            continue
+        for resolution in resolutions:
+            start = RESOLUTIONS[resolution](document["timestamp"])
+            key = (document.get("product_id"), resolution, start)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = RollupBucket(*key)
+            bucket.add(document)
+    return list(buckets.values())
+
+
+def iter_rollups(sorted_documents, resolutions=tuple(RESOLUTIONS)):
+    """
+    Roll up documents sorted by product and time, yielding each bucket once it is complete.
+
+    Only one open bucket per resolution is held at a time, so any amount of
+    history can be streamed through.
+    """
+    current = {}
+    for document in sorted_documents:
+        if document.get("price_numeric") is None:
+            continue
+        for resolution in resolutions:
+            key = (document.get("product_id"), resolution, RESOLUTIONS[resolution](document["timestamp"]))
+            bucket = current.get(resolution)
+            if bucket is None or (bucket.product_id, bucket.resolution, bucket.bucket) != key:
+                if bucket is not None:
+                    yield bucket
+                bucket = current[resolution] = RollupBucket(*key)
+            bucket.add(document)
+    yield from current.values()
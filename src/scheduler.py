@@ -0,0 +1,217 @@
+import os
+import time
+import heapq
+import logging
+import asyncio
+import itertools
+
+from config import TRACKER_CONCURRENCY, DEFAULT_MARKETPLACE
+from src.utils import parse_product_ref
+
+logger = logging.getLogger(__name__)
+
+
+class WatchedProduct:
+    """A product on the watchlist and when it is next due to be checked."""
+
+    def __init__(self, product_id, url, interval, asin=None, marketplace=None, browser_profile=None):
+        self.product_id = product_id
+        self.url = url
+        self.interval = interval
+        self.asin = asin
+        self.marketplace = marketplace
+        self.browser_profile = browser_profile
+        self.next_due = 0.0
+
+    @classmethod
+    def from_ref(cls, value, interval, marketplace=DEFAULT_MARKETPLACE, browser_profile=None):
+        """Build a watched product from a product URL or ASIN."""
+        ref = parse_product_ref(value, marketplace)
+        return cls(ref["product_id"], ref["url"], interval, ref["asin"], ref["marketplace"], browser_profile)
+
+
+def _is_known_browser_profile(name):
+    """Whether a watchlist entry's browser profile exists; entries without one use the default."""
+    if name is None:
+        return True
+    # Imported only when an entry names a profile, since the profiles load crawl4ai
+    from src.browser_profiles import BROWSER_PROFILES
+    return name in BROWSER_PROFILES
+
+
+def load_watchlist_file(path, default_interval):
+    """
+    Load a watchlist from a text file.
+
+    Each non-empty line holds a product URL or ASIN, optionally followed by the
+    interval in seconds and the browser profile for that product. Lines starting
+    with '#' and lines naming an unknown browser profile are skipped.
+
+    Args:
+        path (str): Path to the watchlist file
+        default_interval (float): Interval used when a line does not set one
+
+    Returns:
+        list: WatchedProduct entries, without duplicates
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Watchlist file not found: {path}")
+
+    products = {}
+    with open(path, mode='r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            parts = line.split()
+            interval = default_interval
+            if len(parts) > 1:
+                try:
+                    interval = float(parts[1])
+                except ValueError:
+                    logger.warning("Invalid interval in watchlist, using the default",
+                                   extra={"path": path, "line": line_number, "interval": default_interval})
+            browser_profile = parts[2] if len(parts) > 2 else None
+            if not _is_known_browser_profile(browser_profile):
+                logger.warning("Unknown browser profile in watchlist, skipping the line",
+                               extra={"path": path, "line": line_number, "browser_profile": browser_profile})
+                continue
+
+            product = WatchedProduct.from_ref(parts[0], interval, browser_profile=browser_profile)
+            products[product.product_id] = product
+
+    return list(products.values())
+
+
+def load_watchlist_from_mongodb(default_interval):
+    """
+    Load a watchlist from the MongoDB watchlist collection.
+
+    Documents hold a 'url' or 'asin', and optionally 'marketplace', 'interval'
+    and 'browser_profile'. Documents naming an unknown browser profile are skipped.
+
+    Args:
+        default_interval (float): Interval used when a document does not set one
+
+    Returns:
+        list: WatchedProduct entries, without duplicates
+    """
+    from src.mongodb_handler import mongodb_handler
+
+    products = {}
+    for document in mongodb_handler.get_watchlist():
+        value = document.get("url") or document.get("asin")
+        if not value:
+            continue
+        browser_profile = document.get("browser_profile")
+        if not _is_known_browser_profile(browser_profile):
+            logger.warning("Unknown browser profile in watchlist, skipping the product",
+                           extra={"product": value, "browser_profile": browser_profile})
+            continue
+        product = WatchedProduct.from_ref(
+            value,
+            document.get("interval") or default_interval,
+            document.get("marketplace") or DEFAULT_MARKETPLACE,
+            browser_profile,
+        )
+        products[product.product_id] = product
+
+    return list(products.values())
+
+
+class TrackingScheduler:
+    """
+    Runs product checks concurrently under a fixed concurrency limit.
+
+    Products are kept in a priority queue keyed by the time they are next due,
+    and each one is rescheduled once its check finishes: with the interval the
+    polling policy picks from the check result, or its own fixed interval.
+    """
+
+    def __init__(self, products, check_product, concurrency=TRACKER_CONCURRENCY, policy=None):
+        """
+        Args:
+            products (list): WatchedProduct entries to track
+            check_product (callable): Coroutine function run with each due product
+            concurrency (int): Maximum number of checks in flight
+            policy (AdaptivePollingPolicy, optional): Chooses each product's next interval
+        """
+        self.check_product = check_product
+        self.concurrency = concurrency
+        self.policy = policy
+        self._queue = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        for product in products:
+            self.add_product(product)
+
+    def add_product(self, product, due=None):
+        """Add a product to the queue, due immediately unless `due` is given."""
+        product.next_due = time.monotonic() if due is None else due
+        heapq.heappush(self._queue, (product.next_due, next(self._sequence), product))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_interval(self, product, result):
+        if self.policy is None:
+            return product.interval
+        try:
+            return self.policy.next_interval(product, result)
+        except Exception:
+            logger.exception("Error choosing the next interval", extra={"product_id": product.product_id})
+            return product.interval
+
+    async def _run_check(self, product, semaphore):
+        result = None
+        try:
+            result = await self.check_product(product)
+        except Exception:
+            logger.exception("Error checking product", extra={"product_id": product.product_id})
+        finally:
+            semaphore.release()
+            self.add_product(product, time.monotonic() + self._next_interval(product, result))
+
+    async def run(self, single_pass=False):
+        """
+        Run checks as products come due.
+
+        Args:
+            single_pass (bool): If True, check every product once and return
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        in_flight = set()
+        remaining = len(self._queue) if single_pass else None
+
+        try:
+            while remaining is None or remaining > 0:
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                delay = self._queue[0][0] - time.monotonic()
+                if delay > 0:
+                    # Sleep until the next product is due, or until a product is added
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await semaphore.acquire()
+                _, _, product = heapq.heappop(self._queue)
+                task = asyncio.create_task(self._run_check(product, semaphore))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                if remaining is not None:
+                    remaining -= 1
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            self._wakeup = None
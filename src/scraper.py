@@ -1,6 +1,9 @@
 import json
+import asyncio
+import logging
+from bs4 import BeautifulSoup
 from pydantic import BaseModel
-from typing import List, Set, Tuple
+from typing import List, Set, Tuple, Union
 from crawl4ai import (
     AsyncWebCrawler,
     BrowserConfig,
@@ -18,16 +21,37 @@ if __name__ == "__main__":
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.utils import is_duplicated
-from config import LLM_MODEL, API_TOKEN
+from src.llm_cache import llm_cache, content_hash
+from src.llm_service import BatchedLLMExtraction
+from src.dedup import ProductDeduplicator
+from src.browser_profiles import BrowserProfile, get_browser_profile
+from src.metrics import metrics
+from config import LLM_MODEL, API_TOKEN, MAX_PAGES, CATEGORY_CRAWL_CONCURRENCY
 
+logger = logging.getLogger(__name__)
 
-def get_browser_config() -> BrowserConfig:
+
+def get_browser_config(profile: BrowserProfile = None) -> BrowserConfig:
     """
     Returns the browser configuration for the crawler.
 
+    Args:
+        profile (BrowserProfile, optional): Browser profile; the full profile if not given.
+
     Returns:
         BrowserConfig: The configuration settings for the browser.
     """
+    if profile is not None and profile.blocks_requests:
+        # Lean profile: no image decoding or background features, quiet logs
+        return BrowserConfig(
+            browser_type="chromium",
+            headless=True,
+            verbose=profile.verbose,
+            text_mode=True,  # Disable images and other rich content
+            light_mode=True,  # Disable background features
+            extra_args=["--blink-settings=imagesEnabled=false", "--mute-audio", "--disable-extensions"],
+        )
+
     # https://docs.crawl4ai.com/core/browser-crawler-config/
     return BrowserConfig(
         browser_type="chromium",  # Type of browser that we gonna simulate
@@ -55,42 +79,61 @@ def get_llm_strategy(llm_instructions: str, output_format: BaseModel) -> LLMExtr
         verbose=True,  # Enable verbose logging
     )
 
-# Only updating the check_no_results function, the rest remains the same
-async def check_no_results(
-    crawler: AsyncWebCrawler,
-    url: str,
-    session_id: str,
-) -> bool:
+def is_no_results_page(html: str) -> bool:
     """
-    Checks if the "No Results Found" message is present on the page.
+    Checks if an already fetched page shows Amazon's "No Results Found" message.
 
     Args:
-        crawler (AsyncWebCrawler): The web crawler instance.
-        url (str): The URL to check.
-        session_id (str): The session identifier.
+        html (str): The page HTML.
 
     Returns:
-        bool: True if "No Results Found" message is found, False otherwise.
-    """
-    # Fetch the page without any CSS selector or extraction strategy
-    result = await crawler.arun(
-        url=url,
-        config=CrawlerRunConfig(
-            cache_mode=CacheMode.BYPASS,
-            session_id=session_id,
-        ),
-    )
+        bool: True if the message is present, False otherwise.
+    """
+    return "No results for" in html or "Try checking your spelling" in html
+
+
+def select_region(html: str, css_selector: str) -> str:
+    """
+    Returns the HTML of the elements matched by a CSS selector, or the whole page without a selector.
+    """
+    if not css_selector:
+        return html
+    soup = BeautifulSoup(html, "lxml")
+    return "".join(str(element) for element in soup.select(css_selector))
 
-    if result.success:
-        # Amazon's no results message
-        if "No results for" in result.cleaned_html or "Try checking your spelling" in result.cleaned_html:
-            return True
-    else:
-        print(
-            f"Error fetching page for 'No Results Found' check: {result.error_message}"
-        )
 
-    return False
+def get_batched_llm_strategy(llm_instructions: str, output_format: BaseModel) -> BatchedLLMExtraction:
+    """
+    Returns extraction settings that route pages through the shared LLM extraction service,
+    which batches pages into fewer prompts and limits concurrent provider calls.
+
+    Returns:
+        BatchedLLMExtraction: The instructions and output model for the service.
+    """
+    return BatchedLLMExtraction(llm_instructions, output_format)
+
+
+def region_to_text(html: str, css_selector: str) -> str:
+    """
+    Returns the text of the elements matched by a CSS selector, keeping links as markdown
+    so product URLs survive, for use as compact LLM input.
+    """
+    soup = BeautifulSoup(select_region(html, css_selector), "lxml")
+    for link in soup.select("a[href]"):
+        link.replace_with(f"[{link.get_text(' ', strip=True)}]({link['href']})")
+    return soup.get_text("\n", strip=True)
+
+
+def _is_duplicate(business: dict, seen_names: Union[Set[str], ProductDeduplicator]) -> bool:
+    """Check a business against those seen so far and remember it."""
+    if isinstance(seen_names, ProductDeduplicator):
+        duplicate = seen_names.check_and_add(business)
+    else:
+        duplicate = is_duplicated(business["name"], seen_names)
+        seen_names.add(business["name"])
+    if duplicate:
+        logger.debug("Duplicate business found, skipping", extra={"business_name": business.get("name")})
+    return duplicate
 
 
 async def fetch_and_process_page(
@@ -98,9 +141,10 @@ async def fetch_and_process_page(
     page_number: int,
     base_url: str,
     css_selector: str,
-    llm_strategy: LLMExtractionStrategy,
+    llm_strategy: Union[LLMExtractionStrategy, BatchedLLMExtraction],
     session_id: str,
-    seen_names: Set[str],
+    seen_names: Union[Set[str], ProductDeduplicator] = None,
+    browser_profile: BrowserProfile = None,
 ) -> Tuple[List[dict], bool]:
     """
     Fetches and processes a single page.
@@ -110,10 +154,13 @@ async def fetch_and_process_page(
         page_number (int): The page number to fetch.
         base_url (str): The base URL of the website.
         css_selector (str): The CSS selector to target the content.
-        llm_strategy (LLMExtractionStrategy): The LLM extraction strategy.
+        llm_strategy (LLMExtractionStrategy | BatchedLLMExtraction): The LLM extraction strategy,
+            or settings for the batched LLM extraction service.
         session_id (str): The session identifier.
         required_keys (List[str]): List of required keys.
-        seen_names (Set[str]): Set of names that have already been seen.
+        seen_names (Set[str] | ProductDeduplicator, optional): Names that have already been seen,
+            or a deduplicator matching on ASIN and near-duplicate titles. Nothing is skipped if not given.
+        browser_profile (BrowserProfile, optional): Profile the page is loaded with.
 
     Returns:
         Tuple[List[dict], bool]:
@@ -121,58 +168,177 @@ async def fetch_and_process_page(
             - bool: A flag indicating if the "No Results Found" message was encountered.
     """
     url = base_url.format(page_number=page_number)
-    print(f"Loading page {page_number}...")
+    logger.info("Loading page", extra={"page": page_number, "url": url})
+
+    # Fetch the page once; the "No Results Found" check and the extraction both use this HTML
+    if browser_profile is not None:
+        # No selector wait: a "No Results Found" page never shows the results container
+        page_config = browser_profile.run_config(session_id, wait_for_selector=False)
+    else:
+        page_config = CrawlerRunConfig(
+            cache_mode=CacheMode.BYPASS,  # Do not use cached data
+            session_id=session_id,  # Unique session ID for the crawl
+        )
+    with metrics.time_stage("navigation") as run:
+        page_result = await crawler.arun(url=url, config=page_config)
+        run.failed = not (page_result.success and page_result.html)
+
+    if run.failed:
+        logger.error("Error fetching page", extra={"page": page_number, "error": page_result.error_message})
+        return [], False
 
     # Check if "No Results Found" message is present
-    no_results = await check_no_results(crawler, url, session_id)
-    if no_results:
+    if is_no_results_page(page_result.cleaned_html or page_result.html):
         return [], True  # No more results, signal to stop crawling
 
-    # Fetch page content with the extraction strategy
-    result = await crawler.arun(
-        url=url,
-        config=CrawlerRunConfig(
-            cache_mode=CacheMode.BYPASS,  # Do not use cached data
-            extraction_strategy=llm_strategy,  # Strategy for data extraction
-            css_selector=css_selector,  # Target specific content on the page
-            session_id=session_id,  # Unique session ID for the crawl
-        ),
+    # Reuse the LLM result of an earlier crawl if the instructions and targeted content have not changed
+    region_hash = content_hash(
+        (getattr(llm_strategy, "instruction", "") or "") + select_region(page_result.html, css_selector)
     )
+    extracted_content = await asyncio.to_thread(llm_cache.get, "search_results", url, region_hash)
 
-    if not (result.success and result.extracted_content):
-        print(f"Error fetching page {page_number}: {result.error_message}")
-        return [], False
+    if extracted_content is None and isinstance(llm_strategy, BatchedLLMExtraction):
+        try:
+            with metrics.time_stage("llm_extraction"):
+                businesses = await llm_strategy.extract(region_to_text(page_result.html, css_selector))
+        except Exception as e:
+            logger.error("Error extracting page", extra={"page": page_number, "error": str(e)})
+            return [], False
+
+        extracted_content = json.dumps(businesses)
+        await asyncio.to_thread(llm_cache.set, "search_results", url, region_hash, extracted_content)
+
+    elif extracted_content is None:
+        with metrics.time_stage("llm_extraction") as run:
+            result = await crawler.arun(
+                url=f"raw:{page_result.html}",
+                config=CrawlerRunConfig(
+                    cache_mode=CacheMode.BYPASS,  # Do not use cached data
+                    extraction_strategy=llm_strategy,  # Strategy for data extraction
+                    css_selector=css_selector,  # Target specific content on the page
+                    session_id=session_id,  # Unique session ID for the crawl
+                ),
+            )
+            run.failed = not (result.success and result.extracted_content)
+
+        if run.failed:
+            logger.error("Error extracting page", extra={"page": page_number, "error": result.error_message})
+            return [], False
+
+        extracted_content = result.extracted_content
+        await asyncio.to_thread(llm_cache.set, "search_results", url, region_hash, extracted_content)
 
     # Parse extracted content
-    extracted_data = json.loads(result.extracted_content)
+    extracted_data = json.loads(extracted_content)
     if not extracted_data:
-        print(f"No businesss found on page {page_number}.")
+        logger.info("No businesss found on page", extra={"page": page_number})
         return [], False
 
     # After parsing extracted content
-    print("Extracted data:", extracted_data)
+    logger.debug("Extracted data", extra={"page": page_number, "items": len(extracted_data)})
 
     # Process businesss
     all_businesses = []
     for business in extracted_data:
-        # Debugging: Print each business to understand its structure
-        print("Processing business:", business)
+        # Debugging: log each business to understand its structure
+        logger.debug("Processing business", extra={"business": business})
 
         # Ignore the 'error' key if it's False
         if business.get("error") is False:
             business.pop("error", None)  # Remove the 'error' key if it's False
 
-        if is_duplicated(business["name"], seen_names):
-            print(f"Duplicate business '{business['name']}' found. Skipping.")
+        if seen_names is not None and _is_duplicate(business, seen_names):
             continue  # Skip duplicate businesss
 
         # Add business to the list
-        seen_names.add(business["name"])
         all_businesses.append(business)
 
     if not all_businesses:
-        print(f"No complete businesss found on page {page_number}.")
+        logger.info("No complete businesss found on page", extra={"page": page_number})
         return [], False
 
-    print(f"Extracted {len(all_businesses)} businesss from page {page_number}.")
+    logger.info("Extracted businesss from page", extra={"page": page_number, "businesses": len(all_businesses)})
     return all_businesses, False  # Continue crawling
+
+
+async def crawl_search_results(
+    base_url: str,
+    css_selector: str,
+    llm_strategy: Union[LLMExtractionStrategy, BatchedLLMExtraction],
+    max_pages: int = MAX_PAGES,
+    concurrency: int = CATEGORY_CRAWL_CONCURRENCY,
+    deduplicator: ProductDeduplicator = None,
+    browser_profile: str = None,
+) -> List[dict]:
+    """
+    Crawls the result pages of a category or search concurrently.
+
+    Up to `concurrency` pages are fetched at the same time. Once a page shows the
+    "No Results Found" message, pages after it that are still in flight are
+    cancelled and no further pages are started.
+
+    Args:
+        base_url (str): The results URL with a {page_number} placeholder.
+        css_selector (str): The CSS selector to target the content.
+        llm_strategy (LLMExtractionStrategy | BatchedLLMExtraction): The LLM extraction strategy.
+        max_pages (int): Maximum number of pages to crawl.
+        concurrency (int): Maximum number of pages fetched at the same time.
+        deduplicator (ProductDeduplicator): Shared duplicate detection, e.g. a persistent one
+            reused across crawls. A bounded in-memory one is used by default.
+        browser_profile (str, optional): Name of the browser profile, the configured default if not given.
+
+    Returns:
+        List[dict]: The products found, in page order, without duplicates.
+    """
+    # Imported here because the browser pool imports get_browser_config from this module
+    from src.browser_pool import get_browser_pool
+
+    profile = get_browser_profile(browser_profile)
+
+    seen_names = deduplicator or ProductDeduplicator()
+    semaphore = asyncio.Semaphore(concurrency)
+    terminal_page = None
+    tasks = {}
+
+    async with get_browser_pool(profile.name).lease() as lease:
+        async def crawl_page(page_number: int) -> List[dict]:
+            nonlocal terminal_page
+            async with semaphore:
+                if terminal_page is not None and page_number > terminal_page:
+                    return []
+
+                # Duplicates are dropped once every page is in, so the first listing in page order is kept
+                businesses, no_results = await fetch_and_process_page(
+                    lease.crawler, page_number, base_url, css_selector, llm_strategy,
+                    lease.session(f"_page_{page_number}"), None, profile,
+                )
+
+                if no_results:
+                    logger.info("No more results, stopping crawl", extra={"last_page": page_number - 1})
+                    if terminal_page is None or page_number < terminal_page:
+                        terminal_page = page_number
+                    # Stop pages past the end that are already in flight
+                    for other_page, task in tasks.items():
+                        if other_page > page_number:
+                            task.cancel()
+                return businesses
+
+        for page_number in range(1, max_pages + 1):
+            tasks[page_number] = asyncio.create_task(crawl_page(page_number))
+
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    all_businesses = []
+    for page_number, result in zip(tasks, results):
+        if isinstance(result, asyncio.CancelledError):
+            continue
+        if isinstance(result, Exception):
+            logger.error("Error crawling page", extra={"page": page_number, "error": str(result)})
+            continue
+        all_businesses.extend(business for business in result if not _is_duplicate(business, seen_names))
+
+    if deduplicator is None:
+        seen_names.close()
+
+    logger.info("Crawl finished", extra={"products": len(all_businesses), "url": base_url})
+    return all_businesses
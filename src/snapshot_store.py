@@ -0,0 +1,200 @@
+import os
+import re
+import gzip
+import hashlib
+import sqlite3
+import datetime
+import threading
+
+from config import SNAPSHOT_STORE_ENABLED, SNAPSHOT_DIR, SNAPSHOT_COMPRESSION_LEVEL, SNAPSHOT_STRIP_SCRIPTS
+from src.metrics import metrics
+
+try:
+    import zstandard
+except ImportError:  # Blobs are gzip compressed without zstandard
+    zstandard = None
+
+snapshot_writes = metrics.counter("snapshot_writes_total", "Page snapshots by whether the blob was new", ["result"])
+
+# Script and style elements except embedded JSON data, and HTML comments
+_VOLATILE_MARKUP = re.compile(
+    r"<script(?![^>]*application/(?:ld\+)?json)[^>]*>.*?</script>|<style[^>]*>.*?</style>|<!--.*?-->",
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+def strip_volatile_markup(html):
+    """Remove scripts, styles and comments, which change on every request but are never parsed."""
+    return _VOLATILE_MARKUP.sub("", html)
+
+
+class SnapshotStore:
+    """
+    Content-addressed store of fetched product pages.
+
+    Each page is stored once as a compressed blob named by the SHA-256 of its
+    content, under <directory>/objects/<first 2 hex chars>/<hash>.html.<zst|gz>,
+    so ticks that return the same markup share a blob. An SQLite index records
+    which product, URL and time every snapshot belongs to.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, enabled=SNAPSHOT_STORE_ENABLED,
+                 compression_level=SNAPSHOT_COMPRESSION_LEVEL, strip_scripts=SNAPSHOT_STRIP_SCRIPTS):
+        self.directory = directory
+        self.enabled = enabled
+        self.compression_level = compression_level
+        self.strip_scripts = strip_scripts
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened lazily so importing the module does not touch the disk
+        if self._connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"), check_same_thread=False
+            )
+            self._connection.executescript(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "id INTEGER PRIMARY KEY, product_id TEXT, url TEXT, timestamp TEXT, "
+                "content_hash TEXT, fetch_path TEXT);"
+                "CREATE INDEX IF NOT EXISTS snapshots_product_timestamp ON snapshots (product_id, timestamp);"
+                "CREATE INDEX IF NOT EXISTS snapshots_timestamp ON snapshots (timestamp);"
+            )
+        return self._connection
+
+    def _blob_path(self, content_hash, extension):
+        return os.path.join(self.directory, "objects", content_hash[:2], f"{content_hash}.html.{extension}")
+
+    def _compress(self, data):
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=self.compression_level).compress(data), "zst"
+        return gzip.compress(data, compresslevel=self.compression_level), "gz"
+
+    def save(self, html, product_id, url, timestamp, fetch_path=None):
+        """
+        Store a fetched page and record the snapshot.
+
+        Args:
+            html (str): The page HTML
+            product_id (str): Product key the page belongs to
+            url (str): The fetched URL
+            timestamp (datetime): When the page was checked, matching the price record
+            fetch_path (str, optional): "http" or "browser"
+
+        Returns:
+            str: The content hash, which names the blob
+        """
+        if self.strip_scripts:
+            html = strip_volatile_markup(html)
+        data = html.encode("utf-8", errors="replace")
+        content_hash = hashlib.sha256(data).hexdigest()
+
+        with metrics.time_stage("snapshot_write"):
+            if self.find_blob(content_hash) is None:
+                blob, extension = self._compress(data)
+                path = self._blob_path(content_hash, extension)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Written under a unique name and renamed, so readers never see a partial blob
+                temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporary_path, mode="wb") as file:
+                    file.write(blob)
+                os.replace(temporary_path, path)
+                snapshot_writes.inc(result="new")
+            else:
+                snapshot_writes.inc(result="deduplicated")
+
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT INTO snapshots (product_id, url, timestamp, content_hash, fetch_path) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (product_id, url, timestamp.isoformat(), content_hash, fetch_path),
+                )
+                connection.commit()
+        return content_hash
+
+    def find_blob(self, content_hash):
+        """Return the path of a stored blob, or None if it is not stored."""
+        for extension in ("zst", "gz"):
+            path = self._blob_path(content_hash, extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def load(self, content_hash):
+        """
+        Read a stored page.
+
+        Returns:
+            str: The page HTML, or None if the blob is missing
+        """
+        path = self.find_blob(content_hash)
+        if path is None:
+            return None
+        with open(path, mode="rb") as file:
+            blob = file.read()
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is needed to read {path}")
+            data = zstandard.ZstdDecompressor().decompress(blob)
+        else:
+            data = gzip.decompress(blob)
+        return data.decode("utf-8")
+
+    def list_snapshots(self, product_id=None, start=None, end=None):
+        """
+        List recorded snapshots, oldest first.
+
+        Args:
+            product_id (str, optional): Only snapshots of this product
+            start (datetime, optional): Only snapshots at or after this time
+            end (datetime, optional): Only snapshots before this time
+
+        Returns:
+            list: Dicts with product_id, url, timestamp (datetime), content_hash and fetch_path
+        """
+        query = "SELECT product_id, url, timestamp, content_hash, fetch_path FROM snapshots WHERE 1 = 1"
+        parameters = []
+        if product_id is not None:
+            query += " AND product_id = ?"
+            parameters.append(product_id)
+        if start is not None:
+            query += " AND timestamp >= ?"
+            parameters.append(start.isoformat())
+        if end is not None:
+            query += " AND timestamp < ?"
+            parameters.append(end.isoformat())
+        query += " ORDER BY timestamp"
+
+        with self._lock:
+            rows = self._connect().execute(query, parameters).fetchall()
+        return [
+            {
+                "product_id": row[0],
+                "url": row[1],
+                "timestamp": datetime.datetime.fromisoformat(row[2]),
+                "content_hash": row[3],
+                "fetch_path": row[4],
+            }
+            for row in rows
+        ]
+
+    def stats(self):
+        """Return the number of snapshots and of distinct blobs."""
+        with self._lock:
+            snapshots, blobs = self._connect().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT content_hash) FROM snapshots"
+            ).fetchone()
+        return {"snapshots": snapshots, "blobs": blobs}
+
+    def close(self):
+        """Close the snapshot index."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Create a singleton instance
+snapshot_store = SnapshotStore()
@@ -1,12 +1,88 @@
+import re
 import csv
-from pydantic import BaseModel
+import logging
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:  # Only for the annotation; pydantic is not needed to parse product references
+    from pydantic import BaseModel
+
+from config import DEFAULT_MARKETPLACE
+
+logger = logging.getLogger(__name__)
+
+# ASINs are 10 characters, upper-case letters and digits
+ASIN_PATTERN = re.compile(r"^[A-Z0-9]{10}$")
+ASIN_IN_URL_PATTERN = re.compile(r"/(?:dp|gp/product|gp/aw/d|product-reviews)/([A-Z0-9]{10})(?:[/?#]|$)")
+
+
+def extract_asin(url: str):
+    """
+    Extract the ASIN from an Amazon product URL.
+
+    Returns:
+        str: The ASIN, or None if the URL does not contain one.
+    """
+    match = ASIN_IN_URL_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def make_product_id(asin: str, marketplace: str = DEFAULT_MARKETPLACE) -> str:
+    """Build the product key used across storage and analysis: '<marketplace>:<ASIN>'."""
+    return f"{marketplace}:{asin}"
+
+
+def split_product_id(product_id: str):
+    """
+    Split a product key back into its marketplace and ASIN.
+
+    The ASIN never contains a colon, but the marketplace may, e.g. a host with a port.
+
+    Returns:
+        tuple: (marketplace, asin), or (None, None) if product_id is not set
+    """
+    if not product_id:
+        return None, None
+    marketplace, _, asin = product_id.rpartition(":")
+    return marketplace, asin
+
+
+def parse_product_ref(value: str, marketplace: str = DEFAULT_MARKETPLACE) -> dict:
+    """
+    Resolve a watchlist entry (a product URL or a bare ASIN) into its product key.
+
+    Args:
+        value (str): Product URL or ASIN
+        marketplace (str): Marketplace used when value is a bare ASIN
+
+    Returns:
+        dict: 'product_id', 'asin', 'marketplace' and 'url' of the product
+    """
+    value = value.strip()
+    if ASIN_PATTERN.match(value):
+        asin = value
+        url = f"https://www.{marketplace}/dp/{asin}"
+    else:
+        url = value
+        host = urlparse(url).netloc.lower()
+        marketplace = host[4:] if host.startswith("www.") else host or marketplace
+        # Fall back to the full URL as key for pages without an ASIN
+        asin = extract_asin(url) or url
+
+    return {
+        "product_id": make_product_id(asin, marketplace),
+        "asin": asin,
+        "marketplace": marketplace,
+        "url": url,
+    }
+
 
 def is_duplicated(record: str, seen_names: set) -> bool:
     return record in seen_names
 
-def save_data_to_csv(records: list, data_struct: BaseModel, filename: str):
+def save_data_to_csv(records: list, data_struct: "BaseModel", filename: str):
     if not records:
-        print("No records to save.")
+        logger.info("No records to save")
         return
 
     # Use field names from the Pydantic data model
@@ -16,4 +92,4 @@ def save_data_to_csv(records: list, data_struct: BaseModel, filename: str):
         writer = csv.DictWriter(file, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(records)
-    print(f"Saved {len(records)} records to '{filename}'.")
+    logger.info("Saved records", extra={"records": len(records), "path": filename})
@@ -0,0 +1,345 @@
+import time
+import logging
+import sqlite3
+import datetime
+import threading
+
+from config import (
+    WORK_QUEUE_BACKEND, WORK_QUEUE_LOCAL_PATH, WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_RETRY_DELAY,
+    WORK_QUEUE_MAX_ATTEMPTS
+)
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+work_queue_operations = metrics.counter(
+    "work_queue_operations_total", "Work queue operations by kind and result", ["operation", "result"]
+)
+
+# Fields of a queued product check, as returned by claim()
+ITEM_FIELDS = (
+    "product_id", "url", "asin", "marketplace", "browser_profile", "interval", "attempts", "last_worker",
+)
+
+
+def retry_schedule(attempts, interval, retry_delay=WORK_QUEUE_RETRY_DELAY, max_attempts=WORK_QUEUE_MAX_ATTEMPTS):
+    """
+    Decide when a failed check is tried again.
+
+    Returns:
+        tuple: (seconds until the retry, whether the check gave up and waits for its regular interval)
+    """
+    if attempts >= max_attempts:
+        return interval, True
+    return min(retry_delay * 2 ** max(attempts - 1, 0), max(interval, retry_delay)), False
+
+
+def _utcnow():
+    # Naive UTC, which is what pymongo returns for stored datetimes
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class MongoWorkQueue:
+    """
+    Shared queue of product checks in a MongoDB collection, one document per product.
+
+    Workers claim the most overdue product with an atomic find_one_and_update
+    that also sets a lease, so no two workers check the same product at the same
+    time. Leases are renewed while the check runs and released when it finishes;
+    a lease that expires because its worker died makes the product claimable
+    again. Lease times come from each host's clock, so hosts must keep it in sync.
+    """
+
+    def __init__(self, handler=None, lease_seconds=WORK_QUEUE_LEASE_SECONDS):
+        from src.mongodb_handler import mongodb_handler
+
+        self.handler = handler or mongodb_handler
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from pymongo import ASCENDING
+            from src.mongodb_handler import WORK_QUEUE_COLLECTION_NAME
+
+            if not self.handler.is_connected and not self.handler.connect():
+                raise ConnectionError("MongoDB is not reachable for the work queue")
+            self._collection = self.handler.db[WORK_QUEUE_COLLECTION_NAME]
+            # Claims look for the most overdue product whose lease is free or expired
+            self._collection.create_index([("next_due", ASCENDING), ("lease_expires", ASCENDING)], name="next_due_lease")
+        return self._collection
+
+    def sync_products(self, products, prune=False):
+        """
+        Add watchlist products to the queue and update the settings of queued ones.
+
+        Args:
+            products (list): WatchedProduct entries
+            prune (bool): If True, remove queued products that are not in the list
+
+        Returns:
+            int: Number of products added
+        """
+        now = _utcnow()
+        added = 0
+        for product in products:
+            result = self.collection.update_one(
+                {"_id": product.product_id},
+                {
+                    "$set": {
+                        "url": product.url, "asin": product.asin, "marketplace": product.marketplace,
+                        "browser_profile": product.browser_profile,
+                    },
+                    "$setOnInsert": {
+                        "interval": product.interval, "next_due": now, "lease_owner": None, "lease_expires": None,
+                        "attempts": 0, "last_worker": None,
+                    },
+                },
+                upsert=True,
+            )
+            added += result.upserted_id is not None
+        if prune:
+            self.collection.delete_many({"_id": {"$nin": [product.product_id for product in products]}})
+        return added
+
+    def claim(self, worker_id):
+        """
+        Lease the most overdue product that no live worker holds.
+
+        Returns:
+            dict: The queued check (see ITEM_FIELDS), or None if nothing is due
+        """
+        from pymongo import ASCENDING, ReturnDocument
+
+        now = _utcnow()
+        document = self.collection.find_one_and_update(
+            {"next_due": {"$lte": now}, "$or": [{"lease_expires": None}, {"lease_expires": {"$lte": now}}]},
+            {"$set": {"lease_owner": worker_id, "lease_expires": now + self.lease}, "$inc": {"attempts": 1}},
+            sort=[("next_due", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        work_queue_operations.inc(operation="claim", result="claimed" if document else "empty")
+        if document is None:
+            return None
+        document["product_id"] = document["_id"]
+        return {field: document.get(field) for field in ITEM_FIELDS}
+
+    def heartbeat(self, product_id, worker_id):
+        """
+        Extend a lease the worker still holds.
+
+        Returns:
+            bool: False if the lease expired and was taken over by another worker
+        """
+        result = self.collection.update_one(
+            {"_id": product_id, "lease_owner": worker_id},
+            {"$set": {"lease_expires": _utcnow() + self.lease}},
+        )
+        held = result.matched_count == 1
+        work_queue_operations.inc(operation="heartbeat", result="renewed" if held else "lost")
+        return held
+
+    def complete(self, product_id, worker_id, next_interval, interval):
+        """
+        Release a lease after a successful check and schedule the next one.
+
+        Args:
+            product_id (str): The checked product
+            worker_id (str): The worker holding the lease
+            next_interval (float): Seconds until the next check
+            interval (float): The product's base interval, kept for the next worker that claims it
+        """
+        result = self.collection.update_one(
+            {"_id": product_id, "lease_owner": worker_id},
+            {"$set": {
+                "next_due": _utcnow() + datetime.timedelta(seconds=next_interval), "interval": interval,
+                "lease_owner": None, "lease_expires": None, "attempts": 0, "last_worker": worker_id,
+                "last_error": None,
+            }},
+        )
+        work_queue_operations.inc(operation="complete", result="released" if result.matched_count else "lost")
+
+    def fail(self, product_id, worker_id, attempts, interval, error):
+        """Release a lease after a failed check and schedule a retry with exponential backoff."""
+        delay, gave_up = retry_schedule(attempts, interval)
+        update = {
+            "next_due": _utcnow() + datetime.timedelta(seconds=delay), "lease_owner": None,
+            "lease_expires": None, "last_worker": worker_id, "last_error": str(error)[:500],
+        }
+        if gave_up:
+            update["attempts"] = 0
+        result = self.collection.update_one({"_id": product_id, "lease_owner": worker_id}, {"$set": update})
+        work_queue_operations.inc(operation="fail", result="released" if result.matched_count else "lost")
+        return delay, gave_up
+
+    def stats(self):
+        """Return the number of queued, due and leased products."""
+        now = _utcnow()
+        return {
+            "queued": self.collection.count_documents({}),
+            "due": self.collection.count_documents({"next_due": {"$lte": now}}),
+            "leased": self.collection.count_documents({"lease_expires": {"$gt": now}}),
+        }
+
+    def close(self):
+        self._collection = None
+
+
+class LocalWorkQueue:
+    """
+    Stand-in for MongoWorkQueue in an SQLite file, shared by the worker processes of one host.
+
+    Claims run in an immediate transaction, which takes the database write lock,
+    so a product is leased to only one process at a time.
+    """
+
+    def __init__(self, path=WORK_QUEUE_LOCAL_PATH, lease_seconds=WORK_QUEUE_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            # Autocommit mode, so transactions are explicit
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS work_queue ("
+                "product_id TEXT PRIMARY KEY, url TEXT, asin TEXT, marketplace TEXT, browser_profile TEXT, "
+                "interval REAL, next_due REAL, lease_owner TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, "
+                "last_worker TEXT, last_error TEXT)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS work_queue_next_due ON work_queue (next_due)")
+        return self._connection
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._connect().execute(query, parameters)
+
+    def sync_products(self, products, prune=False):
+        """See MongoWorkQueue.sync_products."""
+        now = time.time()
+        added = 0
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for product in products:
+                    cursor = connection.execute(
+                        "UPDATE work_queue SET url = ?, asin = ?, marketplace = ?, browser_profile = ? "
+                        "WHERE product_id = ?",
+                        (product.url, product.asin, product.marketplace, product.browser_profile, product.product_id),
+                    )
+                    if cursor.rowcount == 0:
+                        connection.execute(
+                            "INSERT INTO work_queue (product_id, url, asin, marketplace, browser_profile, interval, "
+                            "next_due) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (product.product_id, product.url, product.asin, product.marketplace,
+                             product.browser_profile, product.interval, now),
+                        )
+                        added += 1
+                if prune:
+                    ids = [product.product_id for product in products]
+                    connection.execute(
+                        f"DELETE FROM work_queue WHERE product_id NOT IN ({','.join('?' * len(ids))})", ids
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return added
+
+    def claim(self, worker_id):
+        """See MongoWorkQueue.claim."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    f"SELECT {', '.join(ITEM_FIELDS)} FROM work_queue "
+                    "WHERE next_due <= ? AND (lease_expires IS NULL OR lease_expires <= ?) "
+                    "ORDER BY next_due LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE work_queue SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                        "WHERE product_id = ?",
+                        (worker_id, now + self.lease_seconds, row[0]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        work_queue_operations.inc(operation="claim", result="claimed" if row else "empty")
+        if row is None:
+            return None
+        item = dict(zip(ITEM_FIELDS, row))
+        item["attempts"] += 1
+        return item
+
+    def heartbeat(self, product_id, worker_id):
+        """See MongoWorkQueue.heartbeat."""
+        cursor = self._execute(
+            "UPDATE work_queue SET lease_expires = ? WHERE product_id = ? AND lease_owner = ?",
+            (time.time() + self.lease_seconds, product_id, worker_id),
+        )
+        held = cursor.rowcount == 1
+        work_queue_operations.inc(operation="heartbeat", result="renewed" if held else "lost")
+        return held
+
+    def complete(self, product_id, worker_id, next_interval, interval):
+        """See MongoWorkQueue.complete."""
+        cursor = self._execute(
+            "UPDATE work_queue SET next_due = ?, interval = ?, lease_owner = NULL, lease_expires = NULL, "
+            "attempts = 0, last_worker = ?, last_error = NULL WHERE product_id = ? AND lease_owner = ?",
+            (time.time() + next_interval, interval, worker_id, product_id, worker_id),
+        )
+        work_queue_operations.inc(operation="complete", result="released" if cursor.rowcount else "lost")
+
+    def fail(self, product_id, worker_id, attempts, interval, error):
+        """See MongoWorkQueue.fail."""
+        delay, gave_up = retry_schedule(attempts, interval)
+        cursor = self._execute(
+            "UPDATE work_queue SET next_due = ?, lease_owner = NULL, lease_expires = NULL, last_worker = ?, "
+            "last_error = ?, attempts = CASE WHEN ? THEN 0 ELSE attempts END "
+            "WHERE product_id = ? AND lease_owner = ?",
+            (time.time() + delay, worker_id, str(error)[:500], gave_up, product_id, worker_id),
+        )
+        work_queue_operations.inc(operation="fail", result="released" if cursor.rowcount else "lost")
+        return delay, gave_up
+
+    def stats(self):
+        """See MongoWorkQueue.stats."""
+        now = time.time()
+        queued, due, leased = self._execute(
+            "SELECT COUNT(*), COALESCE(SUM(next_due <= ?), 0), COALESCE(SUM(lease_expires > ?), 0) FROM work_queue",
+            (now, now),
+        ).fetchone()
+        return {"queued": queued, "due": due, "leased": leased}
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def get_work_queue(backend=WORK_QUEUE_BACKEND):
+    """
+    Create the work queue for a backend.
+
+    Args:
+        backend (str): "mongodb" or "local"
+
+    Returns:
+        MongoWorkQueue or LocalWorkQueue
+    """
+    if backend == "mongodb":
+        return MongoWorkQueue()
+    if backend == "local":
+        return LocalWorkQueue()
+    raise ValueError(f"Unknown work queue backend '{backend}', expected 'mongodb' or 'local'")
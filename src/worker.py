@@ -0,0 +1,177 @@
+import os
+import socket
+import asyncio
+import logging
+
+from config import (
+    TRACKER_CONCURRENCY, WORK_QUEUE_HEARTBEAT_INTERVAL, WORK_QUEUE_POLL_INTERVAL, COORDINATOR_REFRESH_INTERVAL
+)
+from src.scheduler import WatchedProduct
+from src.price_cache import price_state_cache
+from src.change_tracker import change_tracker
+from src.alerts import alert_engine
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+worker_checks = metrics.counter("worker_checks_total", "Checks run by this worker by outcome", ["outcome"])
+
+
+def default_worker_id():
+    """Name a worker after its host and process, unique across the fleet."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TrackingWorker:
+    """
+    Claims due product checks from a shared work queue and runs them.
+
+    Up to `concurrency` checks run at once, each under a lease that a background
+    task renews every `heartbeat_interval` seconds. A finished check releases
+    its lease and schedules the product's next check with the polling policy;
+    a failed one is retried with backoff. Results are written through the usual
+    storage layer, so workers share the price history.
+    """
+
+    def __init__(self, queue, check_product, worker_id=None, concurrency=TRACKER_CONCURRENCY, policy=None,
+                 heartbeat_interval=WORK_QUEUE_HEARTBEAT_INTERVAL, poll_interval=WORK_QUEUE_POLL_INTERVAL):
+        """
+        Args:
+            queue (MongoWorkQueue or LocalWorkQueue): The shared work queue
+            check_product (callable): Coroutine function run with each claimed WatchedProduct
+            worker_id (str, optional): Name of the worker, host and process id if not given
+            concurrency (int): Maximum number of checks in flight
+            policy (AdaptivePollingPolicy, optional): Chooses each product's next interval
+            heartbeat_interval (float): Seconds between lease renewals
+            poll_interval (float): Seconds to wait before looking again when nothing is due
+        """
+        self.queue = queue
+        self.check_product = check_product
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = concurrency
+        self.policy = policy
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+
+    async def _renew_lease(self, product_id):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                held = await asyncio.to_thread(self.queue.heartbeat, product_id, self.worker_id)
+            except Exception as e:
+                logger.warning("Error renewing lease", extra={"product_id": product_id, "error": str(e)})
+                continue
+            if not held:
+                # The check still finishes, but another worker may already be repeating it
+                logger.warning("Lease lost", extra={"product_id": product_id, "worker_id": self.worker_id})
+                return
+
+    async def _process(self, item):
+        product = WatchedProduct(
+            item["product_id"], item["url"], item["interval"], item["asin"], item["marketplace"],
+            item["browser_profile"],
+        )
+        if item["last_worker"] != self.worker_id:
+            # Another worker stored the last checks, so the cached state of this product may be stale
+            price_state_cache.forget(product.product_id)
+            change_tracker.forget(product.product_id)
+            alert_engine.forget(product.product_id)
+
+        renewer = asyncio.create_task(self._renew_lease(product.product_id))
+        result, error = None, None
+        try:
+            result = await self.check_product(product)
+            error = result.get("error") if isinstance(result, dict) else None
+        except Exception as e:
+            logger.exception("Error checking product", extra={"product_id": product.product_id})
+            error = e
+        finally:
+            renewer.cancel()
+
+        if error is None:
+            next_interval = self.policy.next_interval(product, result) if self.policy else product.interval
+            await asyncio.to_thread(
+                self.queue.complete, product.product_id, self.worker_id, next_interval, product.interval
+            )
+            worker_checks.inc(outcome="success")
+        else:
+            delay, gave_up = await asyncio.to_thread(
+                self.queue.fail, product.product_id, self.worker_id, item["attempts"], product.interval, error
+            )
+            worker_checks.inc(outcome="failure")
+            logger.log(logging.ERROR if gave_up else logging.WARNING, "Check failed, retry scheduled", extra={
+                "product_id": product.product_id, "attempts": item["attempts"], "retry_in": round(delay, 1),
+                "gave_up": gave_up,
+            })
+
+    async def run(self, stop_event=None):
+        """
+        Claim and run checks until `stop_event` is set, then wait for the checks in flight.
+
+        Args:
+            stop_event (asyncio.Event, optional): Set to stop claiming new checks
+        """
+        logger.info("Worker started", extra={"worker_id": self.worker_id, "concurrency": self.concurrency})
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+
+        async def process(item):
+            try:
+                await self._process(item)
+            except Exception:
+                # Leaves the lease to expire, after which the product is claimed again
+                logger.exception("Error releasing lease", extra={"product_id": item["product_id"]})
+            finally:
+                semaphore.release()
+
+        try:
+            while stop_event is None or not stop_event.is_set():
+                await semaphore.acquire()
+                try:
+                    item = await asyncio.to_thread(self.queue.claim, self.worker_id)
+                except Exception as e:
+                    logger.error("Error claiming from the work queue", extra={"error": str(e)})
+                    item = None
+                if item is None:
+                    semaphore.release()
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                task = asyncio.create_task(process(item))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+
+async def run_coordinator(queue, load_products, refresh_interval=COORDINATOR_REFRESH_INTERVAL, stop_event=None):
+    """
+    Keep the work queue in step with the watchlist.
+
+    Args:
+        queue (MongoWorkQueue or LocalWorkQueue): The shared work queue
+        load_products (callable): Returns the current list of WatchedProduct entries
+        refresh_interval (float): Seconds between watchlist reloads
+        stop_event (asyncio.Event, optional): Set to stop the coordinator
+    """
+    while stop_event is None or not stop_event.is_set():
+        try:
+            products = await asyncio.to_thread(load_products)
+            # An empty watchlist is more likely a failed load than a request to stop tracking everything
+            added = await asyncio.to_thread(queue.sync_products, products, bool(products))
+            stats = await asyncio.to_thread(queue.stats)
+            logger.info("Work queue synced", extra={"products": len(products), "added": added, **stats})
+        except Exception as e:
+            logger.error("Error syncing the work queue", extra={"error": str(e)})
+
+        if stop_event is None:
+            await asyncio.sleep(refresh_interval)
+        else:
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=refresh_interval)
+            except asyncio.TimeoutError:
+                pass
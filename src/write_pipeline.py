@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+from config import MONGO_WRITE_QUEUE_SIZE, MONGO_WRITE_BATCH_SIZE, MONGO_WRITE_FLUSH_INTERVAL
+from src.mongodb_handler import mongodb_handler
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+mongo_documents = metrics.counter("mongo_documents_total", "Price documents written by the pipeline", ["outcome"])
+
+# Queued by close() to tell the flusher to write what it has and exit
+_STOP = object()
+# Queued by flush() to tell the flusher to write what it has without waiting for the interval
+_FLUSH = object()
+
+
+class MongoWritePipeline:
+    """
+    Batched, non-blocking writer for price documents.
+
+    Documents are put on a bounded queue and written by a background task with
+    `insert_many` once `batch_size` documents are pending or `flush_interval`
+    seconds have passed. The blocking driver call runs in a worker thread so the
+    event loop keeps serving crawls. When the queue is full `put` waits, which
+    slows producers down instead of growing memory without bound.
+    """
+
+    def __init__(self, handler=mongodb_handler, max_queue_size=MONGO_WRITE_QUEUE_SIZE,
+                 batch_size=MONGO_WRITE_BATCH_SIZE, flush_interval=MONGO_WRITE_FLUSH_INTERVAL):
+        self.handler = handler
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self._queue = None
+        self._flusher = None
+
+    @property
+    def queue_depth(self):
+        """Number of documents waiting to be written."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the background flusher if it is not running yet."""
+        if self._flusher is None or self._flusher.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._flusher = asyncio.create_task(self._run())
+
+    async def put(self, document):
+        """Queue a document for writing, waiting while the queue is full."""
+        self.start()
+        await self._queue.put(document)
+
+    async def _collect_batch(self):
+        """
+        Wait for the first document, then gather more until the batch is full or the interval ends.
+
+        Every document and marker taken from the queue is marked done once the
+        batch has been written, so flush() can wait for the queue to drain.
+
+        Returns:
+            tuple: (batch, stop) - the documents to write and whether shutdown was requested
+        """
+        document = await self._queue.get()
+        if document is _STOP or document is _FLUSH:
+            self._queue.task_done()
+            return [], document is _STOP
+
+        batch = [document]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                document = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            if document is _STOP or document is _FLUSH:
+                self._queue.task_done()
+                return batch, document is _STOP
+            batch.append(document)
+        return batch, False
+
+    async def _run(self):
+        while True:
+            batch, stop = await self._collect_batch()
+            if batch:
+                try:
+                    inserted = await asyncio.to_thread(self.handler.insert_many_price_data, batch)
+                    self.written += inserted
+                    self.failed += len(batch) - inserted
+                    mongo_documents.inc(inserted, outcome="written")
+                    mongo_documents.inc(len(batch) - inserted, outcome="failed")
+                except Exception as e:
+                    self.failed += len(batch)
+                    mongo_documents.inc(len(batch), outcome="failed")
+                    logger.error("Error flushing documents to MongoDB", extra={"documents": len(batch), "error": str(e)})
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    async def flush(self):
+        """Write every pending document now and wait until they are written, keeping the flusher running."""
+        if self._flusher is None or self._flusher.done():
+            return
+
+        # The flush marker is queued behind pending documents and ends the batch being collected
+        await self._queue.put(_FLUSH)
+        await self._queue.join()
+
+    async def close(self):
+        """Write every pending document and stop the background flusher."""
+        if self._flusher is None:
+            return
+
+        if not self._flusher.done():
+            # The stop marker is queued behind pending documents, so they are all flushed first
+            await self._queue.put(_STOP)
+            await self._flusher
+        self._flusher = None
+
+
+# Create a singleton instance
+mongo_write_pipeline = MongoWritePipeline()
+
+metrics.gauge(
+    "mongo_write_queue_depth", "Price documents waiting to be written to MongoDB",
+    function=lambda: mongo_write_pipeline.queue_depth,
+)